@@ -1,20 +1,76 @@
 import os
+import hashlib
+import json
+import logging
+import math
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 from datetime import datetime
-from math import radians, cos, sin, asin, sqrt
+from bisect import bisect_right
 from dotenv import load_dotenv
 import xml.etree.ElementTree as ET
 
+from geocache import CacheGeocodificacao, AUSENTE
+from cotacao_cache import CacheCotacao, impressao_carrinho
+from geo_resolver import NAO_ENCONTRADO, ResolvedorGeo, tem_coordenadas
+from cep_index import carregar_indice
+from municipios import carregar_municipios
+from estoque_cache import CacheEstoque
+from cliente_http import ClienteUpstream, PRAZO_MINIMO_CHAMADA
+from motor_frete import MotorFrete, AJUSTE_RODOVIARIO
+from distancias_rodoviarias import carregar_matriz, distancia_reta
+from divisao_envio import otimizar_divisao
+from tabela_setores import assinatura_config, carregar_tabela
+from registro_cds import ConfigCDs, FonteCDs
+from tabela_frete import FonteTabelaFrete
+from carrinho import Carrinho, CarrinhoExcedido, parse_produtos
+from logs import configurar_logs
+from metricas import Metricas, exportar_valores
+from prazo import Prazo
+from saude import MonitorSaude
+from memoria import resumo_memoria, uso_memoria
+from respostas import RespostaPronta
+from xml_resposta import EscritorXML, xml_simples
+
 # =============================================================================
 # BOOT / ENV
 # =============================================================================
+BOOT_INICIO = time.perf_counter()
 load_dotenv()
 
+# LOG_NIVEL=DEBUG mostra o passo a passo de cada cotação; LOG_JSON=true põe tudo em JSON
+configurar_logs(os.getenv('LOG_NIVEL', 'INFO').upper(), os.getenv('LOG_JSON', 'False').lower() == 'true')
+log_geo = logging.getLogger('geo')
+log_tray = logging.getLogger('tray')
+log_cd = logging.getLogger('cd')
+log_calc = logging.getLogger('calc')
+log_parse = logging.getLogger('parse')
+log_lote = logging.getLogger('lote')
+log_frete = logging.getLogger('frete')
+log_cotacao = logging.getLogger('cotacao')
+
 app = Flask(__name__)
 CORS(app)
 
+# =============================================================================
+# MÉTRICAS (/metrics)
+# =============================================================================
+METRICAS = Metricas()
+M_ETAPAS = METRICAS.histograma(
+    'frete_etapa_segundos', 'Duração de cada etapa da cotação', ('etapa',))
+M_COTACOES = METRICAS.histograma(
+    'frete_cotacao_segundos', 'Duração total da cotação por status HTTP', ('status',))
+M_UPSTREAMS = METRICAS.histograma(
+    'frete_upstream_segundos', 'Latência das chamadas aos upstreams', ('upstream', 'resultado'))
+M_EVENTOS = METRICAS.contador(
+    'frete_eventos_total', 'Desfechos relevantes da cotação', ('evento',))
+
+def _observar_upstream(nome, latencia, sucesso):
+    M_UPSTREAMS.observar(latencia, nome, 'ok' if sucesso else 'erro')
+
 # =============================================================================
 # CONFIG
 # =============================================================================
@@ -23,62 +79,200 @@ DEFAULT_VALOR_KM = float(os.getenv('DEFAULT_VALOR_KM', 7.0))
 TRAY_API_URL = os.getenv('TRAY_API_URL', '')
 TRAY_API_TOKEN = os.getenv('TRAY_API_TOKEN', '')
 HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '5.0'))
+BRASILAPI_URL = os.getenv('BRASILAPI_URL', 'https://brasilapi.com.br/api/cep/v2')
+VIACEP_URL = os.getenv('VIACEP_URL', 'https://viacep.com.br/ws')
+
+# Geocodificação: provedores em ordem de preferência; o próximo é disparado em
+# paralelo se o anterior não responder em GEO_HEDGE_ATRASO segundos (0 = corrida)
+GEO_PROVEDORES = [p.strip() for p in os.getenv('GEO_PROVEDORES', 'brasilapi,viacep').split(',') if p.strip()]
+GEO_HEDGE_ATRASO = float(os.getenv('GEO_HEDGE_ATRASO', 0.15))
+GEO_ORDEM_ADAPTATIVA = os.getenv('GEO_ORDEM_ADAPTATIVA', 'True').lower() == 'true'
+GEO_PROVEDORES_WORKERS = int(os.getenv('GEO_PROVEDORES_WORKERS', 16))
+
+# Clientes HTTP: pool keep-alive por upstream, retry com jitter e circuit breaker
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', min(HTTP_TIMEOUT, 2.0)))
+HTTP_POOL_MAX = int(os.getenv('HTTP_POOL_MAX', 10))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 1))
+CIRCUITO_LIMITE_FALHAS = int(os.getenv('CIRCUITO_LIMITE_FALHAS', 5))
+CIRCUITO_RESFRIAMENTO = float(os.getenv('CIRCUITO_RESFRIAMENTO', 30))
+
+# Sondagem dos upstreams em background para /health (0 desliga)
+SAUDE_INTERVALO = float(os.getenv('SAUDE_INTERVALO', 30))
+SAUDE_TIMEOUT = float(os.getenv('SAUDE_TIMEOUT', 3.0))
+SAUDE_CEP = os.getenv('SAUDE_CEP', '01001000')
+
+# Prazo total de uma cotação do /frete (abaixo do timeout da Tray para cotação);
+# esgotado, degrada: coordenadas da capital, CD mais próximo, assume estoque
+FRETE_DEADLINE = float(os.getenv('FRETE_DEADLINE', 4.0))
+
+# Consulta de estoque: buscas paralelas na Tray com prazo total
+TRAY_MAX_WORKERS = int(os.getenv('TRAY_MAX_WORKERS', 8))
+TRAY_ESTOQUE_DEADLINE = float(os.getenv('TRAY_ESTOQUE_DEADLINE', HTTP_TIMEOUT))
+
+# Cache de estoque (referência -> stock_<CD>), servido vencido enquanto atualiza
+ESTOQUE_CACHE_TTL = float(os.getenv('ESTOQUE_CACHE_TTL', 60))              # 1 minuto
+ESTOQUE_CACHE_TTL_STALE = float(os.getenv('ESTOQUE_CACHE_TTL_STALE', 900))  # +15 minutos
+ESTOQUE_CACHE_MAX = int(os.getenv('ESTOQUE_CACHE_MAX', 50000))
+# Reaquecimento periódico do catálogo inteiro (0 = desligado)
+ESTOQUE_AQUECIMENTO_INTERVALO = float(os.getenv('ESTOQUE_AQUECIMENTO_INTERVALO', 0))
+TRAY_PAGINA_LIMITE = int(os.getenv('TRAY_PAGINA_LIMITE', 50))
+
+# Tabela de frete (planilha) e seu cache convertido; recarrega quando muda
+TABELA_FRETE_PATH = os.getenv('TABELA_FRETE_PATH', 'tabela de frete atualizada(2)(Recuperado Automaticamente).xlsx')
+TABELA_FRETE_CACHE = os.getenv('TABELA_FRETE_CACHE', 'tabela_frete.cache.json')
+TABELA_FRETE_INTERVALO = float(os.getenv('TABELA_FRETE_INTERVALO', 10))
+# Referência da Tray -> nome do produto na planilha ({"SKU": "Cisterna TC 5.000 l"})
+TABELA_FRETE_SKUS = os.getenv('TABELA_FRETE_SKUS', 'tabela_frete_skus.json')
+# true: peças fora do cadastro usam as medidas da Tray (senão, fórmula padrão)
+TABELA_FRETE_MEDIDAS = os.getenv('TABELA_FRETE_MEDIDAS', 'False').lower() == 'true'
+
+TABELA_FRETE = FonteTabelaFrete(TABELA_FRETE_PATH, TABELA_FRETE_CACHE, TABELA_FRETE_INTERVALO,
+                                TABELA_FRETE_SKUS, TABELA_FRETE_MEDIDAS)
+TABELA_FRETE.atual()
+
+# Limites do parâmetro prods (itens e tamanho), contra payload gigante/malicioso
+PRODS_MAX_LINHAS = int(os.getenv('PRODS_MAX_LINHAS', 2000))
+PRODS_MAX_BYTES = int(os.getenv('PRODS_MAX_BYTES', 256 * 1024))
+
+# Sem CD com o carrinho inteiro, divide entre até N CDs (1 = não divide)
+DIVISAO_MAX_CDS = int(os.getenv('DIVISAO_MAX_CDS', 3))
+# A divisão só considera os N CDs mais próximos com estoque de algum item
+DIVISAO_CANDIDATOS = int(os.getenv('DIVISAO_CANDIDATOS', 8))
+
+# Opções devolvidas no XML: cada serviço (codigo:nome:fator de valor:fator de prazo)
+# para o melhor CD e até FRETE_OPCOES_CDS - 1 CDs alternativos com estoque.
+# Padrão: só o serviço de sempre; outros níveis entram pela variável, ex.
+# FRETE_SERVICOS="economico:Econômico:1.0:1.0,expresso:Expresso:1.6:0.5"
+def ler_servicos(texto):
+    """
+    Lista de (codigo, nome, fator de valor, fator de prazo) de FRETE_SERVICOS
+    O nome pode ter ':' (código é o primeiro campo, fatores os dois últimos);
+    levanta ValueError apontando a entrada inválida
+    """
+    servicos = []
+    for entrada in texto.split(','):
+        if not entrada.strip():
+            continue
+        partes = entrada.split(':')
+        if len(partes) < 4:
+            raise ValueError(f"FRETE_SERVICOS: '{entrada}' deve ser codigo:nome:fator de valor:fator de prazo")
+        codigo, nome = partes[0].strip(), ':'.join(partes[1:-2]).strip()
+        try:
+            fator_valor, fator_prazo = float(partes[-2]), float(partes[-1])
+        except ValueError:
+            raise ValueError(f"FRETE_SERVICOS: fatores não numéricos em '{entrada}'") from None
+        if not codigo or not nome:
+            raise ValueError(f"FRETE_SERVICOS: código e nome obrigatórios em '{entrada}'")
+        if not (0 < fator_valor < math.inf and 0 < fator_prazo < math.inf):
+            raise ValueError(f"FRETE_SERVICOS: fatores devem ser positivos em '{entrada}'")
+        if any(codigo == s[0] for s in servicos):
+            raise ValueError(f"FRETE_SERVICOS: código '{codigo}' repetido")
+        servicos.append((codigo, nome, fator_valor, fator_prazo))
+    if not servicos:
+        raise ValueError("FRETE_SERVICOS: nenhum serviço configurado")
+    return servicos
+
+FRETE_SERVICOS = ler_servicos(os.getenv('FRETE_SERVICOS', 'economico:Econômico:1.0:1.0'))
+FRETE_OPCOES_CDS = int(os.getenv('FRETE_OPCOES_CDS', 2))
+
+# Cotação em lote (/frete/batch)
+LOTE_MAX_ITENS = int(os.getenv('LOTE_MAX_ITENS', 20000))
+LOTE_GEO_WORKERS = int(os.getenv('LOTE_GEO_WORKERS', 8))
+LOTE_ESTOQUE_DEADLINE = float(os.getenv('LOTE_ESTOQUE_DEADLINE', 60))
+# Entradas por bloco: cada bloco é cotado e enviado antes do próximo
+LOTE_BLOCO = int(os.getenv('LOTE_BLOCO', 500))
+
+# Cache de geocodificação (CEP -> coordenadas)
+GEO_CACHE_PATH = os.getenv('GEO_CACHE_PATH', 'geocache.sqlite3')
+GEO_CACHE_TTL = float(os.getenv('GEO_CACHE_TTL', 30 * 24 * 3600))          # 30 dias
+GEO_CACHE_TTL_NEGATIVO = float(os.getenv('GEO_CACHE_TTL_NEGATIVO', 3600))  # 1 hora
+GEO_CACHE_MAX_MEMORIA = int(os.getenv('GEO_CACHE_MAX_MEMORIA', 20000))
+
+GEO_CACHE = CacheGeocodificacao(
+    GEO_CACHE_PATH,
+    ttl=GEO_CACHE_TTL,
+    ttl_negativo=GEO_CACHE_TTL_NEGATIVO,
+    max_memoria=GEO_CACHE_MAX_MEMORIA
+)
+
+# Cache de cotações (CEP + carrinho -> XML pronto), compartilhado entre workers.
+# TTL curto e menor que ESTOQUE_CACHE_TTL; 0 desliga
+COTACAO_CACHE_PATH = os.getenv('COTACAO_CACHE_PATH', 'cotacao_cache.sqlite3')
+COTACAO_CACHE_TTL = float(os.getenv('COTACAO_CACHE_TTL', 30))
+COTACAO_CACHE_MAX_MEMORIA = int(os.getenv('COTACAO_CACHE_MAX_MEMORIA', 5000))
+
+COTACAO_CACHE = CacheCotacao(
+    COTACAO_CACHE_PATH,
+    ttl=COTACAO_CACHE_TTL,
+    max_memoria=COTACAO_CACHE_MAX_MEMORIA
+)
+
+def _cliente(nome, pool_max=HTTP_POOL_MAX):
+    return ClienteUpstream(
+        nome,
+        timeout_conexao=HTTP_CONNECT_TIMEOUT,
+        timeout_leitura=HTTP_TIMEOUT,
+        pool_max=pool_max,
+        tentativas=HTTP_RETRIES,
+        limite_falhas=CIRCUITO_LIMITE_FALHAS,
+        resfriamento=CIRCUITO_RESFRIAMENTO,
+        observador=_observar_upstream
+    )
+
+UPSTREAMS = {
+    'brasilapi': _cliente('brasilapi'),
+    'viacep': _cliente('viacep'),
+    'tray': _cliente('tray', pool_max=max(HTTP_POOL_MAX, TRAY_MAX_WORKERS)),
+}
+
+# Índice offline de prefixos de CEP (gerado com `python cep_index.py build ...`)
+CEP_INDEX_PATH = os.getenv('CEP_INDEX_PATH', 'cep_index.bin')
+CEP_INDEX = carregar_indice(CEP_INDEX_PATH)
+
+# Centróides dos municípios do IBGE (gerado com `python municipios.py build ...`):
+# resposta só com município/UF vira coordenada do município, não da capital
+MUNICIPIOS_PATH = os.getenv('MUNICIPIOS_PATH', 'municipios.csv.gz')
+MUNICIPIOS = carregar_municipios(MUNICIPIOS_PATH)
 
 # =============================================================================
-# CENTROS DE DISTRIBUIÇÃO - 5 CDs COBRINDO TODO BRASIL
+# CENTROS DE DISTRIBUIÇÃO (cds.json, recarregado quando o arquivo muda)
 # =============================================================================
-CENTROS_DISTRIBUICAO = {
-    "RS": {
-        "nome": "CD Sul - Rio Grande do Sul",
-        "cidade": "Frederico Westphalen",
-        "uf": "RS",
-        "cep": "98400000",
-        "codigo_ibge": 4307708,
-        "lat": -27.3636,
-        "lon": -53.3978,
-        "codigo_cd_tray": "CD_RS"
-    },
-    "SC": {
-        "nome": "CD Sudeste - Santa Catarina",
-        "cidade": "Joinville",
-        "uf": "SC",
-        "cep": "89239250",
-        "codigo_ibge": 4209102,
-        "lat": -26.3045,
-        "lon": -48.8487,
-        "codigo_cd_tray": "CD_SC"
-    },
-    "MG": {
-        "nome": "CD Sudeste - Minas Gerais",
-        "cidade": "Montes Claros",
-        "uf": "MG",
-        "cep": "39404627",
-        "codigo_ibge": 3143302,
-        "lat": -16.7350,
-        "lon": -43.8619,
-        "codigo_cd_tray": "CD_MG"
-    },
-    "MS": {
-        "nome": "CD Centro-Oeste - Mato Grosso do Sul",
-        "cidade": "Campo Grande",
-        "uf": "MS",
-        "cep": "79108630",
-        "codigo_ibge": 5002704,
-        "lat": -20.4697,
-        "lon": -54.6201,
-        "codigo_cd_tray": "CD_MS"
-    },
-    "CE": {
-        "nome": "CD Nordeste - Ceará",
-        "cidade": "Tauá",
-        "uf": "CE",
-        "cep": "63660000",
-        "codigo_ibge": 2313302,
-        "lat": -6.0014,
-        "lon": -40.2925,
-        "codigo_cd_tray": "CD_CE"
-    }
-}
+CDS_PATH = os.getenv('CDS_PATH', 'cds.json')
+CDS_INTERVALO = float(os.getenv('CDS_INTERVALO', 10))
+
+# Prazo de entrega por faixa de distância: (até km, dias)
+FAIXAS_PRAZO = ((100, 3), (300, 5), (600, 7), (1000, 10))
+PRAZO_MAXIMO = 15
+
+# Distâncias rodoviárias CD x município (gerada com `python distancias_rodoviarias.py build ...`);
+# fora da matriz, fator de correção por CD/região calibrado no build
+DISTANCIAS_RODOVIARIAS_PATH = os.getenv('DISTANCIAS_RODOVIARIAS_PATH', 'distancias_rodoviarias.bin')
+
+# Tabela pré-calculada por setor de CEP (gerada com `python tabela_setores.py build ...`)
+TABELA_SETORES_PATH = os.getenv('TABELA_SETORES_PATH', 'tabela_setores.bin')
+
+def montar_config_cds(centros):
+    """
+    Snapshot de tudo que depende dos CDs: índice espacial, motor vetorizado
+    (lotes e simulações), matriz rodoviária, tabela de setores e a parte fixa
+    da versão das cotações em cache
+    """
+    motor = MotorFrete(centros, FAIXAS_PRAZO, PRAZO_MAXIMO, DEFAULT_VALOR_KM)
+    rotas = carregar_matriz(DISTANCIAS_RODOVIARIAS_PATH, motor.ids)
+    assinatura = assinatura_config(motor, FAIXAS_PRAZO, PRAZO_MAXIMO, rotas)
+    cadastro = hashlib.sha1(json.dumps(centros, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return ConfigCDs(
+        centros, rotas, assinatura,
+        motor=motor,
+        setores=carregar_tabela(TABELA_SETORES_PATH, motor, assinatura),
+        versao_cotacao=f"{assinatura.hex()}:{cadastro}:{DEFAULT_VALOR_KM}:{FRETE_SERVICOS}:{FRETE_OPCOES_CDS}",
+    )
+
+def _cds_recarregados(config):
+    # Página inicial e /cds mostram os CDs; as cotações em cache mudam de versão sozinhas
+    compilar_respostas()
+
+REGISTRO_CDS = FonteCDs(CDS_PATH, montar_config_cds, CDS_INTERVALO, ao_recarregar=_cds_recarregados)
 
 # =============================================================================
 # FUNÇÕES AUXILIARES
@@ -88,18 +282,34 @@ def haversine(lat1, lon1, lat2, lon2):
     """
     Calcula a distância em km entre dois pontos usando Haversine
     Multiplica por 1.15 pois rodovias são ~15% maiores que linha reta
+    (a cotação usa calcular_distancias_cds, que aplica a matriz rodoviária)
     """
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    km = 6371 * c
-    return km * 1.15  # ajuste rodoviário
+    return distancia_reta(lat1, lon1, lat2, lon2) * AJUSTE_RODOVIARIO
 
 def _clean_cep(cep: str) -> str:
     return (cep or "").replace('-', '').replace('.', '').strip()
 
+# Faixas de CEP (5 dígitos) por UF, dos Correios: (início, UF), ordenadas
+FAIXAS_CEP_UF = (
+    (1000, 'SP'), (20000, 'RJ'), (29000, 'ES'), (30000, 'MG'), (40000, 'BA'),
+    (49000, 'SE'), (50000, 'PE'), (57000, 'AL'), (58000, 'PB'), (59000, 'RN'),
+    (60000, 'CE'), (64000, 'PI'), (65000, 'MA'), (66000, 'PA'), (68900, 'AP'),
+    (69000, 'AM'), (69300, 'RR'), (69400, 'AM'), (69900, 'AC'), (70000, 'DF'),
+    (72800, 'GO'), (73000, 'DF'), (73700, 'GO'), (76800, 'RO'), (77000, 'TO'),
+    (78000, 'MT'), (79000, 'MS'), (80000, 'PR'), (88000, 'SC'), (90000, 'RS'),
+)
+_INICIOS_CEP_UF = [inicio for inicio, _ in FAIXAS_CEP_UF]
+
+def uf_do_cep(cep):
+    """
+    UF pela faixa do CEP, sem rede (None para CEP inválido)
+    """
+    cep = _clean_cep(cep)
+    if len(cep) != 8 or not cep.isdigit():
+        return None
+    i = bisect_right(_INICIOS_CEP_UF, int(cep[:5])) - 1
+    return FAIXAS_CEP_UF[i][1] if i >= 0 else None
+
 def buscar_coordenadas_capital(uf):
     """
     Fallback: retorna coordenadas da capital do estado
@@ -135,7 +345,7 @@ def buscar_coordenadas_capital(uf):
     }
     if uf in capitais:
         capital = capitais[uf]
-        print(f"[IBGE] Usando capital como fallback: {capital['nome']}/{uf}")
+        log_geo.info("Usando capital como fallback: %s/%s", capital['nome'], uf)
         return {
             'municipio': capital['nome'],
             'uf': uf,
@@ -144,87 +354,170 @@ def buscar_coordenadas_capital(uf):
         }
     return None
 
-def buscar_coordenadas_ibge(cep):
+def buscar_coordenadas_ibge(cep, prazo=None):
     """
-    Busca coordenadas reais via APIs públicas:
-    1) BrasilAPI (CEP v2) -> já pode vir com latitude/longitude
-    2) ViaCEP -> pega município/UF
-    3) Fallback -> coordenadas da capital do estado
+    Busca coordenadas do CEP, consultando antes o cache de geocodificação
+    e o índice offline de prefixos de CEP.
+    Só grava no cache resultados definitivos (coordenadas ou CEP inexistente);
+    falhas de rede e respostas degradadas pelo `prazo` não são cacheadas.
     """
-    try:
-        cep = _clean_cep(cep)
-        print(f"[GEO] CEP: {cep}")
-
-        # 1) BrasilAPI
-        try:
-            r = requests.get(f"https://brasilapi.com.br/api/cep/v2/{cep}", timeout=HTTP_TIMEOUT)
-            if r.status_code == 200:
-                data = r.json()
-                uf = data.get('state', '')
-                municipio = data.get('city', '')
-                location = data.get('location') or {}
-                coords = location.get('coordinates') if isinstance(location, dict) else None
-                lat = None
-                lon = None
-                if isinstance(coords, dict):
-                    lat = coords.get('latitude')
-                    lon = coords.get('longitude')
-                if lat is not None and lon is not None:
-                    lat = float(lat); lon = float(lon)
-                    print(f"[GEO] BrasilAPI OK -> {municipio}/{uf} [{lat},{lon}]")
-                    return {
-                        'municipio': municipio,
-                        'uf': uf,
-                        'lat': lat,
-                        'lon': lon
-                    }
-                else:
-                    print("[GEO] BrasilAPI sem coordenadas, tentando ViaCEP…")
-            else:
-                print(f"[GEO] BrasilAPI status {r.status_code}, fallback → ViaCEP")
-        except requests.Timeout:
-            print("[GEO] Timeout BrasilAPI")
-        except Exception as e:
-            print(f"[GEO] Erro BrasilAPI: {e}")
-
-        # 2) ViaCEP
-        try:
-            response = requests.get(f"https://viacep.com.br/ws/{cep}/json/", timeout=HTTP_TIMEOUT)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('erro'):
-                    print(f"[IBGE] ⚠️  CEP não encontrado no ViaCEP")
-                    return None
-                municipio = data.get('localidade', '')
-                uf = data.get('uf', '')
-                if municipio and uf:
-                    print(f"[IBGE] Município encontrado: {municipio}/{uf} (sem coords). Fallback capital…")
-                    cap = buscar_coordenadas_capital(uf)
-                    if cap:
-                        # Mantém município real para exibição, mas usa coords da capital
-                        cap['municipio'] = municipio
-                        cap['uf'] = uf
-                        return cap
-            else:
-                print(f"[IBGE] ⚠️ ViaCEP status {response.status_code}")
-        except requests.Timeout:
-            print("[IBGE] ⚠️  Timeout ViaCEP")
-        except Exception as e:
-            print(f"[IBGE] ⚠️  Erro ViaCEP: {e}")
+    cep = _clean_cep(cep)
+    cache = GEO_CACHE.obter(cep)
+    if cache is not AUSENTE:
+        log_geo.debug("CEP: %s (cache)", cep)
+        return dict(cache) if cache else None
+
+    # Índice offline: resolve sem rede; provedores só para CEPs fora do índice
+    indexado = CEP_INDEX.buscar(cep)
+    if indexado:
+        log_geo.debug("CEP: %s (índice %s) -> %s/%s", cep, indexado['precisao'], indexado['municipio'], indexado['uf'])
+        return indexado
+
+    resultado, definitivo = _buscar_coordenadas_provedores(cep, prazo)
+    if resultado is not None and resultado.get('degradado'):
+        return resultado
+    if resultado is not None:
+        # Coordenadas de capital são aproximadas: ficam pouco tempo no cache
+        ttl = GEO_CACHE_TTL_NEGATIVO if resultado.get('fallback_capital') else None
+        GEO_CACHE.gravar(cep, resultado, ttl=ttl)
+        return dict(resultado)
+    if definitivo:
+        GEO_CACHE.gravar(cep, None)
+    return None
 
+def _coordenadas_degradadas(cep, uf, prazo):
+    """
+    Prazo esgotado: capital da UF (informada ou pela faixa do CEP)
+    """
+    prazo.degradar('geo')
+    cap = buscar_coordenadas_capital(uf or uf_do_cep(cep))
+    if cap:
+        cap['fallback_capital'] = True
+        cap['degradado'] = True
+    return cap
+
+def _consultar_brasilapi(cep, prazo=None):
+    """
+    BrasilAPI (CEP v2) -> já pode vir com latitude/longitude
+    """
+    try:
+        r = UPSTREAMS['brasilapi'].get(f"{BRASILAPI_URL.rstrip('/')}/{cep}", prazo=prazo)
+        if r.status_code != 200:
+            log_geo.info("BrasilAPI status %s", r.status_code)
+            return None
+        data = r.json()
+        uf = data.get('state', '')
+        municipio = data.get('city', '')
+        location = data.get('location') or {}
+        coords = location.get('coordinates') if isinstance(location, dict) else None
+        lat = None
+        lon = None
+        if isinstance(coords, dict):
+            lat = coords.get('latitude')
+            lon = coords.get('longitude')
+        if lat is not None and lon is not None:
+            lat = float(lat); lon = float(lon)
+            log_geo.debug("BrasilAPI OK -> %s/%s [%s,%s]", municipio, uf, lat, lon)
+            return {
+                'municipio': municipio,
+                'uf': uf,
+                'lat': lat,
+                'lon': lon
+            }
+        log_geo.debug("BrasilAPI sem coordenadas: %s/%s", municipio, uf)
+        return {'municipio': municipio, 'uf': uf} if municipio and uf else None
+    except requests.Timeout:
+        log_geo.warning("Timeout BrasilAPI")
     except Exception as e:
-        print(f"[IBGE] ⚠️  Erro inesperado: {e}")
-
+        log_geo.warning("Erro BrasilAPI: %s", e)
     return None
 
-def verificar_estoque_tray(codigo_produto, cd_codigo):
+def _consultar_viacep(cep, prazo=None):
     """
-    Verifica estoque do produto no CD específico via API Tray
+    ViaCEP -> só município/UF (sem coordenadas)
     """
-    if not TRAY_API_URL or not TRAY_API_TOKEN:
-        print(f"[TRAY] API não configurada, assumindo estoque disponível")
-        return True
+    try:
+        response = UPSTREAMS['viacep'].get(f"{VIACEP_URL.rstrip('/')}/{cep}/json/", prazo=prazo)
+        if response.status_code != 200:
+            log_geo.warning("ViaCEP status %s", response.status_code)
+            return None
+        data = response.json()
+        if data.get('erro'):
+            log_geo.info("CEP não encontrado no ViaCEP")
+            return NAO_ENCONTRADO
+        municipio = data.get('localidade', '')
+        uf = data.get('uf', '')
+        if municipio and uf:
+            log_geo.debug("ViaCEP -> %s/%s (sem coords)", municipio, uf)
+            return {'municipio': municipio, 'uf': uf, 'codigo_ibge': data.get('ibge')}
+    except requests.Timeout:
+        log_geo.warning("Timeout ViaCEP")
+    except Exception as e:
+        log_geo.warning("Erro ViaCEP: %s", e)
+    return None
+
+PROVEDORES_GEO = {
+    'brasilapi': _consultar_brasilapi,
+    'viacep': _consultar_viacep,
+}
+
+GEO_RESOLVEDOR = ResolvedorGeo(
+    {nome: PROVEDORES_GEO[nome] for nome in GEO_PROVEDORES if nome in PROVEDORES_GEO},
+    atraso_hedge=GEO_HEDGE_ATRASO,
+    adaptativo=GEO_ORDEM_ADAPTATIVA,
+    max_workers=GEO_PROVEDORES_WORKERS
+)
 
+def _buscar_coordenadas_provedores(cep, prazo=None):
+    """
+    Busca coordenadas reais via APIs públicas (BrasilAPI e ViaCEP em hedge,
+    ver geo_resolver); sem coordenadas, usa o centróide do município
+    (tabela do IBGE) e, fora dela, a capital do estado.
+    Retorna (resultado, definitivo); definitivo=True quando o CEP não existe.
+    Com `prazo`, cada chamada recebe só o tempo restante; esgotado, usa a
+    capital da UF (resultado marcado 'degradado').
+    """
+    log_geo.debug("CEP: %s", cep)
+    resultado, nao_encontrado = GEO_RESOLVEDOR.resolver(cep, prazo)
+    if tem_coordenadas(resultado):
+        return dict(resultado), True
+    if nao_encontrado:
+        return None, True
+
+    if resultado:
+        municipio = MUNICIPIOS.buscar(resultado['municipio'], resultado['uf'], resultado.get('codigo_ibge'))
+        if municipio:
+            log_geo.debug("Município %s/%s pela tabela do IBGE", municipio['municipio'], municipio['uf'])
+            municipio['precisao'] = 'municipio'
+            return municipio, True
+
+    uf = resultado.get('uf') if resultado else None
+    if prazo is not None and prazo.esgotado(PRAZO_MINIMO_CHAMADA):
+        log_geo.warning("Prazo esgotado geocodificando %s, usando capital", cep)
+        return _coordenadas_degradadas(cep, uf, prazo), False
+
+    if resultado:
+        log_geo.debug("Município encontrado: %s/%s (sem coords). Fallback capital…", resultado['municipio'], uf)
+        cap = buscar_coordenadas_capital(uf)
+        if cap:
+            # Mantém município real para exibição, mas usa coords da capital
+            cap['municipio'] = resultado['municipio']
+            cap['uf'] = uf
+            cap['fallback_capital'] = True
+            return cap, True
+
+    return None, False
+
+_tray_executor = ThreadPoolExecutor(max_workers=TRAY_MAX_WORKERS, thread_name_prefix='tray')
+
+def _tray_configurada():
+    return bool(TRAY_API_URL and TRAY_API_TOKEN)
+
+def buscar_produto_tray(codigo_produto, prazo=None):
+    """
+    Busca o produto na API Tray (uma chamada traz todos os campos stock_<CD>)
+    Retorna o dict do produto ou None em caso de erro / não encontrado / prazo esgotado
+    """
     try:
         headers = {
             'Authorization': f'Bearer {TRAY_API_TOKEN}',
@@ -232,111 +525,351 @@ def verificar_estoque_tray(codigo_produto, cd_codigo):
         }
         url = f"{TRAY_API_URL.rstrip('/')}/products"
         params = {'reference': codigo_produto}
-        response = requests.get(url, headers=headers, params=params, timeout=HTTP_TIMEOUT)
+        response = UPSTREAMS['tray'].get(url, headers=headers, params=params, prazo=prazo)
 
         if response.status_code != 200:
-            print(f"[TRAY] ⚠️  Erro ao buscar produto: {response.status_code}")
-            return True  # Assume disponível em caso de erro
+            log_tray.warning("Erro ao buscar produto: %s", response.status_code)
+            return None
 
         data = response.json() or {}
         products = data.get('products') or []
         if not products:
-            print(f"[TRAY] ⚠️  Produto {codigo_produto} não encontrado")
-            return True
+            log_tray.info("Produto %s não encontrado", codigo_produto)
+            return None
+
+        return products[0]
+
+    except Exception as e:
+        log_tray.warning("Erro ao verificar estoque: %s", e)
+        return None
 
-        produto = products[0]
+def listar_pagina_tray(pagina):
+    """
+    Lista uma página do catálogo Tray (/products paginado)
+    Retorna (produtos, tem_mais)
+    """
+    headers = {
+        'Authorization': f'Bearer {TRAY_API_TOKEN}',
+        'Content-Type': 'application/json'
+    }
+    url = f"{TRAY_API_URL.rstrip('/')}/products"
+    params = {'page': pagina, 'limit': TRAY_PAGINA_LIMITE}
+    response = UPSTREAMS['tray'].get(url, headers=headers, params=params)
+    response.raise_for_status()
+
+    data = response.json() or {}
+    products = data.get('products') or []
+    paging = data.get('paging') or {}
+    total = int(paging.get('total') or 0)
+    tem_mais = pagina * TRAY_PAGINA_LIMITE < total if total else len(products) >= TRAY_PAGINA_LIMITE
+    return products, tem_mais
+
+ESTOQUE_CACHE = CacheEstoque(
+    buscar_produto_tray,
+    _tray_executor,
+    ttl=ESTOQUE_CACHE_TTL,
+    ttl_stale=ESTOQUE_CACHE_TTL_STALE,
+    max_itens=ESTOQUE_CACHE_MAX,
+    # Produto que zerou ou voltou a ter saldo muda o CD escolhido
+    ao_mudar=lambda codigo: COTACAO_CACHE.invalidar(codigo, "disponibilidade mudou")
+)
+
+def estoque_no_cd(produto, cd_codigo, codigo_produto=''):
+    """
+    Decide a disponibilidade a partir do produto já buscado na Tray.
+    Produto ausente (erro, timeout, não encontrado) = assume disponível
+    """
+    if produto is None:
+        return True
+
+    try:
         campo_estoque = f"stock_{cd_codigo}"
 
         if campo_estoque in produto:
             estoque = int(produto[campo_estoque])
-            print(f"[TRAY] Estoque de {codigo_produto} no {cd_codigo}: {estoque}")
+            log_tray.debug("Estoque de %s no %s: %d", codigo_produto, cd_codigo, estoque)
             return estoque > 0
 
         if 'stock' in produto:
             estoque = int(produto['stock'])
-            print(f"[TRAY] Estoque padrão de {codigo_produto}: {estoque}")
+            log_tray.debug("Estoque padrão de %s: %d", codigo_produto, estoque)
             return estoque > 0
 
-        print(f"[TRAY] ⚠️  Campo de estoque não encontrado")
+        log_tray.warning("Campo de estoque não encontrado")
         return True
 
     except Exception as e:
-        print(f"[TRAY] ⚠️  Erro ao verificar estoque: {e}")
+        log_tray.warning("Erro ao verificar estoque: %s", e)
         return True  # Assume disponível em caso de erro
 
-def calcular_distancias_cds(lat_destino, lon_destino):
+def verificar_estoque_tray(codigo_produto, cd_codigo, prazo=None):
     """
-    Calcula distância de todos CDs para o destino
-    Retorna lista ordenada por distância
+    Verifica estoque do produto no CD específico via API Tray
     """
-    distancias = []
-    for cd_id, cd_info in CENTROS_DISTRIBUICAO.items():
-        distancia = haversine(cd_info['lat'], cd_info['lon'], lat_destino, lon_destino)
-        distancias.append({
-            'cd_id': cd_id,
-            'cd_info': cd_info,
-            'distancia': distancia
-        })
-    distancias.sort(key=lambda x: x['distancia'])
-    return distancias
+    if not _tray_configurada():
+        log_tray.debug("API não configurada, assumindo estoque disponível")
+        return True
 
-def selecionar_melhor_cd(lat_destino, lon_destino, produtos):
+    if prazo is not None and prazo.esgotado(PRAZO_MINIMO_CHAMADA):
+        prazo.degradar('estoque')
+        log_tray.warning("Prazo esgotado, assumindo estoque de %s", codigo_produto)
+        return True
+
+    return estoque_no_cd(buscar_produto_tray(codigo_produto, prazo), cd_codigo, codigo_produto)
+
+def buscar_estoques_tray(codigos, deadline=None, prazo=None):
     """
-    Seleciona o melhor CD baseado em:
-    1. Distância (mais próximo)
-    2. Disponibilidade de estoque
+    Busca cada produto distinto uma única vez, em paralelo, respeitando um
+    prazo total. Passa pelo cache de estoque: respostas recentes (ou vencidas,
+    enquanto atualizam em background) não esperam a Tray.
+    Com `prazo`, espera no máximo o que resta da requisição (esgotado, só
+    aproveita o que já está no cache).
+    Retorna {codigo: mapa de estoque}; produtos que falharam ou não
+    chegaram no prazo ficam None (assume disponível).
+    """
+    if not _tray_configurada():
+        log_tray.debug("API não configurada, assumindo estoque disponível")
+        return {}
+
+    if deadline is None:
+        deadline = TRAY_ESTOQUE_DEADLINE
+    if prazo is not None:
+        deadline = prazo.limitar(deadline)
+
+    futures = {codigo: ESTOQUE_CACHE.obter_future(codigo) for codigo in codigos}
+    _, pendentes = wait(futures.values(), timeout=deadline)
+    if pendentes:
+        if prazo is not None:
+            prazo.degradar('estoque')
+        # Não cancela: os futures são compartilhados e a resposta tardia ainda aquece o cache
+        log_tray.warning("%d produto(s) sem resposta em %.1fs, assumindo estoque", len(pendentes), deadline)
+
+    resultado = {}
+    for codigo, future in futures.items():
+        if future in pendentes:
+            resultado[codigo] = None
+        else:
+            resultado[codigo] = future.result()
+    return resultado
+
+def linha_rotas(destino, rotas=None):
+    """
+    Linha do município de destino na matriz rodoviária, ou None
+    """
+    if rotas is None:
+        rotas = REGISTRO_CDS.atual().rotas
+    if not destino or not len(rotas):
+        return None
+    codigo = destino.get('codigo_ibge') or MUNICIPIOS.codigo(destino.get('municipio'), destino.get('uf'))
+    return rotas.linha(codigo)
+
+def calcular_distancias_cds(lat_destino, lon_destino, destino=None):
     """
-    distancias = calcular_distancias_cds(lat_destino, lon_destino)
+    Distâncias dos CDs para o destino, do mais próximo ao mais distante
+    Com `destino` (município/UF da geocodificação), usa a distância da matriz
+    rodoviária ou o fator da região; sem ele, o ajuste rodoviário padrão
+    Retorna um RankingPreguicoso: os CDs saem do índice espacial conforme a
+    lista é percorrida (quem para no primeiro com estoque não calcula o resto)
+    """
+    config = REGISTRO_CDS.atual()
+    linha = linha_rotas(destino, config.rotas)
+    uf = destino.get('uf') if destino else None
+    return config.ranking(lat_destino, lon_destino, linha, uf)
 
-    print(f"\n[CALC] Distâncias calculadas:")
-    for d in distancias:
-        print(f"  - {d['cd_info']['nome']}: {d['distancia']:.1f} km")
+def codigos_distintos(produtos):
+    """
+    Referências distintas do carrinho, na ordem em que aparecem
+    """
+    return list(dict.fromkeys(
+        codigo for codigo in (p.codigo for p in produtos) if codigo
+    ))
 
+def escolher_cd(distancias, codigos, produtos_tray, produtos=None, prazo=None):
+    """
+    Percorre os CDs em ordem de distância e escolhe o primeiro com estoque
+    de todos os produtos. Sem nenhum, tenta dividir o carrinho (`produtos`)
+    entre CDs; sem divisão possível, usa o mais próximo (tem_estoque=False)
+    """
     for d in distancias:
         cd_info = d['cd_info']
         todos_disponiveis = True
-        for produto in produtos:
-            codigo = (produto.get('codigo') or '').strip()
-            if codigo and not verificar_estoque_tray(codigo, cd_info['codigo_cd_tray']):
+        for codigo in codigos:
+            if not estoque_no_cd(produtos_tray.get(codigo), cd_info['codigo_cd_tray'], codigo):
                 todos_disponiveis = False
-                print(f"[CD] {cd_info['nome']}: Produto {codigo} sem estoque")
+                log_cd.debug("%s: Produto %s sem estoque", cd_info['nome'], codigo)
                 break
         if todos_disponiveis:
-            print(f"[CD] ✓ Escolhido: {cd_info['nome']} ({d['distancia']:.1f} km)")
-            return {
-                'cd_id': d['cd_id'],
-                'cd_info': cd_info,
-                'distancia': d['distancia'],
-                'tem_estoque': True
-            }
+            log_cd.debug("Escolhido: %s (%.1f km)", cd_info['nome'], d['distancia'])
+            return dict(d, tem_estoque=True)
 
-    print(f"[CD] ⚠️  Nenhum CD com estoque completo, usando mais próximo")
-    return {
-        'cd_id': distancias[0]['cd_id'],
-        'cd_info': distancias[0]['cd_info'],
-        'distancia': distancias[0]['distancia'],
-        'tem_estoque': False
-    }
+    if produtos and DIVISAO_MAX_CDS > 1:
+        dividido = dividir_entre_cds(distancias, produtos, produtos_tray, prazo)
+        if dividido:
+            return dividido
+
+    log_cd.info("Nenhum CD com estoque completo, usando mais próximo")
+    return dict(distancias[0], tem_estoque=False)
+
+def alternativas_cd(distancias, codigos, produtos_tray, resultado_cd):
+    """
+    Próximos CDs do ranking (além do escolhido) com estoque de todo o
+    carrinho, até FRETE_OPCOES_CDS - 1; vazio se o carrinho foi dividido
+    ou se nenhum CD tem tudo
+    """
+    if FRETE_OPCOES_CDS <= 1 or not resultado_cd['tem_estoque'] or 'envios' in resultado_cd:
+        return []
+    alternativas = []
+    for d in distancias:
+        if len(alternativas) >= FRETE_OPCOES_CDS - 1:
+            break
+        if d['cd_id'] == resultado_cd['cd_id']:
+            continue
+        cd_codigo = d['cd_info']['codigo_cd_tray']
+        if all(estoque_no_cd(produtos_tray.get(codigo), cd_codigo, codigo) for codigo in codigos):
+            alternativas.append(d)
+    return alternativas
+
+def dividir_entre_cds(distancias, produtos, produtos_tray, prazo=None):
+    """
+    Divisão mais barata do carrinho entre CDs com estoque (ver divisao_envio),
+    precificando cada envio como uma cotação de um CD só.
+    A busca é exponencial no número de CDs, por isso só entram os
+    DIVISAO_CANDIDATOS mais próximos com estoque de algum item, tirados do
+    ranking conforme ele é percorrido; com o prazo esgotado não divide.
+    Retorna o resultado de escolher_cd com 'envios', 'valor' e 'prazo'
+    (o do envio mais lento), ou None se algum produto não tem estoque nos candidatos
+    """
+    if prazo is not None and prazo.esgotado():
+        prazo.degradar('divisao')
+        return None
+
+    tabela = TABELA_FRETE.atual()
+    grupos = {}
+    for indice, p in enumerate(produtos):
+        codigo = p.codigo
+        grupos.setdefault(codigo or indice, []).append(p)
+
+    chaves = list(grupos)
+    codigos = [chave for chave in chaves if not isinstance(chave, int)]
+    candidatos = []
+    estoques = []
+    for d in distancias:
+        cd_codigo = d['cd_info']['codigo_cd_tray']
+        com_estoque = {c for c in codigos if estoque_no_cd(produtos_tray.get(c), cd_codigo, c)}
+        if com_estoque:
+            candidatos.append(d)
+            estoques.append(com_estoque)
+            if len(candidatos) >= DIVISAO_CANDIDATOS:
+                break
+
+    itens = []
+    disponivel = []
+    for chave in chaves:
+        linhas = grupos[chave]
+        peso, volume, _ = totais_carrinho(linhas)
+        itens.append((peso, volume, tabela.ocupacao(linhas) if tabela else None))
+        if isinstance(chave, int):
+            # Sem referência: não há como consultar, assume disponível em todos
+            disponivel.append(frozenset(range(len(candidatos))))
+        else:
+            disponivel.append(frozenset(j for j, com_estoque in enumerate(estoques) if chave in com_estoque))
+
+    def precificar(j, peso, volume, ocupacao):
+        return calcular_valor_frete(candidatos[j]['distancia'], peso, volume, ocupacao=ocupacao)
+
+    melhor = otimizar_divisao(len(candidatos), itens, disponivel, precificar,
+                              max_envios=DIVISAO_MAX_CDS, valor_minimo=50.00)
+    if melhor is None:
+        return None
+
+    _, atribuicao = melhor
+    envios = []
+    for j, d in enumerate(candidatos):
+        alocados = [chaves[i] for i, cd in enumerate(atribuicao) if cd == j]
+        if not alocados:
+            continue
+        linhas = [p for chave in alocados for p in grupos[chave]]
+        peso, volume, _ = totais_carrinho(linhas)
+        envios.append(dict(
+            d,
+            codigos=[c for c in alocados if not isinstance(c, int)],
+            itens=len(linhas),
+            valor=calcular_valor_frete(d['distancia'], peso, volume, ocupacao=ocupacao_carrinho(linhas)),
+            prazo=d.get('prazo') or calcular_prazo_entrega(d['distancia']),
+        ))
+
+    log_cd.info("Carrinho dividido em %d envio(s): %s", len(envios), ', '.join(
+        f"{e['cd_info']['nome']} ({', '.join(e['codigos']) or '-'})" for e in envios
+    ))
+    return dict(
+        envios[0],
+        tem_estoque=True,
+        envios=envios,
+        valor=round(sum(e['valor'] for e in envios), 2),
+        prazo=max(e['prazo'] for e in envios),
+        distancia=max(e['distancia'] for e in envios),
+    )
+
+def ranking_cds(lat_destino, lon_destino, destino=None):
+    distancias = calcular_distancias_cds(lat_destino, lon_destino, destino)
+
+    if log_calc.isEnabledFor(logging.DEBUG):
+        log_calc.debug("Distâncias calculadas: %s", ', '.join(
+            f"{d['cd_info']['nome']}: {d['distancia']:.1f} km" for d in distancias
+        ))
+    return distancias
+
+def ranking_setor(cep):
+    """
+    Ranking de CDs pré-calculado para o setor do CEP (sem geocodificação)
+    Retorna a lista no formato de calcular_distancias_cds, ou None
+    """
+    distancias = REGISTRO_CDS.atual().setores.buscar(_clean_cep(cep))
+    if distancias:
+        log_calc.debug("Setor %s (tabela pré-calculada)", _clean_cep(cep)[:5])
+    return distancias
+
+def selecionar_melhor_cd(lat_destino, lon_destino, produtos, prazo=None, destino=None):
+    """
+    Seleciona o melhor CD baseado em:
+    1. Distância (mais próximo)
+    2. Disponibilidade de estoque
+    Percorre o ranking preguiçoso e para no primeiro CD com estoque
+    """
+    distancias = ranking_cds(lat_destino, lon_destino, destino)
+
+    # Uma busca por produto distinto; a decisão por CD é feita em memória
+    codigos = codigos_distintos(produtos)
+    return escolher_cd(distancias, codigos, buscar_estoques_tray(codigos, prazo=prazo), produtos, prazo)
 
 def calcular_prazo_entrega(distancia_km):
     """
     Calcula prazo de entrega baseado na distância
     """
-    if distancia_km <= 100:
-        return 3
-    elif distancia_km <= 300:
-        return 5
-    elif distancia_km <= 600:
-        return 7
-    elif distancia_km <= 1000:
-        return 10
-    else:
-        return 15
+    for limite, dias in FAIXAS_PRAZO:
+        if distancia_km <= limite:
+            return dias
+    return PRAZO_MAXIMO
+
+def ocupacao_carrinho(produtos):
+    """
+    Metros de caminhão ocupados pelo carrinho segundo a tabela de frete,
+    ou None (sem tabela / peças sem medida)
+    """
+    tabela = TABELA_FRETE.atual()
+    return tabela.ocupacao(produtos) if tabela else None
 
-def calcular_valor_frete(distancia_km, peso_total, volume_total, valor_km=None):
+def calcular_valor_frete(distancia_km, peso_total, volume_total, valor_km=None, ocupacao=None):
     """
     Calcula valor do frete baseado em distância, peso e volume
+    Com `ocupacao` (metros de caminhão, só quando todo o carrinho está no
+    cadastro da planilha), usa a tabela de frete da planilha
     """
+    if ocupacao:
+        tabela = TABELA_FRETE.atual()
+        if tabela:
+            return round(max(distancia_km * tabela.valor_km_metro * ocupacao, 50.00), 2)
+
     if valor_km is None:
         valor_km = DEFAULT_VALOR_KM
 
@@ -348,128 +881,540 @@ def calcular_valor_frete(distancia_km, peso_total, volume_total, valor_km=None):
 
 def parse_produtos_tray(produtos_str):
     """
-    Parse do formato de produtos da Tray:
+    Parse do formato de produtos da Tray (uma passada, ver carrinho.py):
     comp;larg;alt;cubagem;quantidade;peso;codigo;valor
+    Retorna um Carrinho (lista de Produto já com os totais); levanta
+    CarrinhoExcedido acima de PRODS_MAX_LINHAS itens / PRODS_MAX_BYTES
     """
-    produtos = []
     try:
-        itens = [x.strip() for x in (produtos_str or '').strip('/ ').split('/') if x.strip()]
-        for item in itens:
-            campos = [c.strip() for c in item.split(';')]
-            if len(campos) >= 8:
-                try:
-                    produtos.append({
-                        'comprimento': float(campos[0]),
-                        'largura': float(campos[1]),
-                        'altura': float(campos[2]),
-                        'cubagem': float(campos[3]),
-                        'quantidade': int(campos[4]),
-                        'peso': float(campos[5]),
-                        'codigo': campos[6],
-                        'valor': float(campos[7])
-                    })
-                except ValueError:
-                    print(f"[PARSE] Ignorando item inválido: {item}")
-        return produtos
+        return parse_produtos(produtos_str, PRODS_MAX_LINHAS, PRODS_MAX_BYTES)
+    except CarrinhoExcedido:
+        raise
     except Exception as e:
-        print(f"[PARSE] Erro ao processar produtos: {e}")
-        return []
+        log_parse.warning("Erro ao processar produtos: %s", e)
+        return Carrinho()
+
+# =============================================================================
+# COTAÇÃO EM LOTE
+# =============================================================================
+
+def totais_carrinho(produtos):
+    """
+    Retorna (peso_total, volume_total, qtd_total) do carrinho
+    (já somados no parse; recalcula para sublistas, ex.: divisão entre CDs)
+    """
+    if isinstance(produtos, Carrinho):
+        return produtos.peso_total, produtos.volume_total, produtos.qtd_total
+    peso_total = sum(p.peso * p.quantidade for p in produtos)
+    volume_total = sum(p.cubagem * p.quantidade for p in produtos)
+    qtd_total = sum(p.quantidade for p in produtos)
+    return peso_total, volume_total, qtd_total
+
+def cotar_lote(entradas):
+    """
+    Cota várias combinações (cep, prods) de uma vez, em blocos de LOTE_BLOCO
+    entradas: cada bloco é cotado e entregue antes do próximo (o NDJSON de
+    /frete/batch começa a sair sem esperar o lote inteiro).
+    CEPs, carrinhos e referências repetidos no lote são processados uma única
+    vez: cada CEP distinto é geocodificado uma vez (em paralelo), cada
+    referência tem o estoque consultado uma vez e distâncias, preços e prazos
+    saem do motor vetorizado. Gera um dict por entrada, na ordem recebida.
+    """
+    entradas = list(entradas)
+    # Um snapshot de CDs e de tabela para o lote todo
+    config = REGISTRO_CDS.atual()
+    tabela = TABELA_FRETE.atual()
+    carrinhos = {}
+    excedidos = set()
+    ocupacoes = {}
+    coordenadas = {}
+    produtos_tray = {}
+
+    with ThreadPoolExecutor(max_workers=LOTE_GEO_WORKERS, thread_name_prefix='lote-geo') as ex:
+        for inicio in range(0, len(entradas), LOTE_BLOCO):
+            bloco = entradas[inicio:inicio + LOTE_BLOCO]
+
+            # 1) Parse: um por string de produtos distinta
+            for _, prods in bloco:
+                if prods and prods not in carrinhos:
+                    try:
+                        carrinhos[prods] = parse_produtos_tray(prods)
+                        ocupacoes[prods] = ocupacao_carrinho(carrinhos[prods]) if carrinhos[prods] else None
+                    except CarrinhoExcedido as e:
+                        log_lote.info("Carrinho recusado: %s", e)
+                        carrinhos[prods] = None
+                        excedidos.add(prods)
+
+            # 2) Geocodificação: uma por CEP distinto (ainda não visto no lote)
+            novos = [cep for cep in dict.fromkeys(_clean_cep(cep) for cep, _ in bloco if cep) if cep not in coordenadas]
+            coordenadas.update(zip(novos, ex.map(buscar_coordenadas_ibge, novos)))
+
+            # 3) Estoque: uma busca por referência distinta (ainda não vista no lote)
+            codigos = list(dict.fromkeys(
+                c for _, prods in bloco if carrinhos.get(prods)
+                for c in codigos_distintos(carrinhos[prods]) if c not in produtos_tray
+            ))
+            if codigos:
+                produtos_tray.update(buscar_estoques_tray(codigos, deadline=LOTE_ESTOQUE_DEADLINE))
+
+            yield from _cotar_bloco(bloco, inicio, config, tabela, carrinhos, excedidos, ocupacoes,
+                                    coordenadas, produtos_tray)
+
+def _cotar_bloco(bloco, inicio, config, tabela, carrinhos, excedidos, ocupacoes, coordenadas, produtos_tray):
+    """
+    Ranking CEP x CD e preço/prazo vetorizados para um bloco de cotar_lote
+    """
+    motor, rotas = config.motor, config.rotas
+
+    # 4) Matriz CEP x CD numa passada vetorizada
+    ceps_ok = list(dict.fromkeys(
+        cep for cep in (_clean_cep(cep) for cep, _ in bloco) if cep and coordenadas.get(cep)
+    ))
+    if ceps_ok:
+        correcao = (None, None)
+        if len(rotas):
+            correcao = rotas.correcao(
+                [linha_rotas(coordenadas[cep], rotas) for cep in ceps_ok],
+                [coordenadas[cep].get('uf') for cep in ceps_ok]
+            )
+        dist, ordem = motor.ranking(
+            [coordenadas[cep]['lat'] for cep in ceps_ok],
+            [coordenadas[cep]['lon'] for cep in ceps_ok],
+            *correcao
+        )
+    linha = {cep: i for i, cep in enumerate(ceps_ok)}
+
+    # 5) CD por entrada (depende do estoque) e preço/prazo em lote
+    resultados = []
+    calculados = []   # (posição em resultados, cd escolhido, peso, volume, ocupação)
+    for indice, (cep, prods) in enumerate(bloco, start=inicio):
+        cep_limpo = _clean_cep(cep)
+        if not cep_limpo:
+            resultados.append({'indice': indice, 'cep': cep_limpo, 'erro': 'CEP não informado'})
+            continue
+        produtos = carrinhos.get(prods)
+        if not produtos:
+            if prods in excedidos:
+                erro = 'Carrinho excede o limite de itens/tamanho'
+            else:
+                erro = 'Formato de produtos inválido' if prods else 'Produtos não informados'
+            resultados.append({'indice': indice, 'cep': cep_limpo, 'erro': erro})
+            continue
+        if cep_limpo not in linha:
+            resultados.append({'indice': indice, 'cep': cep_limpo, 'erro': 'CEP inválido ou não encontrado'})
+            continue
+
+        distancias = motor.lista_distancias(dist, ordem, linha[cep_limpo])
+        resultado_cd = escolher_cd(distancias, codigos_distintos(produtos), produtos_tray)
+        peso_total, volume_total, _ = totais_carrinho(produtos)
+        calculados.append((len(resultados), resultado_cd, peso_total, volume_total, ocupacoes.get(prods)))
+        resultados.append({'indice': indice, 'cep': cep_limpo})
+
+    if calculados:
+        distancias = [c[1]['distancia'] for c in calculados]
+        valores = motor.valores(
+            distancias,
+            [c[2] for c in calculados],
+            [c[3] for c in calculados],
+            ocupacao=[(c[4] or 0.0) for c in calculados] if tabela else None,
+            valor_km_metro=tabela.valor_km_metro if tabela else None,
+            arredondar=False
+        )
+        prazos = motor.prazos(distancias)
+        for (pos, resultado_cd, _, _, _), valor, prazo in zip(calculados, valores, prazos):
+            cd_info = resultado_cd['cd_info']
+            resultados[pos].update({
+                'price': round(float(valor), 2),
+                'delivery_time': int(prazo),
+                'cd': resultado_cd['cd_id'],
+                'carrier': cd_info['nome'],
+                'origin': f"{cd_info['cidade']}/{cd_info['uf']}",
+                'distance': round(resultado_cd['distancia'], 1),
+                'tem_estoque': resultado_cd['tem_estoque']
+            })
+
+    return resultados
+
+# =============================================================================
+# SAÚDE (SONDAS EM BACKGROUND)
+# =============================================================================
+
+def _sonda_brasilapi():
+    return UPSTREAMS['brasilapi'].get(f"{BRASILAPI_URL.rstrip('/')}/{SAUDE_CEP}", timeout=SAUDE_TIMEOUT).status_code
+
+def _sonda_viacep():
+    return UPSTREAMS['viacep'].get(f"{VIACEP_URL.rstrip('/')}/{SAUDE_CEP}/json/", timeout=SAUDE_TIMEOUT).status_code
+
+def _sonda_tray():
+    headers = {
+        'Authorization': f'Bearer {TRAY_API_TOKEN}',
+        'Content-Type': 'application/json'
+    }
+    url = f"{TRAY_API_URL.rstrip('/')}/products"
+    return UPSTREAMS['tray'].get(url, headers=headers, params={'limit': 1}, timeout=SAUDE_TIMEOUT).status_code
+
+# Mesmos clientes da cotação: a sonda vê (e alimenta) o circuit breaker de cada upstream
+SONDAS = {'brasilapi': _sonda_brasilapi, 'viacep': _sonda_viacep}
+if _tray_configurada():
+    SONDAS['tray'] = _sonda_tray
+
+MONITOR_SAUDE = MonitorSaude(SONDAS, SAUDE_INTERVALO)
+
+def _upstream_disponivel(nome):
+    # Sem sonda ainda (boot) conta como disponível; circuito aberto, não
+    return UPSTREAMS[nome].circuito() != 'aberto' and MONITOR_SAUDE.ok(nome) is not False
+
+def prontidao():
+    """
+    Retorna (pronto, checagens) só com o estado em memória (sem rede):
+    - geocodificação: algum provedor com circuito fechado e última sonda ok
+    - Tray (se configurada): circuito e sonda; com aquecimento ligado,
+      catálogo aquecido ao menos uma vez
+    - tabela de frete carregada, se a planilha existe
+    """
+    checagens = {
+        'geocodificacao': any(_upstream_disponivel(nome) for nome in PROVEDORES_GEO),
+    }
+    if _tray_configurada():
+        checagens['tray'] = _upstream_disponivel('tray')
+        if ESTOQUE_AQUECIMENTO_INTERVALO > 0:
+            checagens['estoque_aquecido'] = ESTOQUE_CACHE.stats['aquecidos'] > 0
+    if os.path.exists(TABELA_FRETE_PATH):
+        checagens['tabela_frete'] = TABELA_FRETE.atual() is not None
+    return all(checagens.values()), checagens
 
 # =============================================================================
 # ENDPOINTS DA API
 # =============================================================================
 
+@app.before_request
+def _iniciar_aquecimento_estoque():
+    # Thread de aquecimento sobe no primeiro request de cada worker (pós-fork)
+    if _tray_configurada():
+        ESTOQUE_CACHE.iniciar_aquecimento(listar_pagina_tray, ESTOQUE_AQUECIMENTO_INTERVALO)
+
+@app.before_request
+def _iniciar_sondagem():
+    # Idem para a thread de sondagem do /health
+    MONITOR_SAUDE.iniciar()
+
+def xml_erro(mensagem):
+    return xml_simples('error', mensagem)
+
+def preparar_cotacao(params):
+    """
+    Valida os parâmetros da Tray (cep_destino/cep + prods)
+    Retorna (erro_xml, cep, produtos); erro_xml é None quando válido
+    """
+    log_frete.debug("Parâmetros: %s", params)
+
+    cep = params.get('cep_destino') or params.get('cep', '')
+    produtos_str = params.get('prods', '')
+
+    if not cep:
+        return xml_erro('CEP não informado'), cep, None
+
+    if not produtos_str:
+        return xml_erro('Produtos não informados'), cep, None
+
+    try:
+        produtos = parse_produtos_tray(produtos_str)
+    except CarrinhoExcedido as e:
+        log_parse.info("Carrinho recusado: %s", e)
+        return xml_erro('Carrinho excede o limite de itens/tamanho'), cep, None
+    if not produtos:
+        return xml_erro('Formato de produtos inválido'), cep, None
+
+    return None, cep, produtos
+
+# Campos do resumo guardados junto com o XML (o registro da cotação servida do cache)
+CAMPOS_RESUMO_CACHE = ('origem_destino', 'cep', 'cd', 'distancia_km', 'valor', 'prazo', 'tem_estoque',
+                       'itens', 'peso_kg', 'opcoes', 'envios')
+
+def chave_cotacao(cep, produtos):
+    """
+    CEP limpo + impressão do carrinho (mesmos itens em outra ordem = mesma chave)
+    """
+    return f"{_clean_cep(cep)}:{impressao_carrinho(produtos)}"
+
+def versao_cotacao():
+    """
+    Versão dos dados de preço: config fixa + planilha de frete vigente
+    """
+    TABELA_FRETE.atual()
+    return f"{REGISTRO_CDS.atual().versao_cotacao}:{TABELA_FRETE.assinatura}"
+
+def guardar_cotacao(chave, versao, marca, produtos, xml, resumo):
+    """
+    Guarda o XML no cache de cotações; cotação degradada (prazo esgotado,
+    estoque assumido) não entra, para a próxima tentar de novo.
+    `marca`: COTACAO_CACHE.marca() de antes do cálculo; se o estoque de uma
+    referência do carrinho mudou no meio, a cotação não é guardada
+    """
+    if resumo.get('degradado'):
+        return
+    COTACAO_CACHE.gravar(chave, versao, {
+        'xml': xml,
+        'resumo': {k: resumo[k] for k in CAMPOS_RESUMO_CACHE if k in resumo},
+    }, codigos_distintos(produtos), marca)
+
+def _opcao(resultado, valor, prazo, servico):
+    codigo, nome, fator_valor, fator_prazo = servico
+    envios = resultado.get('envios') or [resultado]
+    cd = '+'.join(e['cd_id'] for e in envios)
+    return {
+        'codigo': f"{cd}_{codigo}",
+        'servico': nome,
+        'cd': cd,
+        'transportadora': ' + '.join(e['cd_info']['nome'] for e in envios),
+        'origem': ' + '.join(f"{e['cd_info']['cidade']}/{e['cd_info']['uf']}" for e in envios),
+        'distancia': resultado['distancia'],
+        'valor': round(valor * fator_valor, 2),
+        'prazo': max(1, math.ceil(prazo * fator_prazo)),
+    }
+
+def opcoes_frete(produtos, resultado_cd, alternativas=()):
+    """
+    Opções de frete: cada serviço de FRETE_SERVICOS para o CD escolhido e
+    para os alternativos. A primeira é o primeiro serviço do CD escolhido
+    (a cotação de sempre); as demais vêm por valor e prazo
+    """
+    peso_total, volume_total, _ = totais_carrinho(produtos)
+    ocupacao = None
+    if 'valor' not in resultado_cd or alternativas:
+        ocupacao = ocupacao_carrinho(produtos)
+
+    bases = []
+    for d in [resultado_cd, *alternativas]:
+        if 'valor' in d:
+            # Carrinho dividido entre CDs: soma dos envios, já precificados
+            valor = d['valor']
+        else:
+            valor = calcular_valor_frete(d['distancia'], peso_total, volume_total, ocupacao=ocupacao)
+        bases.append((d, valor, d.get('prazo') or calcular_prazo_entrega(d['distancia'])))
+
+    opcoes = [_opcao(d, valor, prazo, servico) for d, valor, prazo in bases for servico in FRETE_SERVICOS]
+    return opcoes[:1] + sorted(opcoes[1:], key=lambda o: (o['valor'], o['prazo']))
+
+def montar_xml_frete(cep, produtos, resultado_cd, resumo=None, alternativas=()):
+    """
+    Calcula valor/prazo das opções e monta o XML de resposta da Tray: os
+    campos de <shipping> são os da primeira opção e <options> traz todas
+    Se `resumo` for um dict, recebe os campos do registro da cotação
+    """
+    peso_total, volume_total, qtd_total = totais_carrinho(produtos)
+    log_frete.debug("Quantidade total: %d, Peso total: %.2f kg", qtd_total, peso_total)
+
+    opcoes = opcoes_frete(produtos, resultado_cd, alternativas)
+    principal = opcoes[0]
+    envios = resultado_cd.get('envios') or [resultado_cd]
+
+    if resumo is not None:
+        resumo.update({
+            'cep': _clean_cep(cep),
+            'cd': resultado_cd['cd_id'],
+            'distancia_km': round(principal['distancia'], 1),
+            'valor': principal['valor'],
+            'prazo': principal['prazo'],
+            'tem_estoque': resultado_cd['tem_estoque'],
+            'itens': len(produtos),
+            'peso_kg': round(peso_total, 2),
+            'opcoes': len(opcoes),
+        })
+        if len(envios) > 1:
+            resumo['envios'] = [
+                {'cd': e['cd_id'], 'valor': e['valor'], 'prazo': e['prazo'], 'codigos': e['codigos']}
+                for e in envios
+            ]
+
+    xml = EscritorXML()
+    xml.abrir('shipping')
+    xml.campo('cep', _clean_cep(cep))
+    xml.campo('price', f"{principal['valor']:.2f}")
+    xml.campo('delivery_time', principal['prazo'])
+    xml.campo('message', f"Frete calculado via {principal['transportadora']}")
+    xml.campo('carrier', principal['transportadora'])
+    xml.campo('distance', f"{principal['distancia']:.1f}")
+    xml.campo('origin', principal['origem'])
+    xml.abrir('options')
+    for opcao in opcoes:
+        xml.abrir('option')
+        xml.campo('code', opcao['codigo'])
+        xml.campo('service', opcao['servico'])
+        xml.campo('carrier', opcao['transportadora'])
+        xml.campo('origin', opcao['origem'])
+        xml.campo('price', f"{opcao['valor']:.2f}")
+        xml.campo('delivery_time', opcao['prazo'])
+        xml.campo('distance', f"{opcao['distancia']:.1f}")
+        xml.fechar()
+    return xml.terminar()
+
+def log_nova_requisicao(metodo):
+    log_frete.debug("Nova requisição de frete - %s", metodo)
+
+def _ms(inicio):
+    return round((time.perf_counter() - inicio) * 1000, 2)
+
+ETAPAS_COTACAO = ('parse', 'geo', 'ranking', 'estoque', 'preco')
+
+def registrar_cotacao(resumo, inicio, status):
+    """
+    Um registro JSON por cotação (CEP, CD, distância, valor, tempos em ms)
+    """
+    resumo['status'] = status
+    resumo['total_ms'] = _ms(inicio)
+    for etapa in ETAPAS_COTACAO:
+        ms = resumo.get(f'{etapa}_ms')
+        if ms is not None:
+            M_ETAPAS.observar(ms / 1000, etapa)
+    M_COTACOES.observar(resumo['total_ms'] / 1000, status)
+    if resumo.get('fallback_capital'):
+        M_EVENTOS.incrementar('fallback_capital')
+    if resumo.get('tem_estoque') is False:
+        M_EVENTOS.incrementar('sem_cd_com_estoque')
+    if resumo.get('origem_destino'):
+        M_EVENTOS.incrementar(f"destino_{resumo['origem_destino']}")
+    if resumo.get('envios'):
+        M_EVENTOS.incrementar('divisao_cds')
+    if resumo.get('cache'):
+        M_EVENTOS.incrementar('cache_cotacao')
+    for etapa in resumo.get('degradado', ()):
+        M_EVENTOS.incrementar(f"degradado_{etapa}")
+    log_cotacao.info(resumo)
+
+def log_erro_frete(e):
+    log_frete.exception("Erro ao calcular frete: %s", e)
+    return xml_erro(f'Erro ao calcular frete: {str(e)}')
+
 @app.route('/frete', methods=['GET', 'POST'])
 def calcular_frete():
     """
     Endpoint principal - calcula frete compatível com Tray
     """
+    inicio = time.perf_counter()
+    prazo = Prazo(FRETE_DEADLINE)
+    resumo = {}
     try:
-        print("\n" + "="*70)
-        print(f"📦 NOVA REQUISIÇÃO DE FRETE - {request.method}")
-        print("="*70)
+        log_nova_requisicao(request.method)
 
         params = request.form.to_dict() if request.method == 'POST' else request.args.to_dict()
-        print(f"Parâmetros: {params}")
+        erro, cep, produtos = preparar_cotacao(params)
+        resumo['parse_ms'] = _ms(inicio)
+        if erro:
+            registrar_cotacao(resumo, inicio, 400)
+            return Response(erro, mimetype='text/xml'), 400
+
+        chave, versao = chave_cotacao(cep, produtos), versao_cotacao()
+        marca = COTACAO_CACHE.marca()
+        em_cache = COTACAO_CACHE.obter(chave, versao)
+        if em_cache is not None:
+            resumo.update(em_cache['resumo'], cache=True)
+            registrar_cotacao(resumo, inicio, 200)
+            return Response(em_cache['xml'], mimetype='text/xml')
+
+        etapa = time.perf_counter()
+        distancias = ranking_setor(cep)
+        if distancias:
+            resumo['origem_destino'] = 'setor'
+        else:
+            coord_destino = buscar_coordenadas_ibge(cep, prazo)
+            resumo['geo_ms'] = _ms(etapa)
+            if not coord_destino:
+                resumo['cep'] = _clean_cep(cep)
+                registrar_cotacao(resumo, inicio, 400)
+                return Response(xml_erro('CEP inválido ou não encontrado'), mimetype='text/xml'), 400
+
+            log_calc.debug("Calculando distâncias para %s/%s", coord_destino['municipio'], coord_destino['uf'])
+            resumo['origem_destino'] = 'geo'
+            resumo['fallback_capital'] = bool(coord_destino.get('fallback_capital'))
+            etapa = time.perf_counter()
+            distancias = ranking_cds(coord_destino['lat'], coord_destino['lon'], coord_destino)
+        resumo['ranking_ms'] = _ms(etapa)
+
+        etapa = time.perf_counter()
+        codigos = codigos_distintos(produtos)
+        produtos_tray = buscar_estoques_tray(codigos, prazo=prazo)
+        resultado_cd = escolher_cd(distancias, codigos, produtos_tray, produtos, prazo)
+        alternativas = alternativas_cd(distancias, codigos, produtos_tray, resultado_cd)
+        resumo['estoque_ms'] = _ms(etapa)
+
+        etapa = time.perf_counter()
+        xml = montar_xml_frete(cep, produtos, resultado_cd, resumo, alternativas)
+        resumo['preco_ms'] = _ms(etapa)
+        if prazo.degradacoes:
+            resumo['degradado'] = prazo.degradacoes
+        guardar_cotacao(chave, versao, marca, produtos, xml, resumo)
+        registrar_cotacao(resumo, inicio, 200)
+        return Response(xml, mimetype='text/xml')
 
-        cep = params.get('cep_destino') or params.get('cep', '')
-        produtos_str = params.get('prods', '')
-
-        if not cep:
-            return Response(
-                '<?xml version="1.0" encoding="UTF-8"?><error>CEP não informado</error>',
-                mimetype='text/xml'
-            ), 400
+    except Exception as e:
+        registrar_cotacao(resumo, inicio, 500)
+        return Response(log_erro_frete(e), mimetype='text/xml'), 500
 
-        if not produtos_str:
-            return Response(
-                '<?xml version="1.0" encoding="UTF-8"?><error>Produtos não informados</error>',
-                mimetype='text/xml'
-            ), 400
+@app.route('/frete/batch', methods=['POST'])
+def calcular_frete_lote():
+    """
+    Cotação em lote - JSON {"itens": [{"cep": ..., "prods": ...}, ...]}
+    (ou a lista direto); responde NDJSON, uma linha por item
+    """
+    corpo = request.get_json(silent=True)
+    itens = corpo.get('itens') if isinstance(corpo, dict) else corpo
+    if not isinstance(itens, list) or not itens:
+        return jsonify({"erro": "Informe 'itens' como lista de {cep, prods}"}), 400
+    if len(itens) > LOTE_MAX_ITENS:
+        return jsonify({"erro": f"Máximo de {LOTE_MAX_ITENS} itens por lote"}), 400
+
+    entradas = []
+    for item in itens:
+        if isinstance(item, dict):
+            entradas.append((str(item.get('cep_destino') or item.get('cep') or ''), str(item.get('prods') or '')))
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            entradas.append((str(item[0] or ''), str(item[1] or '')))
+        else:
+            entradas.append(('', ''))
+
+    log_lote.info("%d cotações", len(entradas))
+
+    def gerar():
+        try:
+            for resultado in cotar_lote(entradas):
+                yield json.dumps(resultado, ensure_ascii=False) + '\n'
+        except Exception as e:
+            log_lote.exception("Erro: %s", e)
+            yield json.dumps({'erro': f'Erro ao calcular frete: {str(e)}'}, ensure_ascii=False) + '\n'
 
-        produtos = parse_produtos_tray(produtos_str)
-        if not produtos:
-            return Response(
-                '<?xml version="1.0" encoding="UTF-8"?><error>Formato de produtos inválido</error>',
-                mimetype='text/xml'
-            ), 400
-
-        peso_total = sum(p['peso'] * p['quantidade'] for p in produtos)
-        volume_total = sum(p['cubagem'] * p['quantidade'] for p in produtos)
-        qtd_total = sum(p['quantidade'] for p in produtos)
-        print(f"Quantidade total: {qtd_total}, Peso total: {peso_total:.2f} kg")
-
-        coord_destino = buscar_coordenadas_ibge(cep)
-        if not coord_destino:
-            return Response(
-                '<?xml version="1.0" encoding="UTF-8"?><error>CEP inválido ou não encontrado</error>',
-                mimetype='text/xml'
-            ), 400
-
-        print(f"[CALC] Calculando distâncias para {coord_destino['municipio']}/{coord_destino['uf']}")
-
-        resultado_cd = selecionar_melhor_cd(
-            coord_destino['lat'],
-            coord_destino['lon'],
-            produtos
-        )
+    return Response(gerar(), mimetype='application/x-ndjson')
 
-        cd_info = resultado_cd['cd_info']
-        distancia = resultado_cd['distancia']
-
-        valor_frete = calcular_valor_frete(distancia, peso_total, volume_total)
-        prazo = calcular_prazo_entrega(distancia)
-
-        print(f"\n{'='*70)")
-        print(f"🏢 CD Selecionado: {cd_info['nome']}")
-        print(f"📍 Origem: {cd_info['cidade']}/{cd_info['uf']}")
-        print(f"📏 Distância: {distancia:.1f} km")
-        print(f"📦 Estoque: {'Disponível' if resultado_cd['tem_estoque'] else 'Verificar'}")
-        print(f"💰 Valor: R$ {valor_frete:.2f}")
-        print(f"⏱️  Prazo: {prazo} dias")
-        print("="*70 + "\n")
-
-        xml_response = f'''<?xml version="1.0" encoding="UTF-8"?>
-<shipping>
-    <cep>{_clean_cep(cep)}</cep>
-    <price>{valor_frete:.2f}</price>
-    <delivery_time>{prazo}</delivery_time>
-    <message>Frete calculado via {cd_info['nome']}</message>
-    <carrier>{cd_info['nome']}</carrier>
-    <distance>{distancia:.1f}</distance>
-    <origin>{cd_info['cidade']}/{cd_info['uf']}</origin>
-</shipping>'''
-
-        return Response(xml_response, mimetype='text/xml')
+# Casca fixa da página de /teste (só destino e CDs mudam por requisição)
+TESTE_INICIO = """
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="utf-8">
+            <title>Teste de Frete - Multi-CD</title>
+            <style>
+                body { font-family: Arial; padding: 20px; background: #f5f5f5; }
+                .container { max-width: 800px; margin: 0 auto; background: white; padding: 30px; border-radius: 10px; }
+                h1 { color: #333; }
+                .info { background: #e3f2fd; padding: 15px; border-radius: 5px; margin: 20px 0; }
+                .cd { background: #f5f5f5; padding: 15px; margin: 10px 0; border-radius: 5px; border-left: 4px solid #2196F3; }
+                .cd.melhor { border-left-color: #4CAF50; background: #e8f5e9; }
+                .stats { display: flex; justify-content: space-between; margin: 20px 0; }
+                .stat { text-align: center; }
+                .stat-value { font-size: 24px; font-weight: bold; color: #2196F3; }
+                .stat-label { color: #666; font-size: 14px; }
+            </style>
+        </head>
+        <body>
+            <div class="container">
+                <h1>🚚 Teste de Frete Multi-CD</h1>
+"""
 
-    except Exception as e:
-        print(f"[ERRO] {e}")
-        import traceback
-        traceback.print_exc()
-        return Response(
-            f'<?xml version="1.0" encoding="UTF-8"?><error>Erro ao calcular frete: {str(e)}</error>',
-            mimetype='text/xml'
-        ), 500
+TESTE_FIM = """
+            </div>
+        </body>
+        </html>
+        """
 
 @app.route('/teste', methods=['GET'])
 def teste_frete():
@@ -479,6 +1424,8 @@ def teste_frete():
     try:
         cep = request.args.get('cep', '')
         produto = request.args.get('produto', 'PROD001')
+        # Carrinho no formato da Tray; sem `prods`, uma peça de exemplo (10 kg, 0,5 m³)
+        prods = request.args.get('prods') or f"100;100;50;0.5;1;10;{produto};0"
 
         if not cep:
             return jsonify({"erro": "Parâmetro 'cep' obrigatório"}), 400
@@ -487,31 +1434,20 @@ def teste_frete():
         if not coord:
             return jsonify({"erro": "CEP inválido"}), 400
 
-        distancias = calcular_distancias_cds(coord['lat'], coord['lon'])
+        try:
+            produtos = parse_produtos_tray(prods)
+        except CarrinhoExcedido:
+            produtos = None
+        if not produtos:
+            return jsonify({"erro": "Formato de produtos inválido"}), 400
+        # Mesma precificação do /frete
+        peso_total, volume_total, _ = totais_carrinho(produtos)
+        ocupacao = ocupacao_carrinho(produtos)
 
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <title>Teste de Frete - Multi-CD</title>
-            <style>
-                body {{ font-family: Arial; padding: 20px; background: #f5f5f5; }}
-                .container {{ max-width: 800px; margin: 0 auto; background: white; padding: 30px; border-radius: 10px; }}
-                h1 {{ color: #333; }}
-                .info {{ background: #e3f2fd; padding: 15px; border-radius: 5px; margin: 20px 0; }}
-                .cd {{ background: #f5f5f5; padding: 15px; margin: 10px 0; border-radius: 5px; border-left: 4px solid #2196F3; }}
-                .cd.melhor {{ border-left-color: #4CAF50; background: #e8f5e9; }}
-                .stats {{ display: flex; justify-content: space-between; margin: 20px 0; }}
-                .stat {{ text-align: center; }}
-                .stat-value {{ font-size: 24px; font-weight: bold; color: #2196F3; }}
-                .stat-label {{ color: #666; font-size: 14px; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>🚚 Teste de Frete Multi-CD</h1>
+        # Com o destino geocodificado: matriz rodoviária / fator da região, como no /frete
+        distancias = calcular_distancias_cds(coord['lat'], coord['lon'], coord)
 
+        partes = [TESTE_INICIO, f"""
                 <div class="info">
                     <h3>📍 Destino</h3>
                     <p><strong>CEP:</strong> {_clean_cep(cep)}</p>
@@ -521,15 +1457,15 @@ def teste_frete():
                 </div>
 
                 <h3>📊 Distâncias dos CDs</h3>
-        """
+        """]
 
         for i, d in enumerate(distancias):
             cd = d['cd_info']
             dist = d['distancia']
             prazo = calcular_prazo_entrega(dist)
-            valor = calcular_valor_frete(dist, 10.0, 0.5)  # Exemplo: 10kg, 0.5m³
+            valor = calcular_valor_frete(dist, peso_total, volume_total, ocupacao=ocupacao)
             classe = "cd melhor" if i == 0 else "cd"
-            html += f"""
+            partes.append(f"""
                 <div class="{classe}">
                     <h4>{'🏆 ' if i == 0 else ''}{cd['nome']}</h4>
                     <p><strong>Origem:</strong> {cd['cidade']}/{cd['uf']}</p>
@@ -548,13 +1484,10 @@ def teste_frete():
                         </div>
                     </div>
                 </div>
-            """
+            """)
 
-        html += """
-            </div>
-        </body>
-        </html>
-        """
+        partes.append(TESTE_FIM)
+        html = ''.join(partes)
 
         return html
 
@@ -564,10 +1497,13 @@ def teste_frete():
 @app.route('/cds', methods=['GET'])
 def listar_cds():
     """
-    Lista todos CDs disponíveis
+    Lista todos CDs disponíveis (pré-compilado, ver compilar_respostas)
     """
+    return servir_pronta('/cds')
+
+def dados_cds():
     cds = []
-    for cd_id, cd_info in CENTROS_DISTRIBUICAO.items():
+    for cd_id, cd_info in REGISTRO_CDS.atual().centros.items():
         cds.append({
             'id': cd_id,
             'nome': cd_info['nome'],
@@ -578,39 +1514,125 @@ def listar_cds():
             'lon': cd_info['lon']
         })
 
-    return jsonify({
+    return {
         'total': len(cds),
         'centros': cds
-    })
+    }
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """
-    Health check da API
+    Health check da API (estado em memória; upstreams pela última sonda)
     """
-    ibge_ok = True
-    try:
-        r = requests.get('https://servicodados.ibge.gov.br/api/v1/localidades/estados', timeout=3)
-        ibge_ok = r.status_code == 200
-    except:
-        ibge_ok = False
-
-    tray_ok = bool(TRAY_API_URL and TRAY_API_TOKEN)
+    pronto, checagens = prontidao()
 
     return jsonify({
         'status': 'ok',
+        'pronto': pronto,
         'timestamp': datetime.now().isoformat(),
-        'cds': len(CENTROS_DISTRIBUICAO),
-        'ibge_api': 'disponível' if ibge_ok else 'indisponível',
-        'tray_api': 'configurado' if tray_ok else 'não configurado',
+        'cds': REGISTRO_CDS.estatisticas(),
+        'tray_api': 'configurado' if _tray_configurada() else 'não configurado',
+        'checagens': checagens,
+        'sondas': MONITOR_SAUDE.estado(),
+        'cache_geo': GEO_CACHE.estatisticas(),
+        'cache_estoque': ESTOQUE_CACHE.estatisticas(),
+        'cache_cotacao': COTACAO_CACHE.estatisticas(),
+        'indice_cep': len(CEP_INDEX),
+        'municipios': len(MUNICIPIOS),
+        'distancias_rodoviarias': len(REGISTRO_CDS.atual().rotas),
+        'tabela_setores': len(REGISTRO_CDS.atual().setores),
+        'tabela_frete': TABELA_FRETE.estatisticas(),
+        'upstreams': {nome: c.estatisticas() for nome, c in UPSTREAMS.items()},
+        'geocodificacao': GEO_RESOLVEDOR.estatisticas(),
+        'processo': {
+            'pid': os.getpid(),
+            'pid_boot': BOOT['pid'],
+            'herdado_do_master': os.getpid() != BOOT['pid'],
+            'boot_s': BOOT['segundos'],
+            'memoria_boot': BOOT['memoria'],
+            'memoria': uso_memoria(),
+        },
         'versao': '2.0.0'
     })
 
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    """
+    Liveness: o processo responde (não olha upstreams)
+    """
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    """
+    Readiness: 200 se pronto para cotar, 503 caso contrário
+    """
+    pronto, checagens = prontidao()
+    return jsonify({
+        'pronto': pronto,
+        'checagens': checagens,
+        'circuitos': {nome: c.circuito() for nome, c in UPSTREAMS.items()},
+        'sondas': {nome: e['ok'] for nome, e in MONITOR_SAUDE.estado().items()},
+    }), 200 if pronto else 503
+
+@METRICAS.coletor
+def _metricas_caches():
+    geo = GEO_CACHE.estatisticas()
+    estoque = ESTOQUE_CACHE.estatisticas()
+    cotacao = COTACAO_CACHE.estatisticas()
+    estoque_total = estoque['hits'] + estoque['hits_stale'] + estoque['misses']
+    linhas = exportar_valores(
+        'frete_cache_eventos_total', 'Eventos dos caches', 'counter', ('cache', 'tipo'),
+        {**{('geo', k): geo[k] for k in ('hits_memoria', 'hits_disco', 'hits_negativos', 'misses')},
+         **{('estoque', k): estoque[k] for k in ('hits', 'hits_stale', 'misses', 'compartilhadas', 'chamadas_tray')},
+         **{('cotacao', k): cotacao[k] for k in ('hits_memoria', 'hits_disco', 'misses', 'invalidacoes')}}
+    )
+    linhas += exportar_valores(
+        'frete_cache_hit_ratio', 'Fração de consultas respondidas pelo cache', 'gauge', ('cache',),
+        {('geo',): geo['hit_ratio'],
+         ('estoque',): round((estoque['hits'] + estoque['hits_stale']) / estoque_total, 4) if estoque_total else 0.0,
+         ('cotacao',): cotacao['hit_ratio']}
+    )
+    linhas += exportar_valores(
+        'frete_upstream_circuito_aberto', '1 se o circuito do upstream está aberto', 'gauge', ('upstream',),
+        {(nome,): int(c.circuito() != 'fechado') for nome, c in UPSTREAMS.items()}
+    )
+    geo_provedores = GEO_RESOLVEDOR.estatisticas()['provedores']
+    linhas += exportar_valores(
+        'frete_geo_provedor_respostas_total', 'Respostas dos provedores de geocodificação', 'counter',
+        ('provedor', 'resultado'),
+        {(nome, k): st[k] for nome, st in geo_provedores.items()
+         for k in ('com_coordenadas', 'sem_coordenadas', 'nao_encontrado', 'falhas')}
+    )
+    linhas += exportar_valores(
+        'frete_geo_provedor_vitorias_total', 'Cotações em que o provedor deu as coordenadas primeiro', 'counter',
+        ('provedor',), {(nome,): st['vitorias'] for nome, st in geo_provedores.items()}
+    )
+    linhas += exportar_valores(
+        'frete_geo_provedor_latencia_ms', 'Latência média móvel (EWMA) do provedor', 'gauge', ('provedor',),
+        {(nome,): st['latencia_ewma_ms'] for nome, st in geo_provedores.items()}
+    )
+    linhas += exportar_valores(
+        'frete_processo_memoria_bytes', 'Memória do worker (privado = só dele)', 'gauge', ('tipo',),
+        {(k.removesuffix('_kb'),): v * 1024 for k, v in uso_memoria().items()}
+    )
+    return linhas
+
+@app.route('/metrics', methods=['GET'])
+def metricas():
+    """
+    Métricas do worker em formato texto do Prometheus
+    """
+    return Response(METRICAS.exportar(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/', methods=['GET'])
 def index():
     """
-    Página inicial da API
+    Página inicial da API (pré-compilada, ver compilar_respostas)
     """
+    return servir_pronta('/')
+
+def pagina_inicial():
     return f"""
     <!DOCTYPE html>
     <html>
@@ -732,13 +1754,13 @@ def index():
         <div class="container">
             <div class="header">
                 <h1>🚚 API Multi-CD</h1>
-                <p>Sistema Inteligente de Cálculo de Frete com 5 Centros de Distribuição</p>
+                <p>Sistema Inteligente de Cálculo de Frete com {len(REGISTRO_CDS.atual())} Centros de Distribuição</p>
             </div>
 
             <div class="content">
                 <div class="stats">
                     <div class="stat">
-                        <div class="stat-value">{len(CENTROS_DISTRIBUICAO)}</div>
+                        <div class="stat-value">{len(REGISTRO_CDS.atual())}</div>
                         <div class="stat-label">Centros de Distribuição</div>
                     </div>
                     <div class="stat">
@@ -760,7 +1782,7 @@ def index():
                             <p>📍 {cd['cidade']}/{cd['uf']}</p>
                             <p>📮 CEP: {cd['cep'][:5]}-{cd['cep'][5:]}</p>
                         </div>
-                        ''' for cd in CENTROS_DISTRIBUICAO.values()])}
+                        ''' for cd in REGISTRO_CDS.atual().lista])}
                     </div>
                 </div>
 
@@ -773,6 +1795,12 @@ def index():
                         <code>?cep_destino=90000000&prods=...</code>
                     </div>
 
+                    <div class="endpoint">
+                        <strong>POST /frete/batch</strong><br>
+                        Cotação em lote (NDJSON, uma linha por item)<br>
+                        <code>{{"itens": [{{"cep": "90000000", "prods": "..."}}]}}</code>
+                    </div>
+
                     <div class="endpoint">
                         <strong>GET /teste</strong><br>
                         Testa cálculo com interface visual<br>
@@ -790,6 +1818,12 @@ def index():
                         Status da API e serviços<br>
                         <code>Health check e monitoramento</code>
                     </div>
+
+                    <div class="endpoint">
+                        <strong>GET /health/live</strong> e <strong>GET /health/ready</strong><br>
+                        Liveness e readiness (503 se não estiver pronto)<br>
+                        <code>Sem chamadas externas na requisição</code>
+                    </div>
                 </div>
 
                 <div class="section" style="text-align: center;">
@@ -824,6 +1858,45 @@ def index():
     </html>
     """
 
+# =============================================================================
+# RESPOSTAS PRÉ-COMPILADAS
+# =============================================================================
+
+RESPOSTAS = {}
+
+def compilar_respostas():
+    """
+    Gera (de novo) os corpos de / e /cds com as variantes comprimidas;
+    chamar no boot e quando a configuração dos CDs mudar
+    """
+    global RESPOSTAS
+    RESPOSTAS = {
+        '/': RespostaPronta(pagina_inicial(), 'text/html; charset=utf-8'),
+        '/cds': RespostaPronta(app.json.dumps(dados_cds()) + '\n', 'application/json'),
+    }
+
+def servir_pronta(chave):
+    # Confere o arquivo de CDs: se mudou, a recarga recompila RESPOSTAS
+    REGISTRO_CDS.atual()
+    status, cabecalhos, corpo = RESPOSTAS[chave].responder(
+        request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding'))
+    return Response(corpo, status=status, headers=cabecalhos)
+
+compilar_respostas()
+
+# =============================================================================
+# TEMPO E MEMÓRIA DO BOOT
+# =============================================================================
+# Com preload (gunicorn.conf.py) este módulo roda uma vez no master e os
+# workers herdam os dados no fork: pid atual != BOOT['pid']
+BOOT = {
+    'pid': os.getpid(),
+    'segundos': round(time.perf_counter() - BOOT_INICIO, 3),
+    'memoria': uso_memoria(),
+}
+logging.getLogger('boot').info(
+    "Configuração e índices carregados em %.2fs (pid %d): %s", BOOT['segundos'], BOOT['pid'], resumo_memoria(BOOT['memoria']))
+
 # =============================================================================
 # INICIALIZAÇÃO DO SERVIDOR
 # =============================================================================
@@ -834,19 +1907,21 @@ if __name__ == '__main__':
     print("🚀 INICIANDO API MULTI-CD")
     print("="*70)
     print(f"🌐 Porta: {port}")
-    print(f"📦 CDs configurados: {len(CENTROS_DISTRIBUICAO)}")
+    print(f"📦 CDs configurados: {len(REGISTRO_CDS.atual())} ({CDS_PATH})")
     print(f"🔑 Token configurado: {'Sim' if TOKEN_SECRETO != 'teste123' else 'Não (usando padrão)'}")
     print(f"💰 Valor/km: R$ {DEFAULT_VALOR_KM:.2f}")
     print(f"🏪 Tray API: {'Configurada' if TRAY_API_URL else 'Não configurada'}")
     print("\n📍 Centros de Distribuição:")
-    for cd_id, cd in CENTROS_DISTRIBUICAO.items():
+    for cd_id, cd in REGISTRO_CDS.atual().centros.items():
         print(f"   {cd_id}: {cd['nome']} ({cd['cidade']}/{cd['uf']})")
     print("\n🔗 Endpoints disponíveis:")
     print(f"   http://localhost:{port}/")
     print(f"   http://localhost:{port}/frete")
+    print(f"   http://localhost:{port}/frete/batch")
     print(f"   http://localhost:{port}/teste")
     print(f"   http://localhost:{port}/cds")
     print(f"   http://localhost:{port}/health")
+    print(f"   http://localhost:{port}/metrics")
     print("="*70 + "\n")
 
     app.run(
@@ -0,0 +1,195 @@
+"""
+Modo ASGI da API
+
+O pipeline de /frete roda no event loop: a geocodificação vai para threads
+(os provedores usam os clientes HTTP síncronos) e a consulta de estoque
+aguarda os futures do cache de estoque sem prender nenhuma thread, de modo
+que um worker sobrepõe a espera de centenas de cotações. As demais rotas
+(/, /teste, /cds, /health) e requisições multipart caem no app Flask via
+ponte WSGI. O XML de /frete é o mesmo do modo WSGI.
+
+Subir:
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from a2wsgi import WSGIMiddleware
+
+import app as api
+from prazo import Prazo
+
+GEO_MAX_WORKERS = int(os.getenv('GEO_MAX_WORKERS', 32))
+
+_flask = WSGIMiddleware(api.app, workers=int(os.getenv('WSGI_MAX_WORKERS', 10)))
+_geo_executor = ThreadPoolExecutor(max_workers=GEO_MAX_WORKERS, thread_name_prefix='geo')
+
+
+# =============================================================================
+# PIPELINE ASSÍNCRONO
+# =============================================================================
+
+async def buscar_coordenadas_async(cep, prazo=None):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_geo_executor, api.buscar_coordenadas_ibge, cep, prazo)
+
+
+async def buscar_estoques_tray_async(codigos, deadline=None, prazo=None):
+    """
+    Mesma semântica de buscar_estoques_tray, aguardando no event loop
+    """
+    if not api._tray_configurada():
+        api.log_tray.debug("API não configurada, assumindo estoque disponível")
+        return {}
+    if not codigos:
+        return {}
+
+    if deadline is None:
+        deadline = api.TRAY_ESTOQUE_DEADLINE
+    if prazo is not None:
+        deadline = prazo.limitar(deadline)
+
+    # Os futures do cache são compartilhados: nunca cancelar os pendentes
+    futures = {codigo: asyncio.wrap_future(api.ESTOQUE_CACHE.obter_future(codigo)) for codigo in codigos}
+    _, pendentes = await asyncio.wait(futures.values(), timeout=deadline)
+    if pendentes:
+        if prazo is not None:
+            prazo.degradar('estoque')
+        api.log_tray.warning("%d produto(s) sem resposta em %.1fs, assumindo estoque", len(pendentes), deadline)
+
+    return {
+        codigo: None if future in pendentes else future.result()
+        for codigo, future in futures.items()
+    }
+
+
+async def calcular_frete_async(metodo, params):
+    """
+    Retorna (status, xml)
+    """
+    inicio = time.perf_counter()
+    prazo = Prazo(api.FRETE_DEADLINE)
+    resumo = {'modo': 'asgi'}
+    try:
+        api.log_nova_requisicao(metodo)
+
+        erro, cep, produtos = api.preparar_cotacao(params)
+        resumo['parse_ms'] = api._ms(inicio)
+        if erro:
+            api.registrar_cotacao(resumo, inicio, 400)
+            return 400, erro
+
+        chave, versao = api.chave_cotacao(cep, produtos), api.versao_cotacao()
+        marca = api.COTACAO_CACHE.marca()
+        em_cache = api.COTACAO_CACHE.obter(chave, versao)
+        if em_cache is not None:
+            resumo.update(em_cache['resumo'], cache=True)
+            api.registrar_cotacao(resumo, inicio, 200)
+            return 200, em_cache['xml']
+
+        etapa = time.perf_counter()
+        distancias = api.ranking_setor(cep)
+        if distancias:
+            resumo['origem_destino'] = 'setor'
+        else:
+            coord_destino = await buscar_coordenadas_async(cep, prazo)
+            resumo['geo_ms'] = api._ms(etapa)
+            if not coord_destino:
+                resumo['cep'] = api._clean_cep(cep)
+                api.registrar_cotacao(resumo, inicio, 400)
+                return 400, api.xml_erro('CEP inválido ou não encontrado')
+
+            api.log_calc.debug("Calculando distâncias para %s/%s", coord_destino['municipio'], coord_destino['uf'])
+            resumo['origem_destino'] = 'geo'
+            resumo['fallback_capital'] = bool(coord_destino.get('fallback_capital'))
+            etapa = time.perf_counter()
+            distancias = api.ranking_cds(coord_destino['lat'], coord_destino['lon'], coord_destino)
+        resumo['ranking_ms'] = api._ms(etapa)
+
+        etapa = time.perf_counter()
+        codigos = api.codigos_distintos(produtos)
+        produtos_tray = await buscar_estoques_tray_async(codigos, prazo=prazo)
+        resultado_cd = api.escolher_cd(distancias, codigos, produtos_tray, produtos, prazo)
+        alternativas = api.alternativas_cd(distancias, codigos, produtos_tray, resultado_cd)
+        resumo['estoque_ms'] = api._ms(etapa)
+
+        etapa = time.perf_counter()
+        xml = api.montar_xml_frete(cep, produtos, resultado_cd, resumo, alternativas)
+        resumo['preco_ms'] = api._ms(etapa)
+        if prazo.degradacoes:
+            resumo['degradado'] = prazo.degradacoes
+        api.guardar_cotacao(chave, versao, marca, produtos, xml, resumo)
+        api.registrar_cotacao(resumo, inicio, 200)
+        return 200, xml
+
+    except Exception as e:
+        api.registrar_cotacao(resumo, inicio, 500)
+        return 500, api.log_erro_frete(e)
+
+
+# =============================================================================
+# ASGI
+# =============================================================================
+
+def _primeiros(pares):
+    # Igual a MultiDict.to_dict() do Flask: fica o primeiro valor de cada chave
+    params = {}
+    for chave, valor in pares:
+        params.setdefault(chave, valor)
+    return params
+
+
+def _cabecalho(scope, nome):
+    for chave, valor in scope.get('headers', ()):
+        if chave == nome:
+            return valor.decode('latin-1')
+    return ''
+
+
+async def _ler_corpo(receive):
+    partes = []
+    while True:
+        mensagem = await receive()
+        partes.append(mensagem.get('body', b''))
+        if not mensagem.get('more_body'):
+            return b''.join(partes)
+
+
+async def _frete(scope, receive, send):
+    api._iniciar_aquecimento_estoque()
+    api._iniciar_sondagem()
+    metodo = scope['method']
+    if metodo == 'POST':
+        corpo = await _ler_corpo(receive)
+        params = _primeiros(parse_qsl(corpo.decode('utf-8', 'replace'), keep_blank_values=True))
+    else:
+        # werkzeug decodifica a query string como UTF-8 (com substituição)
+        params = _primeiros(parse_qsl(scope.get('query_string', b'').decode('utf-8', 'replace'), keep_blank_values=True))
+
+    status, xml = await calcular_frete_async(metodo, params)
+    corpo = xml.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'text/xml; charset=utf-8'),
+            (b'content-length', str(len(corpo)).encode()),
+            # mesmo CORS aberto do flask_cors
+            (b'access-control-allow-origin', b'*'),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': corpo})
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == '/frete' and scope['method'] in ('GET', 'POST'):
+        tipo = _cabecalho(scope, b'content-type').lower()
+        # POST sem Content-Type ou de outro tipo vai para o Flask, que o lê
+        # como formulário vazio: mesmo contrato nos dois caminhos
+        if scope['method'] == 'GET' or tipo.startswith('application/x-www-form-urlencoded'):
+            await _frete(scope, receive, send)
+            return
+    await _flask(scope, receive, send)
@@ -0,0 +1,109 @@
+"""
+Servidores locais que imitam BrasilAPI (cep/v2), ViaCEP (ws/<cep>/json) e
+Tray (/products), com latência, taxa de erro e taxa de timeout configuráveis
+"""
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CDS_TRAY = ('CD_RS', 'CD_SC', 'CD_MG', 'CD_MS', 'CD_CE')
+
+
+class Perfil:
+    """
+    latencia: segundos (média); jitter: fração da latência;
+    erro: probabilidade de 503; timeout: probabilidade de não responder
+    dentro de `segura` segundos
+    """
+
+    def __init__(self, latencia=0.02, jitter=0.3, erro=0.0, timeout=0.0, segura=30.0):
+        self.latencia = latencia
+        self.jitter = jitter
+        self.erro = erro
+        self.timeout = timeout
+        self.segura = segura
+
+    def esperar(self):
+        """
+        Dorme a latência sorteada; retorna o status a responder (None = segurou)
+        """
+        sorteio = random.random()
+        if sorteio < self.timeout:
+            time.sleep(self.segura)
+            return None
+        variacao = self.latencia * self.jitter
+        time.sleep(max(0.0, random.uniform(self.latencia - variacao, self.latencia + variacao)))
+        if sorteio < self.timeout + self.erro:
+            return 503
+        return 200
+
+
+def _coordenadas(cep):
+    # Determinístico por CEP, espalhado pelo território
+    h = zlib.crc32(cep.encode())
+    return -33.0 + (h % 3800) / 100.0, -73.0 + ((h // 3800) % 3800) / 100.0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    servico = None
+    perfil = None
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status, corpo):
+        dados = json.dumps(corpo).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_GET(self):
+        status = self.perfil.esperar()
+        if status is None:
+            return
+        if status != 200:
+            self._responder(status, {'erro': 'indisponível'})
+            return
+        url = urlparse(self.path)
+        partes = [p for p in url.path.split('/') if p]
+        self._responder(*getattr(self, f'_{self.servico}')(partes, parse_qs(url.query)))
+
+    def _brasilapi(self, partes, _):
+        cep = partes[-1]
+        lat, lon = _coordenadas(cep)
+        dados = {'cep': cep, 'state': 'SP', 'city': f'Cidade {cep[:3]}'}
+        # ~20% sem coordenadas: força o caminho ViaCEP -> capital
+        if zlib.crc32(cep.encode()) % 5:
+            dados['location'] = {'type': 'Point', 'coordinates': {'latitude': str(lat), 'longitude': str(lon)}}
+        return 200, dados
+
+    def _viacep(self, partes, _):
+        cep = partes[-2]
+        return 200, {'cep': cep, 'localidade': f'Cidade {cep[:3]}', 'uf': 'SP'}
+
+    def _tray(self, partes, query):
+        referencia = (query.get('reference') or [''])[0]
+        h = zlib.crc32(referencia.encode())
+        produto = {'reference': referencia, 'stock': h % 50}
+        for i, cd in enumerate(CDS_TRAY):
+            # ~1 em 4 produtos sem estoque em cada CD
+            produto[f'stock_{cd}'] = 0 if (h >> i) % 4 == 0 else (h >> i) % 30 + 1
+        return 200, {'products': [produto]}
+
+
+def iniciar(servico, perfil):
+    """
+    Sobe o servidor fake numa thread; retorna (servidor, url_base)
+    """
+    handler = type(f'Handler_{servico}', (_Handler,), {'servico': servico, 'perfil': perfil})
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name=f'fake-{servico}', daemon=True).start()
+    return servidor, f'http://127.0.0.1:{servidor.server_port}'
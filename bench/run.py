@@ -0,0 +1,302 @@
+"""
+Benchmark e teste de carga de /frete
+
+Cada cenário roda num subprocesso limpo (caches vazios): sobe os fakes de
+BrasilAPI/ViaCEP/Tray com o perfil do cenário, sobe a API apontando para eles
+e dispara /frete com carrinhos e CEPs sorteados. Também mede micro-benchmarks
+das funções quentes. O resultado vai para bench/resultados/<data>-<commit>.json.
+
+    python bench/run.py                          # todos os cenários + micro
+    python bench/run.py -c lento -n 2000 -j 32   # um cenário
+    python bench/run.py --modo asgi              # mesmo teste no modo ASGI
+    python bench/run.py --comparar antes.json depois.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes  # noqa: E402
+
+# perfil de cada upstream: latência (s), erro (503) e timeout (não responde)
+CENARIOS = {
+    'rapido': {'latencia': 0.01, 'erro': 0.0, 'timeout': 0.0},
+    'lento': {'latencia': 0.15, 'erro': 0.0, 'timeout': 0.0},
+    'instavel': {'latencia': 0.05, 'erro': 0.10, 'timeout': 0.02},
+}
+
+N_CEPS = 300
+N_SKUS = 500
+
+
+# =============================================================================
+# CARGA
+# =============================================================================
+
+def _cep_sorteado(rnd):
+    # Zipf aproximado: poucos CEPs concentram a maior parte das cotações
+    return '%08d' % (10000000 + int(N_CEPS * rnd.random() ** 3) * 290011)
+
+
+def _carrinho_sorteado(rnd):
+    linhas = []
+    for _ in range(rnd.choice((1, 1, 1, 2, 2, 3, 5, 10, 20))):
+        sku = 'SKU%04d' % rnd.randrange(N_SKUS)
+        linhas.append(f"{rnd.randint(30, 300)};{rnd.randint(30, 250)};{rnd.randint(30, 250)};"
+                      f"{rnd.uniform(0.01, 2):.3f};{rnd.randint(1, 4)};{rnd.uniform(1, 80):.2f};{sku};"
+                      f"{rnd.uniform(50, 5000):.2f}")
+    return '/'.join(linhas)
+
+
+def _percentil(ordenados, p):
+    if not ordenados:
+        return 0.0
+    i = min(len(ordenados) - 1, max(0, int(round(p / 100.0 * len(ordenados) + 0.5)) - 1))
+    return ordenados[i]
+
+
+def _subir_api(modo):
+    """
+    Sobe a API em thread, no modo pedido; retorna a URL base
+    """
+    if modo == 'asgi':
+        import uvicorn
+        import asgi
+        config = uvicorn.Config(asgi.app, host='127.0.0.1', port=0, log_level='warning', access_log=False)
+        servidor = uvicorn.Server(config)
+        threading.Thread(target=servidor.run, daemon=True).start()
+        while not servidor.started:
+            time.sleep(0.01)
+        porta = servidor.servers[0].sockets[0].getsockname()[1]
+        return f'http://127.0.0.1:{porta}'
+
+    from werkzeug.serving import make_server
+    import app
+    servidor = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{servidor.server_port}'
+
+
+def rodar_cenario(nome, requisicoes, concorrencia, modo, semente):
+    perfil = fakes.Perfil(**CENARIOS[nome])
+    _, url_brasilapi = fakes.iniciar('brasilapi', perfil)
+    _, url_viacep = fakes.iniciar('viacep', perfil)
+    _, url_tray = fakes.iniciar('tray', perfil)
+
+    tmp = tempfile.mkdtemp(prefix='bench-frete-')
+    os.environ.update({
+        'BRASILAPI_URL': f'{url_brasilapi}/api/cep/v2',
+        'VIACEP_URL': f'{url_viacep}/ws',
+        'TRAY_API_URL': url_tray,
+        'TRAY_API_TOKEN': 'bench',
+        'GEO_CACHE_PATH': os.path.join(tmp, 'geocache.sqlite3'),
+        'COTACAO_CACHE_PATH': os.path.join(tmp, 'cotacao_cache.sqlite3'),
+        'CEP_INDEX_PATH': '',
+        'TABELA_SETORES_PATH': '',
+        'LOG_NIVEL': 'WARNING',
+    })
+    os.environ.setdefault('HTTP_TIMEOUT', '1.0')
+
+    import requests
+    base = _subir_api(modo)
+    rnd = random.Random(semente)
+    pedidos = [{'cep_destino': _cep_sorteado(rnd), 'prods': _carrinho_sorteado(rnd)} for _ in range(requisicoes)]
+
+    local = threading.local()
+
+    def disparar(params):
+        sessao = getattr(local, 'sessao', None)
+        if sessao is None:
+            sessao = local.sessao = requests.Session()
+        inicio = time.perf_counter()
+        try:
+            status = sessao.post(f'{base}/frete', data=params, timeout=30).status_code
+        except requests.RequestException:
+            status = 'erro'
+        return (time.perf_counter() - inicio) * 1000, status
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as ex:
+        resultados = list(ex.map(disparar, pedidos))
+    duracao = time.perf_counter() - inicio
+
+    latencias = sorted(r[0] for r in resultados)
+    status = {}
+    for _, s in resultados:
+        status[str(s)] = status.get(str(s), 0) + 1
+
+    return {
+        'cenario': nome,
+        'modo': modo,
+        'perfil': CENARIOS[nome],
+        'requisicoes': requisicoes,
+        'concorrencia': concorrencia,
+        'duracao_s': round(duracao, 3),
+        'throughput_rps': round(requisicoes / duracao, 1),
+        'latencia_ms': {
+            'p50': round(_percentil(latencias, 50), 2),
+            'p95': round(_percentil(latencias, 95), 2),
+            'p99': round(_percentil(latencias, 99), 2),
+            'max': round(latencias[-1], 2),
+            'media': round(sum(latencias) / len(latencias), 2),
+        },
+        'status': status,
+    }
+
+
+# =============================================================================
+# MICRO-BENCHMARKS
+# =============================================================================
+
+def rodar_micro():
+    os.environ.update({'LOG_NIVEL': 'WARNING', 'CEP_INDEX_PATH': '', 'TABELA_SETORES_PATH': '',
+                       'GEO_CACHE_PATH': '', 'COTACAO_CACHE_PATH': '', 'TRAY_API_URL': '', 'TRAY_API_TOKEN': ''})
+    import app
+
+    rnd = random.Random(1)
+    prods_10 = '/'.join(_carrinho_sorteado(rnd) for _ in range(3))
+    prods_200 = '/'.join(_carrinho_sorteado(rnd) for _ in range(40))
+    produtos = app.parse_produtos_tray(prods_10)
+    distancias = app.calcular_distancias_cds(-23.55, -46.63)
+    resultado_cd = dict(distancias[0], tem_estoque=True)
+    # Carrinho com produtos do cadastro da planilha (referência = nome): vai pela ocupação, como no /frete
+    tabela = app.TABELA_FRETE.atual()
+    nomes = sorted(tabela.produtos)[:3] if tabela else []
+    catalogados = app.parse_produtos_tray('/'.join(f"200;180;180;5;1;90;{nome};0" for nome in nomes))
+    ocupacao = app.ocupacao_carrinho(catalogados)
+
+    casos = {
+        'haversine': lambda: app.haversine(-27.3636, -53.3978, -23.55, -46.63),
+        # ranking completo x só o primeiro CD (o que a cotação com estoque percorre)
+        'calcular_distancias_cds': lambda: list(app.calcular_distancias_cds(-23.55, -46.63)),
+        'cd_mais_proximo': lambda: app.calcular_distancias_cds(-23.55, -46.63)[0],
+        'parse_produtos_tray_10': lambda: app.parse_produtos_tray(prods_10),
+        'parse_produtos_tray_200': lambda: app.parse_produtos_tray(prods_200),
+        'calcular_valor_frete': lambda: app.calcular_valor_frete(812.4, 42.0, 1.3),
+        'ocupacao_carrinho': lambda: app.ocupacao_carrinho(catalogados),
+        'calcular_valor_frete_ocupacao': lambda: app.calcular_valor_frete(812.4, 42.0, 1.3, ocupacao=ocupacao),
+        'montar_xml_frete': lambda: app.montar_xml_frete('01310100', produtos, resultado_cd),
+    }
+    resultado = {}
+    for nome, funcao in casos.items():
+        n, _ = timeit.Timer(funcao).autorange()
+        melhor = min(timeit.repeat(funcao, number=n, repeat=5))
+        resultado[nome] = {'ns_por_op': round(melhor / n * 1e9, 1)}
+    return resultado
+
+
+# =============================================================================
+# ORQUESTRAÇÃO
+# =============================================================================
+
+def _subprocesso(args):
+    # O resultado volta por arquivo: o stdout do filho é dos logs da API
+    with tempfile.NamedTemporaryFile(suffix='.json') as tmp:
+        subprocess.run([sys.executable, os.path.abspath(__file__), *args, '--saida', tmp.name],
+                       cwd=RAIZ, stdout=subprocess.DEVNULL, check=True)
+        with open(tmp.name) as f:
+            return json.load(f)
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ,
+                              capture_output=True, text=True).stdout.strip() or 'sem-git'
+    except OSError:
+        return 'sem-git'
+
+
+def comparar(caminho_a, caminho_b):
+    with open(caminho_a) as f:
+        a = json.load(f)
+    with open(caminho_b) as f:
+        b = json.load(f)
+    print(f"{'':32} {a['commit']:>12} {b['commit']:>12} {'variação':>10}")
+    for nome, ma in a['micro'].items():
+        mb = b['micro'].get(nome)
+        if mb:
+            print(f"{nome + ' (ns)':32} {ma['ns_por_op']:>12} {mb['ns_por_op']:>12} "
+                  f"{(mb['ns_por_op'] / ma['ns_por_op'] - 1) * 100:>+9.1f}%")
+    cenarios_b = {c['cenario']: c for c in b['cenarios']}
+    for ca in a['cenarios']:
+        cb = cenarios_b.get(ca['cenario'])
+        if not cb:
+            continue
+        for metrica in ('p50', 'p95', 'p99'):
+            va, vb = ca['latencia_ms'][metrica], cb['latencia_ms'][metrica]
+            print(f"{ca['cenario'] + ' ' + metrica + ' (ms)':32} {va:>12} {vb:>12} {(vb / va - 1) * 100 if va else 0:>+9.1f}%")
+        va, vb = ca['throughput_rps'], cb['throughput_rps']
+        print(f"{ca['cenario'] + ' req/s':32} {va:>12} {vb:>12} {(vb / va - 1) * 100 if va else 0:>+9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark da API de frete')
+    parser.add_argument('-c', '--cenario', action='append', choices=sorted(CENARIOS),
+                        help='cenário a rodar (pode repetir; padrão: todos)')
+    parser.add_argument('-n', '--requisicoes', type=int, default=500)
+    parser.add_argument('-j', '--concorrencia', type=int, default=16)
+    parser.add_argument('--modo', choices=('wsgi', 'asgi'), default='wsgi')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--sem-micro', action='store_true')
+    parser.add_argument('--saida', help='arquivo JSON de saída')
+    parser.add_argument('--comparar', nargs=2, metavar=('A', 'B'))
+    parser.add_argument('--interno', choices=('cenario', 'micro'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.comparar:
+        comparar(*args.comparar)
+        return
+
+    if args.interno:
+        if args.interno == 'micro':
+            resultado = rodar_micro()
+        else:
+            resultado = rodar_cenario(args.cenario[0], args.requisicoes, args.concorrencia,
+                                      args.modo, args.semente)
+        with open(args.saida, 'w') as f:
+            json.dump(resultado, f)
+        return
+
+    resultado = {
+        'commit': _commit(),
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'micro': {},
+        'cenarios': [],
+    }
+    if not args.sem_micro:
+        resultado['micro'] = _subprocesso(['--interno', 'micro'])
+        for nome, m in resultado['micro'].items():
+            print(f"[MICRO] {nome}: {m['ns_por_op']} ns/op")
+
+    for nome in args.cenario or sorted(CENARIOS):
+        r = _subprocesso(['--interno', 'cenario', '-c', nome, '-n', str(args.requisicoes),
+                          '-j', str(args.concorrencia), '--modo', args.modo, '--semente', str(args.semente)])
+        resultado['cenarios'].append(r)
+        lat = r['latencia_ms']
+        print(f"[CARGA] {nome}/{args.modo}: {r['throughput_rps']} req/s, p50 {lat['p50']} ms, "
+              f"p95 {lat['p95']} ms, p99 {lat['p99']} ms, status {r['status']}")
+
+    saida = args.saida or os.path.join(
+        RAIZ, 'bench', 'resultados', f"{datetime.now():%Y%m%d-%H%M%S}-{resultado['commit']}.json")
+    os.makedirs(os.path.dirname(saida), exist_ok=True)
+    with open(saida, 'w') as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"Resultados em {saida}")
+
+
+if __name__ == '__main__':
+    main()
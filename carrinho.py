@@ -0,0 +1,106 @@
+"""
+Parser do parâmetro `prods` da Tray
+
+Formato: itens separados por '/', campos por ';':
+    comp;larg;alt;cubagem;quantidade;peso;codigo;valor
+
+Uma passada só sobre a string: cada item vira um Produto (__slots__, sem
+dict por linha) e os totais de peso, volume e quantidade são somados no
+caminho. Payload acima de `max_bytes` ou com mais de `max_linhas` itens é
+recusado antes de consumir memória com ele.
+"""
+import logging
+
+log = logging.getLogger('parse')
+
+
+class CarrinhoExcedido(ValueError):
+    """
+    Payload de produtos acima dos limites configurados
+    """
+
+
+class Produto:
+    __slots__ = ('comprimento', 'largura', 'altura', 'cubagem', 'quantidade', 'peso', 'codigo', 'valor')
+
+    def __init__(self, comprimento, largura, altura, cubagem, quantidade, peso, codigo, valor):
+        self.comprimento = comprimento
+        self.largura = largura
+        self.altura = altura
+        self.cubagem = cubagem
+        self.quantidade = quantidade
+        self.peso = peso
+        self.codigo = codigo
+        self.valor = valor
+
+    def __repr__(self):
+        return f'Produto({self.codigo!r}, quantidade={self.quantidade}, peso={self.peso})'
+
+
+class Carrinho(list):
+    """
+    Lista de Produto com os totais calculados no parse
+    """
+    __slots__ = ('peso_total', 'volume_total', 'qtd_total')
+
+    def __init__(self):
+        super().__init__()
+        self.peso_total = 0.0
+        self.volume_total = 0.0
+        self.qtd_total = 0
+
+
+def parse_produtos(produtos_str, max_linhas=None, max_bytes=None):
+    """
+    Retorna um Carrinho; itens com menos de 8 campos são ignorados e itens
+    com número inválido são ignorados com log. Levanta CarrinhoExcedido.
+    """
+    carrinho = Carrinho()
+    texto = (produtos_str or '').strip('/ ')
+    # Cada caractere ocupa de 1 a 4 bytes em UTF-8: só codifica quando a
+    # contagem de caracteres não decide sozinha
+    if max_bytes is not None and len(texto) * 4 > max_bytes:
+        tamanho = len(texto) if len(texto) > max_bytes else len(texto.encode('utf-8'))
+        if tamanho > max_bytes:
+            raise CarrinhoExcedido(f"prods com mais de {max_bytes} bytes")
+
+    peso_total = volume_total = 0.0
+    qtd_total = 0
+    linhas = 0
+    inicio = 0
+    fim_texto = len(texto)
+    while inicio <= fim_texto:
+        fim = texto.find('/', inicio)
+        if fim < 0:
+            fim = fim_texto
+        item = texto[inicio:fim].strip()
+        inicio = fim + 1
+        if not item:
+            continue
+
+        linhas += 1
+        if max_linhas is not None and linhas > max_linhas:
+            raise CarrinhoExcedido(f"prods com mais de {max_linhas} itens")
+
+        campos = item.split(';')
+        if len(campos) < 8:
+            continue
+        try:
+            # float()/int() já ignoram espaços em volta
+            produto = Produto(
+                float(campos[0]), float(campos[1]), float(campos[2]), float(campos[3]),
+                int(campos[4]), float(campos[5]), campos[6].strip(), float(campos[7])
+            )
+        except ValueError:
+            log.info("Ignorando item inválido: %s", item)
+            continue
+
+        carrinho.append(produto)
+        peso_total += produto.peso * produto.quantidade
+        volume_total += produto.cubagem * produto.quantidade
+        qtd_total += produto.quantidade
+
+    carrinho.peso_total = peso_total
+    carrinho.volume_total = volume_total
+    carrinho.qtd_total = qtd_total
+    return carrinho
@@ -0,0 +1,193 @@
+"""
+Índice offline CEP -> município/UF/coordenadas
+
+Mapeia prefixos de CEP (setor de 5 dígitos e sub-região de 3 dígitos) para o
+centróide dos CEPs conhecidos daquele prefixo. É gerado uma única vez a partir
+de um arquivo CSV em massa e lido via mmap como arrays ordenados, de modo
+que a consulta é uma busca binária, sem rede.
+
+Gerar o índice:
+    python cep_index.py build ceps.csv cep_index.bin
+
+O CSV precisa das colunas: cep, municipio, uf, lat, lon
+"""
+import csv
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+MAGIC = b'CEPIDX01'
+# n_setores(5 dígitos), n_subregioes(3 dígitos), n_nomes, bytes da tabela de nomes
+CABECALHO = struct.Struct('<8sIIII')
+
+log = logging.getLogger('cepidx')
+
+
+def _alinhar(n):
+    # arrays começam em offset múltiplo de 4
+    return (n + 3) & ~3
+
+
+def _clean_cep(cep):
+    return ''.join(ch for ch in (cep or '') if ch.isdigit())
+
+
+class IndiceCEP:
+    """
+    Para cada nível, chaves ordenadas (uint32) e colunas paralelas de
+    lat/lon (float32) e id do município (uint32).
+    """
+
+    def __init__(self):
+        self.niveis = {}   # digitos -> (chaves, lat, lon, municipio)
+        self.nomes = []    # id -> (municipio, uf)
+        self._mmap = None
+
+    def __len__(self):
+        return sum(len(n[0]) for n in self.niveis.values())
+
+    @classmethod
+    def carregar(cls, caminho):
+        """
+        Carrega o índice binário gerado por `build`. As colunas são views
+        sobre o mmap (zero-cópia): as páginas ficam no page cache e são
+        compartilhadas entre os workers do gunicorn.
+        """
+        indice = cls()
+        with open(caminho, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, n5, n3, n_nomes, tam_nomes = CABECALHO.unpack_from(mm, 0)
+        if magic != MAGIC:
+            mm.close()
+            raise ValueError(f"Arquivo de índice inválido: {caminho}")
+
+        buf = memoryview(mm)
+        pos = CABECALHO.size
+        nomes = bytes(buf[pos:pos + tam_nomes]).decode('utf-8').split('\n') if n_nomes else []
+        indice.nomes = [tuple(n.split('|', 1)) for n in nomes]
+        pos += _alinhar(tam_nomes)
+
+        for digitos, n in ((5, n5), (3, n3)):
+            colunas = []
+            for tipo in ('I', 'f', 'f', 'I'):
+                colunas.append(buf[pos:pos + 4 * n].cast(tipo))
+                pos += 4 * n
+            indice.niveis[digitos] = tuple(colunas)
+        indice._mmap = mm
+        return indice
+
+    def buscar(self, cep):
+        """
+        Retorna {'municipio','uf','lat','lon','precisao'} ou None.
+        Tenta primeiro o setor (5 dígitos), depois a sub-região (3 dígitos).
+        """
+        cep = _clean_cep(cep)
+        if len(cep) != 8:
+            return None
+        for digitos in (5, 3):
+            nivel = self.niveis.get(digitos)
+            if not nivel:
+                continue
+            chaves, lat, lon, mun = nivel
+            chave = int(cep[:digitos])
+            i = bisect_left(chaves, chave)
+            if i < len(chaves) and chaves[i] == chave:
+                municipio, uf = self.nomes[mun[i]]
+                return {
+                    'municipio': municipio,
+                    'uf': uf,
+                    'lat': round(lat[i], 5),
+                    'lon': round(lon[i], 5),
+                    'precisao': f'cep{digitos}'
+                }
+        return None
+
+
+def carregar_indice(caminho):
+    """
+    Carrega o índice se o arquivo existir; em caso de erro retorna índice vazio
+    """
+    if not caminho or not os.path.exists(caminho):
+        return IndiceCEP()
+    try:
+        indice = IndiceCEP.carregar(caminho)
+        log.info("Índice carregado: %d prefixos (%s)", len(indice), caminho)
+        return indice
+    except Exception as e:
+        log.warning("Erro ao carregar índice %s: %s", caminho, e)
+        return IndiceCEP()
+
+
+# =============================================================================
+# BUILD (CLI)
+# =============================================================================
+
+def _agregar(linhas, digitos):
+    """
+    Agrupa CEPs por prefixo: centróide das coordenadas e município mais frequente
+    """
+    soma = defaultdict(lambda: [0.0, 0.0, 0])
+    municipios = defaultdict(Counter)
+    for cep, municipio, uf, lat, lon in linhas:
+        chave = int(cep[:digitos])
+        acc = soma[chave]
+        acc[0] += lat
+        acc[1] += lon
+        acc[2] += 1
+        municipios[chave][(municipio, uf)] += 1
+
+    resultado = []
+    for chave in sorted(soma):
+        s_lat, s_lon, n = soma[chave]
+        resultado.append((chave, s_lat / n, s_lon / n, municipios[chave].most_common(1)[0][0]))
+    return resultado
+
+
+def build(entrada, saida):
+    linhas = []
+    with open(entrada, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            cep = _clean_cep(row.get('cep'))
+            if len(cep) != 8:
+                continue
+            try:
+                lat = float(row['lat'])
+                lon = float(row['lon'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            linhas.append((cep, (row.get('municipio') or '').strip(), (row.get('uf') or '').strip().upper(), lat, lon))
+
+    nomes = {}
+    niveis = {}
+    for digitos in (5, 3):
+        niveis[digitos] = _agregar(linhas, digitos)
+        for _, _, _, nome in niveis[digitos]:
+            nomes.setdefault(nome, len(nomes))
+
+    tabela_nomes = '\n'.join(f'{m}|{uf}' for m, uf in nomes).encode('utf-8')
+    with open(saida + '.tmp', 'wb') as f:
+        f.write(CABECALHO.pack(MAGIC, len(niveis[5]), len(niveis[3]), len(nomes), len(tabela_nomes)))
+        f.write(tabela_nomes.ljust(_alinhar(len(tabela_nomes)), b'\0'))
+        for digitos in (5, 3):
+            itens = niveis[digitos]
+            f.write(array('I', (i[0] for i in itens)).tobytes())
+            f.write(array('f', (i[1] for i in itens)).tobytes())
+            f.write(array('f', (i[2] for i in itens)).tobytes())
+            f.write(array('I', (nomes[i[3]] for i in itens)).tobytes())
+    os.replace(saida + '.tmp', saida)
+
+    print(f"[CEPIDX] {len(linhas)} CEPs -> {len(niveis[5])} setores, "
+          f"{len(niveis[3])} sub-regiões, {len(nomes)} municípios em {saida}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'build':
+        print("Uso: python cep_index.py build <entrada.csv> <saida.bin>")
+        sys.exit(1)
+    build(sys.argv[2], sys.argv[3])
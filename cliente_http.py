@@ -0,0 +1,219 @@
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# =============================================================================
+# CLIENTE HTTP POR UPSTREAM (POOL KEEP-ALIVE + RETRY + CIRCUIT BREAKER)
+# =============================================================================
+
+# Status que indicam falha do upstream (contam para o circuito e são retentados)
+STATUS_FALHA = frozenset({502, 503, 504})
+
+# Com prazo por requisição, não vale abrir uma chamada com menos que isto (s)
+PRAZO_MINIMO_CHAMADA = float(os.getenv('PRAZO_MINIMO_CHAMADA', 0.05))
+
+log = logging.getLogger('http')
+
+
+class CircuitoAberto(requests.ConnectionError):
+    """
+    Upstream em resfriamento: a chamada falha na hora, sem ir para a rede.
+    Herda de requests.ConnectionError para cair nos mesmos `except` de antes.
+    """
+
+
+class PrazoEsgotado(requests.Timeout):
+    """
+    A requisição não tem mais tempo para esta chamada: falha sem ir para a rede.
+    Herda de requests.Timeout para cair nos `except requests.Timeout`.
+    """
+
+
+class ClienteUpstream:
+    """
+    Cliente de um upstream (BrasilAPI, ViaCEP, Tray, IBGE):
+    - Session própria com pool de conexões keep-alive
+    - Timeouts separados de conexão e leitura
+    - Retentativas limitadas com jitter, só para falhas de conexão e 502/503/504
+      (timeout de leitura não é retentado: já custou o prazo inteiro)
+    - Circuit breaker: após `limite_falhas` falhas seguidas, falha rápido por
+      `resfriamento` segundos; depois deixa passar uma chamada de teste
+    """
+
+    def __init__(self, nome, timeout_conexao, timeout_leitura, pool_max=10,
+                 tentativas=1, backoff=0.1, limite_falhas=5, resfriamento=30.0,
+                 observador=None):
+        self.nome = nome
+        # observador(nome, latencia_s, sucesso): chamado a cada ida à rede
+        self.observador = observador
+        self.timeout_conexao = timeout_conexao
+        self.timeout_leitura = timeout_leitura
+        self.pool_max = pool_max
+        self.tentativas = tentativas
+        self.backoff = backoff
+        self.limite_falhas = limite_falhas
+        self.resfriamento = resfriamento
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+        self._falhas_seguidas = 0
+        self._aberto_ate = 0.0
+        self._teste_em_andamento = False
+        self.stats = {
+            'chamadas': 0,
+            'erros': 0,
+            'retentativas': 0,
+            'rejeitadas_circuito': 0,
+            'aberturas_circuito': 0,
+            'latencia_total_ms': 0.0,
+            'latencia_max_ms': 0.0,
+        }
+
+    # -------------------------------------------------------------------------
+    # Session
+    # -------------------------------------------------------------------------
+    def _sessao(self):
+        """
+        Uma Session por processo (gunicorn faz fork depois do import)
+        """
+        if self._session is not None and self._session_pid == os.getpid():
+            return self._session
+        with self._lock:
+            if self._session is None or self._session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_max, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+                self._session_pid = os.getpid()
+        return self._session
+
+    # -------------------------------------------------------------------------
+    # Circuit breaker
+    # -------------------------------------------------------------------------
+    def _liberar(self):
+        """
+        Retorna True se a chamada pode ir para a rede
+        """
+        with self._lock:
+            if self._falhas_seguidas < self.limite_falhas:
+                return True
+            if time.time() < self._aberto_ate or self._teste_em_andamento:
+                self.stats['rejeitadas_circuito'] += 1
+                return False
+            # Meio-aberto: uma única chamada de teste
+            self._teste_em_andamento = True
+            return True
+
+    def _encerrar_teste(self):
+        with self._lock:
+            self._teste_em_andamento = False
+
+    def _registrar(self, sucesso, latencia_ms, circuito=True):
+        if self.observador is not None:
+            try:
+                self.observador(self.nome, latencia_ms / 1000, sucesso)
+            except Exception as e:
+                log.warning("Erro no observador de %s: %s", self.nome, e)
+        with self._lock:
+            self._teste_em_andamento = False
+            self.stats['chamadas'] += 1
+            self.stats['latencia_total_ms'] += latencia_ms
+            if latencia_ms > self.stats['latencia_max_ms']:
+                self.stats['latencia_max_ms'] = latencia_ms
+            if sucesso:
+                self._falhas_seguidas = 0
+                return
+            self.stats['erros'] += 1
+            if not circuito:
+                return
+            self._falhas_seguidas += 1
+            if self._falhas_seguidas >= self.limite_falhas:
+                if time.time() >= self._aberto_ate:
+                    self.stats['aberturas_circuito'] += 1
+                    log.warning("Circuito de %s aberto por %.0fs", self.nome, self.resfriamento)
+                self._aberto_ate = time.time() + self.resfriamento
+
+    def circuito(self):
+        with self._lock:
+            if self._falhas_seguidas < self.limite_falhas:
+                return 'fechado'
+            return 'aberto' if time.time() < self._aberto_ate else 'meio-aberto'
+
+    # -------------------------------------------------------------------------
+    # API
+    # -------------------------------------------------------------------------
+    def get(self, url, timeout=None, prazo=None, **kwargs):
+        """
+        GET com pool, retentativas e circuit breaker.
+        `timeout` (opcional) substitui o timeout de leitura desta chamada.
+        `prazo` (opcional, prazo.Prazo) limita conexão, leitura e retentativas
+        ao tempo que resta da requisição.
+        Levanta CircuitoAberto se o upstream está em resfriamento e
+        PrazoEsgotado se não sobrou tempo para tentar.
+        """
+        if prazo is not None and prazo.esgotado(PRAZO_MINIMO_CHAMADA):
+            raise PrazoEsgotado(f"{self.nome}: prazo da requisição esgotado")
+        if not self._liberar():
+            raise CircuitoAberto(f"{self.nome}: circuito aberto")
+
+        leitura = self.timeout_leitura if timeout is None else timeout
+        tentativa = 0
+        while True:
+            timeouts = (self.timeout_conexao, leitura)
+            if prazo is not None:
+                timeouts = (prazo.limitar(self.timeout_conexao), prazo.limitar(leitura))
+            inicio = time.perf_counter()
+            try:
+                response = self._sessao().get(url, timeout=timeouts, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # Timeout encurtado pelo prazo não é culpa do upstream: não conta no circuito
+                encurtado = isinstance(e, requests.Timeout) and timeouts != (self.timeout_conexao, leitura)
+                self._registrar(False, (time.perf_counter() - inicio) * 1000, circuito=not encurtado)
+                retentavel = not isinstance(e, requests.ReadTimeout)
+                espera = self._espera(tentativa)
+                if (not retentavel or tentativa >= self.tentativas or self._sem_tempo(prazo, espera)
+                        or not self._liberar()):
+                    raise
+            except requests.RequestException:
+                # Resposta corrompida, redirecionamentos demais, URL inválida: falha sem retentar
+                self._registrar(False, (time.perf_counter() - inicio) * 1000)
+                raise
+            except BaseException:
+                # Qualquer outro erro não pode deixar a chamada de teste do meio-aberto presa
+                self._encerrar_teste()
+                raise
+            else:
+                falhou = response.status_code in STATUS_FALHA
+                self._registrar(not falhou, (time.perf_counter() - inicio) * 1000)
+                espera = self._espera(tentativa)
+                if (not falhou or tentativa >= self.tentativas or self._sem_tempo(prazo, espera)
+                        or not self._liberar()):
+                    return response
+                response.close()
+
+            tentativa += 1
+            self.stats['retentativas'] += 1
+            time.sleep(espera)
+
+    def _espera(self, tentativa):
+        return self.backoff * (2 ** tentativa) * random.uniform(0.5, 1.5)
+
+    @staticmethod
+    def _sem_tempo(prazo, espera):
+        return prazo is not None and prazo.esgotado(espera + PRAZO_MINIMO_CHAMADA)
+
+    def estatisticas(self):
+        chamadas = self.stats['chamadas']
+        return {
+            **self.stats,
+            'latencia_total_ms': round(self.stats['latencia_total_ms'], 1),
+            'latencia_max_ms': round(self.stats['latencia_max_ms'], 1),
+            'latencia_media_ms': round(self.stats['latencia_total_ms'] / chamadas, 1) if chamadas else 0.0,
+            'circuito': self.circuito(),
+        }
@@ -0,0 +1,373 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+# =============================================================================
+# CACHE DE COTAÇÕES (RESPOSTA INTEIRA DE /frete)
+# =============================================================================
+
+log = logging.getLogger('cotacaocache')
+
+# Invalidação de todas as cotações (não só das que têm uma referência)
+TODAS = '*'
+
+
+def impressao_carrinho(produtos):
+    """
+    Hash canônico do carrinho: independe da ordem das linhas em `prods`
+    """
+    itens = sorted(
+        (p.codigo, p.comprimento, p.largura, p.altura, p.cubagem, p.quantidade, p.peso, p.valor)
+        for p in produtos
+    )
+    return hashlib.blake2b(repr(itens).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class CacheCotacao:
+    """
+    Resposta pronta por (CEP limpo, impressão do carrinho), com TTL curto:
+    1) LRU em memória, por processo
+    2) SQLite em disco, compartilhado entre os workers do gunicorn
+    Cada entrada guarda a `versao` dos dados de preço com que foi calculada
+    (versão diferente = miss) e as referências do carrinho.
+
+    `invalidar(codigo)` descarta só as cotações com aquela referência e
+    registra a invalidação numa sequência (tabela `invalidacao` no SQLite);
+    os outros workers leem a sequência em até `intervalo_sincronia` segundos
+    e descartam as mesmas entradas da memória. Quem vai calcular uma cotação
+    pega `marca()` antes do obter; `gravar` com essa marca descarta a
+    cotação se alguma referência dela foi invalidada no meio do cálculo
+    (estoque antigo não entra no cache depois da mudança).
+    """
+
+    # Invalidações mais antigas que isto saem da tabela (s); marca anterior
+    # ao que foi podado não grava
+    JANELA_INVALIDACOES = 600.0
+
+    def __init__(self, caminho, ttl, max_memoria=5000, intervalo_sincronia=0.5):
+        self.caminho = caminho
+        self.ttl = ttl
+        self.max_memoria = max_memoria
+        self.intervalo_sincronia = intervalo_sincronia
+        self._memoria = OrderedDict()   # chave -> (dados, versao, codigos, expira)
+        self._por_codigo = {}           # codigo -> {chaves em memória}
+        self._invalidacoes = deque()    # (seq, codigo, em) recentes, em ordem
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._disco_ok = bool(caminho)
+        self._seq = 0
+        self._seq_podada = 0
+        self._proxima_sincronia = 0.0
+        self.stats = {
+            'hits_memoria': 0,
+            'hits_disco': 0,
+            'misses': 0,
+            'gravacoes': 0,
+            'descartadas': 0,
+            'invalidacoes': 0,
+            'erros_disco': 0,
+        }
+
+    @property
+    def ativo(self):
+        return self.ttl > 0
+
+    # -------------------------------------------------------------------------
+    # SQLite
+    # -------------------------------------------------------------------------
+    def _conexao(self):
+        """
+        Uma conexão por thread e por processo (gunicorn faz fork depois do import)
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.caminho, timeout=1.0, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cotacao ('
+            ' chave TEXT PRIMARY KEY,'
+            ' dados TEXT NOT NULL,'
+            ' versao TEXT NOT NULL,'
+            ' expira REAL NOT NULL)'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cotacao_codigo ('
+            ' codigo TEXT NOT NULL,'
+            ' chave TEXT NOT NULL,'
+            ' PRIMARY KEY (codigo, chave)) WITHOUT ROWID'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS cotacao_codigo_chave ON cotacao_codigo (chave)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS invalidacao ('
+            ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' codigo TEXT NOT NULL,'
+            ' em REAL NOT NULL)'
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _erro_disco(self, e):
+        self.stats['erros_disco'] += 1
+        log.warning("Erro no cache em disco: %s", e)
+
+    # -------------------------------------------------------------------------
+    # Memória
+    # -------------------------------------------------------------------------
+    def _remover_memoria(self, chave):
+        item = self._memoria.pop(chave, None)
+        if item is None:
+            return
+        for codigo in item[2]:
+            chaves = self._por_codigo.get(codigo)
+            if chaves is not None:
+                chaves.discard(chave)
+                if not chaves:
+                    del self._por_codigo[codigo]
+
+    def _descartar_memoria(self, codigo):
+        if codigo == TODAS:
+            self._memoria.clear()
+            self._por_codigo.clear()
+            return
+        for chave in list(self._por_codigo.get(codigo, ())):
+            self._remover_memoria(chave)
+
+    def _aplicar(self, seq, codigo, em):
+        """
+        Registra uma invalidação (local ou lida do SQLite); chamar com o lock
+        """
+        if seq <= self._seq:
+            return
+        self._seq = seq
+        self._invalidacoes.append((seq, codigo, em))
+        self._descartar_memoria(codigo)
+        limite = time.time() - self.JANELA_INVALIDACOES
+        while self._invalidacoes and self._invalidacoes[0][2] < limite:
+            self._seq_podada = self._invalidacoes.popleft()[0]
+
+    def _guardar_memoria(self, chave, dados, versao, codigos, expira):
+        with self._lock:
+            self._remover_memoria(chave)
+            self._memoria[chave] = (dados, versao, codigos, expira)
+            for codigo in codigos:
+                self._por_codigo.setdefault(codigo, set()).add(chave)
+            while len(self._memoria) > self.max_memoria:
+                self._remover_memoria(next(iter(self._memoria)))
+
+    def _invalidada_desde(self, marca, codigos):
+        """
+        Alguma invalidação depois de `marca` atinge estas referências?
+        (chamar com o lock)
+        """
+        if marca < self._seq_podada:
+            return True
+        for seq, codigo, _ in reversed(self._invalidacoes):
+            if seq <= marca:
+                break
+            if codigo == TODAS or codigo in codigos:
+                return True
+        return False
+
+    # -------------------------------------------------------------------------
+    # Sequência de invalidações
+    # -------------------------------------------------------------------------
+    def marca(self):
+        """
+        Posição atual na sequência de invalidações: pegar antes de calcular
+        uma cotação e passar para gravar(). Lida do SQLite no máximo a cada
+        `intervalo_sincronia` segundos.
+        """
+        agora = time.time()
+        if not self._disco_ok or agora < self._proxima_sincronia:
+            return self._seq
+        self._proxima_sincronia = agora + self.intervalo_sincronia
+        try:
+            linhas = self._conexao().execute(
+                'SELECT seq, codigo, em FROM invalidacao WHERE seq > ? ORDER BY seq', (self._seq,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            self._erro_disco(e)
+            return self._seq
+        if linhas:
+            with self._lock:
+                for seq, codigo, em in linhas:
+                    self._aplicar(seq, codigo, em)
+        return self._seq
+
+    # -------------------------------------------------------------------------
+    # API
+    # -------------------------------------------------------------------------
+    def obter(self, chave, versao):
+        """
+        Retorna os dados gravados (dict) ou None
+        """
+        if not self.ativo:
+            return None
+        self.marca()
+        agora = time.time()
+        with self._lock:
+            item = self._memoria.get(chave)
+            if item is not None:
+                dados, versao_item, _, expira = item
+                if versao_item == versao and expira >= agora:
+                    self._memoria.move_to_end(chave)
+                    self.stats['hits_memoria'] += 1
+                    return dados
+                self._remover_memoria(chave)
+
+        if self._disco_ok:
+            try:
+                conn = self._conexao()
+                row = conn.execute(
+                    'SELECT dados, expira FROM cotacao WHERE chave = ? AND versao = ?', (chave, versao)
+                ).fetchone()
+                codigos = ()
+                if row is not None and row[1] >= agora:
+                    codigos = frozenset(c for (c,) in conn.execute(
+                        'SELECT codigo FROM cotacao_codigo WHERE chave = ?', (chave,)))
+            except sqlite3.Error as e:
+                self._erro_disco(e)
+                row = None
+            if row is not None and row[1] >= agora:
+                dados = json.loads(row[0])
+                self.stats['hits_disco'] += 1
+                self._guardar_memoria(chave, dados, versao, codigos, row[1])
+                return dados
+
+        self.stats['misses'] += 1
+        return None
+
+    def gravar(self, chave, versao, dados, codigos=(), marca=None):
+        """
+        Guarda a cotação. `codigos`: referências do carrinho (invalidar uma
+        delas descarta a entrada). `marca`: marca() de antes do cálculo; se
+        uma dessas referências foi invalidada depois dela, não grava.
+        """
+        if not self.ativo:
+            return
+        codigos = frozenset(codigos)
+        if marca is None:
+            marca = self.marca()
+        expira = time.time() + self.ttl
+
+        if self._disco_ok:
+            try:
+                if not self._gravar_disco(chave, versao, dados, codigos, marca, expira):
+                    self.stats['descartadas'] += 1
+                    return
+            except sqlite3.Error as e:
+                self._erro_disco(e)
+
+        with self._lock:
+            if self._invalidada_desde(marca, codigos):
+                self.stats['descartadas'] += 1
+                return
+        self._guardar_memoria(chave, dados, versao, codigos, expira)
+        self.stats['gravacoes'] += 1
+
+    def _gravar_disco(self, chave, versao, dados, codigos, marca, expira):
+        """
+        Confere e grava numa transação só: uma invalidação concorrente ou
+        entra antes (e a cotação é descartada) ou depois (e a apaga)
+        """
+        conn = self._conexao()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            alvos = [TODAS, *codigos]
+            invalidada = conn.execute(
+                f'SELECT 1 FROM invalidacao WHERE seq > ? AND codigo IN ({",".join("?" * len(alvos))}) LIMIT 1',
+                (marca, *alvos)
+            ).fetchone()
+            podada = marca < self._seq_podada
+            if invalidada or podada:
+                conn.execute('COMMIT')
+                return False
+            conn.execute(
+                'INSERT OR REPLACE INTO cotacao (chave, dados, versao, expira) VALUES (?, ?, ?, ?)',
+                (chave, json.dumps(dados, ensure_ascii=False), versao, expira)
+            )
+            conn.execute('DELETE FROM cotacao_codigo WHERE chave = ?', (chave,))
+            conn.executemany('INSERT INTO cotacao_codigo (codigo, chave) VALUES (?, ?)',
+                             [(codigo, chave) for codigo in codigos])
+            conn.execute('COMMIT')
+            return True
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+
+    def invalidar(self, codigo=TODAS, motivo=''):
+        """
+        Descarta as cotações com a referência `codigo` (padrão: todas),
+        neste e nos demais workers
+        """
+        self.stats['invalidacoes'] += 1
+        log.info("Cotações invalidadas (%s): %s", codigo, motivo)
+        agora = time.time()
+        if self._disco_ok:
+            try:
+                self._invalidar_disco(codigo, agora)
+                return
+            except sqlite3.Error as e:
+                self._erro_disco(e)
+        with self._lock:
+            self._aplicar(self._seq + 1, codigo, agora)
+
+    def _invalidar_disco(self, codigo, agora):
+        conn = self._conexao()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            seq = conn.execute('INSERT INTO invalidacao (codigo, em) VALUES (?, ?)', (codigo, agora)).lastrowid
+            if codigo == TODAS:
+                conn.execute('DELETE FROM cotacao')
+                conn.execute('DELETE FROM cotacao_codigo')
+            else:
+                conn.execute(
+                    'DELETE FROM cotacao WHERE chave IN (SELECT chave FROM cotacao_codigo WHERE codigo = ?)', (codigo,))
+                conn.execute(
+                    'DELETE FROM cotacao_codigo WHERE chave IN (SELECT chave FROM cotacao_codigo WHERE codigo = ?)',
+                    (codigo,))
+            conn.execute('DELETE FROM invalidacao WHERE em < ?', (agora - self.JANELA_INVALIDACOES,))
+            # Invalidações de outros workers desde a última sincronia, e esta
+            linhas = conn.execute(
+                'SELECT seq, codigo, em FROM invalidacao WHERE seq > ? AND seq <= ? ORDER BY seq', (self._seq, seq)
+            ).fetchall()
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+        with self._lock:
+            for linha in linhas:
+                self._aplicar(*linha)
+
+    def limpar_expirados(self):
+        """
+        Remove entradas vencidas do SQLite (manutenção)
+        """
+        if not self._disco_ok:
+            return 0
+        try:
+            conn = self._conexao()
+            cur = conn.execute('DELETE FROM cotacao WHERE expira < ?', (time.time(),))
+            conn.execute('DELETE FROM cotacao_codigo WHERE chave NOT IN (SELECT chave FROM cotacao)')
+            return cur.rowcount
+        except sqlite3.Error as e:
+            self._erro_disco(e)
+            return 0
+
+    def estatisticas(self):
+        hits = self.stats['hits_memoria'] + self.stats['hits_disco']
+        total = hits + self.stats['misses']
+        return {
+            **self.stats,
+            'itens_memoria': len(self._memoria),
+            'seq_invalidacao': self._seq,
+            'hit_ratio': round(hits / total, 4) if total else 0.0,
+        }
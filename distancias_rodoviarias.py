@@ -0,0 +1,257 @@
+"""
+Matriz de distâncias rodoviárias CD x município
+
+A distância em linha reta x 1,15 subestima muito as rotas no Norte e no
+Nordeste. Esta matriz guarda a distância rodoviária real de cada CD até cada
+município (código IBGE), gerada offline por um roteador, num arquivo binário
+lido via mmap: a consulta é uma busca binária e um acesso ao array.
+
+Para pares fora da matriz, usa um fator de correção por CD e região de
+destino, calibrado no build (mediana de rodoviária / linha reta dos pares
+conhecidos). Sem amostra para a região, vale o AJUSTE_RODOVIARIO global.
+
+Gerar (CSV com cd_id, codigo_ibge, km; municípios de `municipios.py build`):
+    python distancias_rodoviarias.py build rotas.csv municipios.csv.gz distancias_rodoviarias.bin
+Depois gere novamente a tabela de setores (a assinatura muda).
+"""
+import csv
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from statistics import median
+
+from motor_frete import AJUSTE_RODOVIARIO, RAIO_TERRA_KM
+
+MAGIC = b'RODOV001'
+# n_municipios, n_cds, n_regioes, bytes da lista de CDs
+CABECALHO = struct.Struct('<8sIIII')
+
+REGIOES = ('N', 'NE', 'CO', 'SE', 'S')
+REGIAO_POR_UF = {
+    'AC': 'N', 'AM': 'N', 'AP': 'N', 'PA': 'N', 'RO': 'N', 'RR': 'N', 'TO': 'N',
+    'AL': 'NE', 'BA': 'NE', 'CE': 'NE', 'MA': 'NE', 'PB': 'NE', 'PE': 'NE', 'PI': 'NE', 'RN': 'NE', 'SE': 'NE',
+    'DF': 'CO', 'GO': 'CO', 'MS': 'CO', 'MT': 'CO',
+    'ES': 'SE', 'MG': 'SE', 'RJ': 'SE', 'SP': 'SE',
+    'PR': 'S', 'RS': 'S', 'SC': 'S',
+}
+
+# Pares com menos amostras que isto não calibram o fator da região
+AMOSTRAS_MIN_FATOR = 5
+
+log = logging.getLogger('rotas')
+
+
+def _alinhar(n):
+    return (n + 3) & ~3
+
+
+def distancia_reta(lat1, lon1, lat2, lon2):
+    """
+    Haversine em km, sem ajuste
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return RAIO_TERRA_KM * 2 * math.asin(math.sqrt(a))
+
+
+class MatrizRodoviaria:
+    """
+    Colunas na ordem de CDs do motor (CDs fora do arquivo ficam sem coluna):
+    - codigos uint32[n] ordenados
+    - km float32[n * n_cds_arquivo] (NaN = par sem rota)
+    - fatores float32[n_cds_arquivo * n_regioes] (NaN = sem calibração)
+    """
+
+    def __init__(self, ids=()):
+        self.ids = list(ids)
+        self.assinatura = b''
+        self._colunas = [None] * len(self.ids)
+        self._n_arquivo = 0
+        self._codigos = ()
+        self._km = None
+        self._fatores = {}
+        self._mmap = None
+
+    def __len__(self):
+        return len(self._codigos)
+
+    @classmethod
+    def carregar(cls, caminho, ids):
+        matriz = cls(ids)
+        with open(caminho, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, n, n_cds, n_regioes, tam_ids = CABECALHO.unpack_from(mm, 0)
+        if magic != MAGIC or n_regioes != len(REGIOES):
+            mm.close()
+            raise ValueError(f"Arquivo de distâncias inválido: {caminho}")
+
+        buf = memoryview(mm)
+        pos = CABECALHO.size
+        ids_arquivo = bytes(buf[pos:pos + tam_ids]).decode('utf-8').split('\n') if n_cds else []
+        pos += _alinhar(tam_ids)
+        fatores = buf[pos:pos + 4 * n_cds * n_regioes].cast('f')
+        pos += 4 * n_cds * n_regioes
+        matriz._codigos = buf[pos:pos + 4 * n].cast('I')
+        pos += 4 * n
+        matriz._km = buf[pos:pos + 4 * n * n_cds].cast('f')
+
+        coluna = {cd_id: k for k, cd_id in enumerate(ids_arquivo)}
+        matriz._colunas = [coluna.get(cd_id) for cd_id in matriz.ids]
+        matriz._n_arquivo = n_cds
+        for j, k in enumerate(matriz._colunas):
+            if k is None:
+                continue
+            for r, regiao in enumerate(REGIOES):
+                fator = fatores[k * n_regioes + r]
+                if not math.isnan(fator):
+                    matriz._fatores[(j, regiao)] = fator
+        matriz.assinatura = hashlib.sha1(mm).digest()[:16]
+        matriz._mmap = mm
+        return matriz
+
+    def linha(self, codigo_ibge):
+        """
+        Índice do município na matriz ou None
+        """
+        if not codigo_ibge or not len(self._codigos):
+            return None
+        i = bisect_left(self._codigos, int(codigo_ibge))
+        if i < len(self._codigos) and self._codigos[i] == int(codigo_ibge):
+            return i
+        return None
+
+    def km(self, i, j):
+        """
+        Distância rodoviária da linha i ao CD j (ordem do motor) ou None
+        """
+        k = self._colunas[j]
+        if i is None or k is None:
+            return None
+        km = self._km[i * self._n_arquivo + k]
+        return None if math.isnan(km) else km
+
+    def fator(self, j, uf):
+        """
+        Fator rodoviária / linha reta do CD j para a região da UF
+        """
+        return self._fatores.get((j, REGIAO_POR_UF.get(uf)), AJUSTE_RODOVIARIO)
+
+    def distancia(self, j, reta_km, i=None, uf=None):
+        km = self.km(i, j)
+        return km if km is not None else reta_km * self.fator(j, uf)
+
+    def correcao(self, linhas, ufs):
+        """
+        Para o motor vetorizado: (fatores, km) no formato (n_destinos, n_cds);
+        km é NaN onde o par não está na matriz
+        """
+        import numpy as np
+
+        n_cds = len(self.ids)
+        fatores = np.array([[self.fator(j, uf) for j in range(n_cds)] for uf in ufs], dtype=np.float64)
+        km = np.full((len(linhas), n_cds), np.nan)
+        for d, i in enumerate(linhas):
+            if i is None:
+                continue
+            for j in range(n_cds):
+                valor = self.km(i, j)
+                if valor is not None:
+                    km[d, j] = valor
+        return fatores.reshape(len(ufs), n_cds), km
+
+
+def carregar_matriz(caminho, ids):
+    """
+    Carrega a matriz se o arquivo existir; caso contrário (ou com erro)
+    retorna matriz vazia, que só aplica o AJUSTE_RODOVIARIO global
+    """
+    if not caminho or not os.path.exists(caminho):
+        return MatrizRodoviaria(ids)
+    try:
+        matriz = MatrizRodoviaria.carregar(caminho, ids)
+        log.info("Matriz rodoviária carregada: %d municípios, %d fatores (%s)",
+                 len(matriz), len(matriz._fatores), caminho)
+        return matriz
+    except Exception as e:
+        log.warning("Ignorando matriz %s: %s", caminho, e)
+        return MatrizRodoviaria(ids)
+
+
+# =============================================================================
+# BUILD (CLI)
+# =============================================================================
+
+def build(rotas_csv, municipios, centros, saida):
+    """
+    `municipios`: TabelaMunicipios (coordenadas para calibrar os fatores);
+    `centros`: {cd_id: {'lat', 'lon', ...}}
+    """
+    ids = list(centros)
+    coluna = {cd_id: k for k, cd_id in enumerate(ids)}
+    km = defaultdict(dict)
+    with open(rotas_csv, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            try:
+                k = coluna[row['cd_id'].strip()]
+                km[int(row['codigo_ibge'])][k] = float(row['km'])
+            except (KeyError, TypeError, ValueError):
+                continue
+
+    razoes = defaultdict(list)
+    for codigo, por_cd in km.items():
+        municipio = municipios.buscar(codigo_ibge=codigo)
+        if not municipio:
+            continue
+        regiao = REGIAO_POR_UF.get(municipio['uf'])
+        for k, rodoviaria in por_cd.items():
+            cd = centros[ids[k]]
+            reta = distancia_reta(cd['lat'], cd['lon'], municipio['lat'], municipio['lon'])
+            if reta > 1.0:
+                razoes[(k, regiao)].append(rodoviaria / reta)
+
+    fatores = array('f', [math.nan] * (len(ids) * len(REGIOES)))
+    for (k, regiao), valores in razoes.items():
+        if regiao in REGIOES and len(valores) >= AMOSTRAS_MIN_FATOR:
+            fatores[k * len(REGIOES) + REGIOES.index(regiao)] = median(valores)
+
+    codigos = sorted(km)
+    matriz = array('f', [math.nan] * (len(codigos) * len(ids)))
+    for i, codigo in enumerate(codigos):
+        for k, valor in km[codigo].items():
+            matriz[i * len(ids) + k] = valor
+
+    tabela_ids = '\n'.join(ids).encode('utf-8')
+    with open(saida + '.tmp', 'wb') as f:
+        f.write(CABECALHO.pack(MAGIC, len(codigos), len(ids), len(REGIOES), len(tabela_ids)))
+        f.write(tabela_ids.ljust(_alinhar(len(tabela_ids)), b'\0'))
+        f.write(fatores.tobytes())
+        f.write(array('I', codigos).tobytes())
+        f.write(matriz.tobytes())
+    os.replace(saida + '.tmp', saida)
+
+    print(f"[ROTAS] {len(codigos)} municípios x {len(ids)} CDs em {saida}")
+    for k, cd_id in enumerate(ids):
+        calibrados = {r: round(fatores[k * len(REGIOES) + n], 3) for n, r in enumerate(REGIOES)
+                      if not math.isnan(fatores[k * len(REGIOES) + n])}
+        print(f"[ROTAS] fatores {cd_id}: {calibrados or '-'}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 5 or sys.argv[1] != 'build':
+        print("Uso: python distancias_rodoviarias.py build <rotas.csv> <municipios.csv.gz> <saida.bin>")
+        sys.exit(1)
+
+    from municipios import TabelaMunicipios
+    from registro_cds import carregar_centros
+
+    # Só a lista de CDs: não sobe o app (caches, clientes, planilha)
+    build(sys.argv[2], TabelaMunicipios.carregar(sys.argv[3]), carregar_centros(os.getenv('CDS_PATH', 'cds.json')),
+          sys.argv[4])
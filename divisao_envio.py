@@ -0,0 +1,119 @@
+"""
+Divisão do carrinho entre CDs quando nenhum CD tem todos os itens
+
+Cada item (referência do carrinho) tem o conjunto de CDs com estoque. A busca
+é exata sobre quais CDs despacham: percorre os conjuntos de até `max_envios`
+CDs que cobrem todos os itens, do menor para o maior, e para cada um aloca os
+itens pelo menor custo marginal e refina movendo itens entre os CDs do
+conjunto enquanto o total cair. Como cada envio paga pelo menos o valor
+mínimo, conjuntos com `tamanho * valor_minimo` acima do melhor total já
+encontrado são descartados sem precificar.
+
+O preço de um envio vem de `precificar(cd, peso, volume, ocupacao)` (a mesma
+fórmula da cotação de um CD só), sobre os totais dos itens alocados.
+"""
+from itertools import combinations
+
+# Passadas de refinamento por conjunto de CDs
+MAX_PASSADAS = 4
+
+
+class _Carga:
+    __slots__ = ('peso', 'volume', 'ocupacao', 'sem_medida', 'itens')
+
+    def __init__(self):
+        self.peso = 0.0
+        self.volume = 0.0
+        self.ocupacao = 0.0
+        self.sem_medida = 0
+        self.itens = 0
+
+    def mudar(self, item, sinal):
+        peso, volume, ocupacao = item
+        self.peso += sinal * peso
+        self.volume += sinal * volume
+        if ocupacao is None:
+            self.sem_medida += sinal
+        else:
+            self.ocupacao += sinal * ocupacao
+        self.itens += sinal
+
+
+def _custo(precificar, cd, carga):
+    if not carga.itens:
+        return 0.0
+    ocupacao = carga.ocupacao if not carga.sem_medida else None
+    return precificar(cd, carga.peso, carga.volume, ocupacao)
+
+
+def _alocar(conjunto, itens, disponivel, precificar):
+    """
+    Alocação dos itens aos CDs do conjunto; retorna (total, atribuicao)
+    """
+    cargas = {cd: _Carga() for cd in conjunto}
+    atribuicao = [None] * len(itens)
+    opcoes = [[cd for cd in conjunto if cd in disponivel[i]] for i in range(len(itens))]
+
+    # Itens com uma só opção primeiro; os demais do mais pesado ao mais leve
+    ordem = sorted(range(len(itens)), key=lambda i: (len(opcoes[i]) > 1, -itens[i][0]))
+    for i in ordem:
+        melhor_cd, melhor_delta = None, None
+        for cd in opcoes[i]:
+            carga = cargas[cd]
+            antes = _custo(precificar, cd, carga)
+            carga.mudar(itens[i], 1)
+            delta = _custo(precificar, cd, carga) - antes
+            carga.mudar(itens[i], -1)
+            if melhor_delta is None or delta < melhor_delta:
+                melhor_cd, melhor_delta = cd, delta
+        cargas[melhor_cd].mudar(itens[i], 1)
+        atribuicao[i] = melhor_cd
+
+    custos = {cd: _custo(precificar, cd, carga) for cd, carga in cargas.items()}
+    flexiveis = [i for i in ordem if len(opcoes[i]) > 1]
+    for _ in range(MAX_PASSADAS):
+        melhorou = False
+        for i in flexiveis:
+            origem = atribuicao[i]
+            cargas[origem].mudar(itens[i], -1)
+            custo_origem = _custo(precificar, origem, cargas[origem])
+            for destino in opcoes[i]:
+                if destino == origem:
+                    continue
+                cargas[destino].mudar(itens[i], 1)
+                custo_destino = _custo(precificar, destino, cargas[destino])
+                ganho = custos[origem] + custos[destino] - custo_origem - custo_destino
+                if ganho > 1e-6:
+                    custos[origem], custos[destino] = custo_origem, custo_destino
+                    atribuicao[i] = origem = destino
+                    melhorou = True
+                    break
+                cargas[destino].mudar(itens[i], -1)
+            else:
+                cargas[origem].mudar(itens[i], 1)
+        if not melhorou:
+            break
+
+    return sum(custos.values()), atribuicao
+
+
+def otimizar_divisao(n_cds, itens, disponivel, precificar, max_envios=3, valor_minimo=0.0):
+    """
+    itens: [(peso, volume, ocupacao ou None)]; disponivel: [conjunto de CDs]
+    por item (índices 0..n_cds-1). Retorna (total, atribuicao) com o CD de
+    cada item, ou None se algum item não tem estoque em nenhum CD.
+    """
+    if not itens or any(not d for d in disponivel):
+        return None
+
+    melhor = None
+    for tamanho in range(1, min(max_envios, n_cds) + 1):
+        if melhor is not None and tamanho * valor_minimo >= melhor[0]:
+            break
+        for conjunto in combinations(range(n_cds), tamanho):
+            if any(d.isdisjoint(conjunto) for d in disponivel):
+                continue
+            total, atribuicao = _alocar(conjunto, itens, disponivel, precificar)
+            if melhor is None or total < melhor[0] - 1e-6:
+                melhor = (total, atribuicao)
+    return melhor
@@ -0,0 +1,191 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# =============================================================================
+# CACHE DE ESTOQUE TRAY (STALE-WHILE-REVALIDATE + SINGLE-FLIGHT)
+# =============================================================================
+
+log = logging.getLogger('estoque')
+
+
+def mapa_estoque(produto):
+    """
+    Extrai do produto Tray apenas os campos de estoque (stock, stock_<CD>)
+    """
+    if produto is None:
+        return None
+    return {k: v for k, v in produto.items() if k == 'stock' or k.startswith('stock_')}
+
+
+def disponibilidade(mapa):
+    """
+    Só o que a cotação usa do estoque: quais campos têm saldo positivo
+    """
+    if mapa is None:
+        return None
+    saida = {}
+    for k, v in mapa.items():
+        try:
+            saida[k] = int(v) > 0
+        except (TypeError, ValueError):
+            saida[k] = None
+    return saida
+
+
+def _future_pronto(valor):
+    f = Future()
+    f.set_result(valor)
+    return f
+
+
+class CacheEstoque:
+    """
+    Snapshot de estoque por referência de produto.
+    - Dentro do TTL: responde da memória
+    - Vencido mas dentro da janela stale: responde o valor antigo e dispara
+      atualização em background
+    - Ausente: busca na Tray; chamadas simultâneas para a mesma referência
+      compartilham a mesma requisição (single-flight)
+    Falhas (None) não são cacheadas.
+    `ao_mudar(codigo)` é chamado quando uma atualização muda a
+    disponibilidade de um produto já conhecido (saldo positivo x zerado).
+    """
+
+    def __init__(self, buscar, executor, ttl, ttl_stale, max_itens=50000, ao_mudar=None):
+        self.buscar = buscar
+        self.executor = executor
+        self.ttl = ttl
+        self.ttl_stale = ttl_stale
+        self.max_itens = max_itens
+        self.ao_mudar = ao_mudar
+        self._itens = OrderedDict()   # codigo -> (mapa, atualizado_em)
+        self._em_voo = {}             # codigo -> Future
+        self._lock = threading.Lock()
+        self._aquecimento_pid = None
+        self._aquecimento_lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'hits_stale': 0,
+            'misses': 0,
+            'chamadas_tray': 0,
+            'compartilhadas': 0,
+            'aquecidos': 0,
+            'mudancas': 0,
+        }
+
+    def obter_future(self, codigo):
+        """
+        Retorna um Future com o mapa de estoque do produto (ou None)
+        """
+        agora = time.time()
+        with self._lock:
+            item = self._itens.get(codigo)
+            if item is not None:
+                mapa, atualizado = item
+                idade = agora - atualizado
+                if idade <= self.ttl:
+                    self._itens.move_to_end(codigo)
+                    self.stats['hits'] += 1
+                    return _future_pronto(mapa)
+                if idade <= self.ttl + self.ttl_stale:
+                    self.stats['hits_stale'] += 1
+                    self._buscar_single_flight(codigo)
+                    return _future_pronto(mapa)
+                del self._itens[codigo]
+
+            self.stats['misses'] += 1
+            return self._buscar_single_flight(codigo)
+
+    def _buscar_single_flight(self, codigo):
+        """
+        Deve ser chamado com o lock adquirido
+        """
+        future = self._em_voo.get(codigo)
+        if future is not None:
+            self.stats['compartilhadas'] += 1
+            return future
+        self.stats['chamadas_tray'] += 1
+        future = self.executor.submit(self._buscar_e_gravar, codigo)
+        self._em_voo[codigo] = future
+        return future
+
+    def _buscar_e_gravar(self, codigo):
+        try:
+            mapa = mapa_estoque(self.buscar(codigo))
+            if mapa is not None:
+                self.gravar(codigo, mapa)
+            return mapa
+        finally:
+            with self._lock:
+                self._em_voo.pop(codigo, None)
+
+    def gravar(self, codigo, mapa):
+        with self._lock:
+            anterior = self._itens.get(codigo)
+            self._itens[codigo] = (mapa, time.time())
+            self._itens.move_to_end(codigo)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+            mudou = anterior is not None and disponibilidade(anterior[0]) != disponibilidade(mapa)
+            if mudou:
+                self.stats['mudancas'] += 1
+        if mudou and self.ao_mudar is not None:
+            try:
+                self.ao_mudar(codigo)
+            except Exception as e:
+                log.warning("Erro ao notificar mudança de estoque de %s: %s", codigo, e)
+
+    # -------------------------------------------------------------------------
+    # Aquecimento do catálogo
+    # -------------------------------------------------------------------------
+    def aquecer(self, listar_pagina):
+        """
+        Percorre o catálogo paginado e grava o estoque de todos os produtos.
+        listar_pagina(pagina) -> (lista de produtos, tem_mais)
+        """
+        pagina = 1
+        total = 0
+        while True:
+            produtos, tem_mais = listar_pagina(pagina)
+            for produto in produtos:
+                codigo = (str(produto.get('reference') or '')).strip()
+                if codigo:
+                    self.gravar(codigo, mapa_estoque(produto))
+                    total += 1
+            if not tem_mais or not produtos:
+                break
+            pagina += 1
+        self.stats['aquecidos'] += total
+        log.info("Catálogo aquecido: %d produtos em %d página(s)", total, pagina)
+        return total
+
+    def iniciar_aquecimento(self, listar_pagina, intervalo):
+        """
+        Inicia (uma vez por processo) a thread que reaquece o catálogo
+        periodicamente. Threads não sobrevivem ao fork do gunicorn, por isso
+        a checagem é por pid.
+        """
+        if intervalo <= 0:
+            return
+        # Duas primeiras requisições simultâneas não podem iniciar duas threads
+        with self._aquecimento_lock:
+            if self._aquecimento_pid == os.getpid():
+                return
+            self._aquecimento_pid = os.getpid()
+
+        def loop():
+            while True:
+                try:
+                    self.aquecer(listar_pagina)
+                except Exception as e:
+                    log.warning("Erro no aquecimento do catálogo: %s", e)
+                time.sleep(intervalo)
+
+        threading.Thread(target=loop, name='estoque-aquecimento', daemon=True).start()
+
+    def estatisticas(self):
+        return {**self.stats, 'itens': len(self._itens)}
@@ -0,0 +1,186 @@
+"""
+Geocodificação especulativa (BrasilAPI x ViaCEP)
+
+Em vez de só chamar o segundo provedor depois que o primeiro falha, o
+resolvedor dispara o provedor preferido e, se ele não responder em
+`atraso_hedge` segundos, dispara o próximo em paralelo (hedge; com atraso 0
+é uma corrida). Vence a primeira resposta com coordenadas; uma resposta só
+com município/UF (ViaCEP) fica como reserva até os demais terminarem.
+
+Provedor = função (cep, prazo) que retorna:
+- dict com 'municipio', 'uf' e, se tiver, 'lat'/'lon'
+- NAO_ENCONTRADO se o CEP não existe
+- None em caso de falha
+"""
+import logging
+import math
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+NAO_ENCONTRADO = object()
+
+# Peso da última amostra na latência média (EWMA)
+ALFA_LATENCIA = 0.2
+
+log = logging.getLogger('georesolver')
+
+
+def tem_coordenadas(resultado):
+    return isinstance(resultado, dict) and resultado.get('lat') is not None and resultado.get('lon') is not None
+
+
+class ResolvedorGeo:
+    """
+    `provedores`: {nome: função}, na ordem de preferência configurada.
+    Com `adaptativo`, depois de `amostras_min` chamadas de cada provedor a
+    ordem passa a ser pelo tempo esperado até coordenadas (latência média /
+    fração de respostas com coordenadas).
+    """
+
+    def __init__(self, provedores, atraso_hedge=0.15, adaptativo=True, amostras_min=20, max_workers=16):
+        self.provedores = dict(provedores)
+        self.atraso_hedge = atraso_hedge
+        self.adaptativo = adaptativo
+        self.amostras_min = amostras_min
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='geo-prov')
+        self._lock = threading.Lock()
+        self._stats = {
+            nome: {
+                'chamadas': 0,
+                'com_coordenadas': 0,
+                'sem_coordenadas': 0,
+                'nao_encontrado': 0,
+                'falhas': 0,
+                'vitorias': 0,
+                'canceladas': 0,
+                'latencia_ewma_ms': None,
+            }
+            for nome in self.provedores
+        }
+        self.hedges = 0
+
+    # -------------------------------------------------------------------------
+    # Ordem
+    # -------------------------------------------------------------------------
+    def _custo(self, nome):
+        s = self._stats[nome]
+        taxa = s['com_coordenadas'] / s['chamadas'] if s['chamadas'] else 0.0
+        return (s['latencia_ewma_ms'] or 0.0) / max(taxa, 0.05)
+
+    def ordem(self):
+        nomes = list(self.provedores)
+        if not self.adaptativo:
+            return nomes
+        with self._lock:
+            if any(self._stats[n]['chamadas'] < self.amostras_min for n in nomes):
+                return nomes
+            return sorted(nomes, key=self._custo)
+
+    # -------------------------------------------------------------------------
+    # Consulta
+    # -------------------------------------------------------------------------
+    def _consultar(self, nome, cep, prazo):
+        inicio = time.perf_counter()
+        try:
+            resultado = self.provedores[nome](cep, prazo)
+        except Exception as e:
+            log.warning("Erro %s: %s", nome, e)
+            resultado = None
+        latencia_ms = (time.perf_counter() - inicio) * 1000
+
+        with self._lock:
+            s = self._stats[nome]
+            s['chamadas'] += 1
+            if resultado is None:
+                s['falhas'] += 1
+            elif resultado is NAO_ENCONTRADO:
+                s['nao_encontrado'] += 1
+            elif tem_coordenadas(resultado):
+                s['com_coordenadas'] += 1
+            else:
+                s['sem_coordenadas'] += 1
+            ewma = s['latencia_ewma_ms']
+            s['latencia_ewma_ms'] = latencia_ms if ewma is None else ewma + ALFA_LATENCIA * (latencia_ms - ewma)
+        return resultado
+
+    def resolver(self, cep, prazo=None):
+        """
+        Retorna (resultado, nao_encontrado):
+        - resultado com coordenadas, ou só com município/UF, ou None
+        - nao_encontrado=True se algum provedor afirmou que o CEP não existe
+          e nenhum trouxe o endereço
+        """
+        ordem = self.ordem()
+        pendentes = {}
+        proximo = 0
+        parcial = None
+        nao_encontrado = False
+
+        def disparar():
+            nonlocal proximo
+            nome = ordem[proximo]
+            proximo += 1
+            pendentes[self._executor.submit(self._consultar, nome, cep, prazo)] = nome
+
+        disparar()
+        while pendentes:
+            espera = self.atraso_hedge if proximo < len(ordem) else math.inf
+            if prazo is not None:
+                espera = prazo.limitar(espera)
+            feitos, _ = wait(pendentes, timeout=None if espera == math.inf else espera,
+                             return_when=FIRST_COMPLETED)
+
+            if not feitos:
+                if prazo is not None and prazo.esgotado():
+                    break
+                # Hedge: o provedor em voo está demorando, dispara o próximo
+                with self._lock:
+                    self.hedges += 1
+                disparar()
+                continue
+
+            for future in feitos:
+                nome = pendentes.pop(future)
+                resultado = future.result()
+                if tem_coordenadas(resultado):
+                    self._encerrar(pendentes)
+                    with self._lock:
+                        self._stats[nome]['vitorias'] += 1
+                    log.debug("%s: %s venceu", cep, nome)
+                    return resultado, False
+                if resultado is NAO_ENCONTRADO:
+                    nao_encontrado = True
+                elif resultado and parcial is None:
+                    parcial = resultado
+
+            # Quem respondeu não tinha coordenadas: não espera o atraso para o próximo
+            if not pendentes and proximo < len(ordem):
+                disparar()
+
+        self._encerrar(pendentes)
+        return parcial, nao_encontrado and parcial is None
+
+    def _encerrar(self, pendentes):
+        """
+        Cancela o que ainda não começou; chamadas já em voo terminam em
+        background (só contam nas estatísticas)
+        """
+        for future, nome in pendentes.items():
+            if future.cancel():
+                with self._lock:
+                    self._stats[nome]['canceladas'] += 1
+
+    def estatisticas(self):
+        with self._lock:
+            provedores = {
+                nome: dict(s, latencia_ewma_ms=round(s['latencia_ewma_ms'] or 0.0, 1))
+                for nome, s in self._stats.items()
+            }
+            hedges = self.hedges
+        return {
+            'ordem': self.ordem(),
+            'atraso_hedge': self.atraso_hedge,
+            'hedges': hedges,
+            'provedores': provedores,
+        }
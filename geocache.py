@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# =============================================================================
+# CACHE DE GEOCODIFICAÇÃO (LRU EM MEMÓRIA + SQLITE EM DISCO)
+# =============================================================================
+
+# Sentinela para "CEP não está no cache" (None significa cache negativo)
+AUSENTE = object()
+
+log = logging.getLogger('geocache')
+
+
+class CacheGeocodificacao:
+    """
+    Cache de coordenadas por CEP em dois níveis:
+    1) LRU em memória, por processo
+    2) SQLite em disco, compartilhado entre workers e persistente entre restarts
+    Resultados negativos (CEP inexistente) ficam com TTL próprio, mais curto.
+    """
+
+    def __init__(self, caminho, ttl, ttl_negativo, max_memoria=10000):
+        self.caminho = caminho
+        self.ttl = ttl
+        self.ttl_negativo = ttl_negativo
+        self.max_memoria = max_memoria
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._disco_ok = bool(caminho)
+        self.stats = {
+            'hits_memoria': 0,
+            'hits_disco': 0,
+            'hits_negativos': 0,
+            'misses': 0,
+            'gravacoes': 0,
+            'erros_disco': 0,
+        }
+
+    # -------------------------------------------------------------------------
+    # SQLite
+    # -------------------------------------------------------------------------
+    def _conexao(self):
+        """
+        Uma conexão por thread e por processo (gunicorn faz fork depois do import)
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.caminho, timeout=1.0, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS geocode ('
+            ' cep TEXT PRIMARY KEY,'
+            ' dados TEXT,'
+            ' expira REAL NOT NULL)'
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _ler_disco(self, cep):
+        if not self._disco_ok:
+            return AUSENTE, 0
+        try:
+            row = self._conexao().execute(
+                'SELECT dados, expira FROM geocode WHERE cep = ?', (cep,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._erro_disco(e)
+            return AUSENTE, 0
+        if row is None or row[1] < time.time():
+            return AUSENTE, 0
+        return (json.loads(row[0]) if row[0] else None), row[1]
+
+    def _gravar_disco(self, cep, valor, expira):
+        if not self._disco_ok:
+            return
+        try:
+            self._conexao().execute(
+                'INSERT OR REPLACE INTO geocode (cep, dados, expira) VALUES (?, ?, ?)',
+                (cep, json.dumps(valor) if valor is not None else None, expira)
+            )
+        except sqlite3.Error as e:
+            self._erro_disco(e)
+
+    def _erro_disco(self, e):
+        self.stats['erros_disco'] += 1
+        log.warning("Erro no cache em disco: %s", e)
+
+    # -------------------------------------------------------------------------
+    # API
+    # -------------------------------------------------------------------------
+    def obter(self, cep):
+        """
+        Retorna o dict de coordenadas, None (cache negativo) ou AUSENTE
+        """
+        agora = time.time()
+        with self._lock:
+            item = self._memoria.get(cep)
+            if item is not None:
+                valor, expira = item
+                if expira >= agora:
+                    self._memoria.move_to_end(cep)
+                    self.stats['hits_memoria'] += 1
+                    if valor is None:
+                        self.stats['hits_negativos'] += 1
+                    return valor
+                del self._memoria[cep]
+
+        valor, expira = self._ler_disco(cep)
+        if valor is AUSENTE:
+            self.stats['misses'] += 1
+            return AUSENTE
+
+        self.stats['hits_disco'] += 1
+        if valor is None:
+            self.stats['hits_negativos'] += 1
+        self._guardar_memoria(cep, valor, expira)
+        return valor
+
+    def gravar(self, cep, valor, ttl=None):
+        """
+        Grava resultado positivo (dict) ou negativo (None)
+        """
+        if ttl is None:
+            ttl = self.ttl if valor is not None else self.ttl_negativo
+        expira = time.time() + ttl
+        self._guardar_memoria(cep, valor, expira)
+        self._gravar_disco(cep, valor, expira)
+        self.stats['gravacoes'] += 1
+
+    def _guardar_memoria(self, cep, valor, expira):
+        with self._lock:
+            self._memoria[cep] = (valor, expira)
+            self._memoria.move_to_end(cep)
+            while len(self._memoria) > self.max_memoria:
+                self._memoria.popitem(last=False)
+
+    def limpar_expirados(self):
+        """
+        Remove entradas vencidas do SQLite (manutenção)
+        """
+        if not self._disco_ok:
+            return 0
+        try:
+            cur = self._conexao().execute('DELETE FROM geocode WHERE expira < ?', (time.time(),))
+            return cur.rowcount
+        except sqlite3.Error as e:
+            self._erro_disco(e)
+            return 0
+
+    def estatisticas(self):
+        hits = self.stats['hits_memoria'] + self.stats['hits_disco']
+        total = hits + self.stats['misses']
+        return {
+            **self.stats,
+            'itens_memoria': len(self._memoria),
+            'hit_ratio': round(hits / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,47 @@
+"""
+Configuração do gunicorn (lida automaticamente de ./gunicorn.conf.py)
+
+GUNICORN_PRELOAD=true (padrão): o master importa app.py uma vez, com os
+índices (CEP, matriz rodoviária, tabela de setores) e tabelas já carregados,
+e os workers herdam tudo no fork. Os arquivos grandes são lidos via mmap e
+ficam no page cache; o resto das páginas do master é copy-on-write.
+gc.freeze() antes do fork tira os objetos do boot das coletas do GC, que
+senão tocariam nos cabeçalhos e copiariam as páginas em cada worker.
+
+GUNICORN_PRELOAD=false: cada worker importa app.py por conta própria
+(necessário se o app precisar ser recarregado com HUP sem reiniciar o master).
+
+Cada worker registra no log o tempo até ficar pronto e a memória privada x
+compartilhada (ver memoria.py); /health mostra o mesmo em "processo".
+Porta e número de workers seguem PORT e WEB_CONCURRENCY (padrões do gunicorn).
+"""
+import gc
+import os
+import time
+
+from memoria import resumo_memoria, uso_memoria
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+# Momento do fork, gravado no próprio worker
+_inicio_worker = None
+
+
+def when_ready(server):
+    # Chamado no master depois do preload e antes do primeiro fork
+    if preload_app:
+        gc.collect()
+        gc.freeze()
+    server.log.info("Master pronto (pid %d, preload=%s): %s",
+                    os.getpid(), preload_app, resumo_memoria(uso_memoria()))
+
+
+def post_fork(server, worker):
+    global _inicio_worker
+    _inicio_worker = time.perf_counter()
+
+
+def post_worker_init(worker):
+    segundos = time.perf_counter() - _inicio_worker if _inicio_worker is not None else 0.0
+    worker.log.info("Worker pronto em %.2fs (pid %d): %s",
+                    segundos, os.getpid(), resumo_memoria(uso_memoria()))
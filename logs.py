@@ -0,0 +1,119 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# =============================================================================
+# LOGGING (FILA NÃO BLOQUEANTE + JSON)
+# =============================================================================
+
+FORMATO_TEXTO = '%(asctime)s %(levelname)s [%(name)s] %(message)s'
+
+
+class FormatoLog(logging.Formatter):
+    """
+    Mensagens dict viram uma linha JSON (registro estruturado da cotação);
+    as demais saem em texto, ou em JSON se `json_sempre`
+    """
+
+    def __init__(self, json_sempre=False):
+        super().__init__(FORMATO_TEXTO)
+        self.json_sempre = json_sempre
+
+    def format(self, record):
+        if not isinstance(record.msg, dict) and not self.json_sempre:
+            return super().format(record)
+        dados = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'logger': record.name,
+        }
+        if isinstance(record.msg, dict):
+            dados.update(record.msg)
+        else:
+            dados['msg'] = record.getMessage()
+        if record.exc_info:
+            dados['exc'] = self.formatException(record.exc_info)
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+class FilaLog(QueueHandler):
+    """
+    Enfileira o registro sem formatar: a formatação (e o write no stdout)
+    acontece na thread do listener. Fila cheia descarta em vez de bloquear.
+    """
+
+    def __init__(self, fila):
+        super().__init__(fila)
+        self.descartados = 0
+
+    def prepare(self, record):
+        # Mesmo processo: não precisa achatar msg/args como o QueueHandler padrão
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+_estado = {'handler': None, 'listener': None, 'destino': None}
+_lock = threading.Lock()
+
+
+def _iniciar_listener():
+    fila = queue.Queue(maxsize=int(os.getenv('LOG_FILA_MAX', 10000)))
+    _estado['handler'].queue = fila
+    listener = QueueListener(fila, _estado['destino'], respect_handler_level=False)
+    listener.start()
+    _estado['listener'] = listener
+
+
+def configurar_logs(nivel='INFO', json_sempre=False):
+    """
+    Configura o logger raiz uma vez por processo. A thread do listener não
+    sobrevive ao fork do gunicorn, por isso é recriada no filho.
+    """
+    with _lock:
+        logging.getLogger().setLevel(nivel)
+        if _estado['handler'] is not None:
+            return
+
+        destino = logging.StreamHandler(sys.stdout)
+        destino.setFormatter(FormatoLog(json_sempre))
+        _estado['destino'] = destino
+        _estado['handler'] = FilaLog(queue.Queue())
+        _iniciar_listener()
+
+        raiz = logging.getLogger()
+        for h in list(raiz.handlers):
+            raiz.removeHandler(h)
+        raiz.addHandler(_estado['handler'])
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_iniciar_listener)
+        atexit.register(parar_logs)
+
+
+def parar_logs():
+    """
+    Esvazia a fila (chamar no shutdown)
+    """
+    listener = _estado['listener']
+    if listener is not None:
+        listener.stop()
+        _estado['listener'] = None
+
+
+def estatisticas():
+    handler = _estado['handler']
+    return {
+        'fila': handler.queue.qsize() if handler else 0,
+        'descartados': handler.descartados if handler else 0,
+    }
@@ -0,0 +1,61 @@
+"""
+Uso de memória do processo (boot, /health, hooks do gunicorn)
+
+No Linux lê /proc/<pid>/smaps_rollup, que separa o que o processo divide com
+outros (páginas herdadas do master no fork, mmap dos índices no page cache)
+do que é só dele. PSS reparte as páginas compartilhadas entre os processos
+que as usam: somar o PSS dos workers dá o custo real do conjunto.
+Fora do Linux, só o pico de RSS (resource.getrusage).
+"""
+import os
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Campo do smaps_rollup -> chave do retorno (valores em kB)
+CAMPOS_SMAPS = {
+    'Rss': 'rss_kb',
+    'Pss': 'pss_kb',
+    'Shared_Clean': 'compartilhado_kb',
+    'Shared_Dirty': 'compartilhado_kb',
+    'Private_Clean': 'privado_kb',
+    'Private_Dirty': 'privado_kb',
+}
+
+
+def uso_memoria(pid=None):
+    """
+    {'rss_kb', 'pss_kb', 'compartilhado_kb', 'privado_kb'} do processo,
+    ou {'rss_max_kb'} onde não há smaps_rollup
+    """
+    try:
+        with open(f"/proc/{pid or 'self'}/smaps_rollup") as f:
+            linhas = f.readlines()
+    except OSError:
+        linhas = None
+
+    if linhas is not None:
+        uso = dict.fromkeys(CAMPOS_SMAPS.values(), 0)
+        for linha in linhas:
+            campo, _, valor = linha.partition(':')
+            chave = CAMPOS_SMAPS.get(campo)
+            if chave:
+                uso[chave] += int(valor.split()[0])
+        return uso
+
+    if resource is None or (pid and pid != os.getpid()):
+        return {}
+    rss_max = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss vem em kB no Linux e em bytes no macOS
+    return {'rss_max_kb': rss_max // 1024 if os.uname().sysname == 'Darwin' else rss_max}
+
+
+def resumo_memoria(uso):
+    """
+    Texto curto para log: "rss 85.3 MB, privado 12.1 MB, compartilhado 73.2 MB"
+    """
+    nomes = {'rss_kb': 'rss', 'pss_kb': 'pss', 'privado_kb': 'privado',
+             'compartilhado_kb': 'compartilhado', 'rss_max_kb': 'rss máx'}
+    return ', '.join(f"{nomes[k]} {v / 1024:.1f} MB" for k, v in uso.items() if k in nomes)
@@ -0,0 +1,121 @@
+import threading
+from bisect import bisect_left
+
+# =============================================================================
+# MÉTRICAS (HISTOGRAMAS/CONTADORES EM MEMÓRIA, FORMATO PROMETHEUS)
+# =============================================================================
+
+# Segundos: de 0,5 ms (cache/índice) a 10 s (timeouts de upstream)
+BUCKETS_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                    0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _rotulos(nomes, valores):
+    if not nomes:
+        return ''
+    pares = ','.join(f'{n}="{str(v)}"' for n, v in zip(nomes, valores))
+    return '{' + pares + '}'
+
+
+class Histograma:
+    """
+    Histograma com buckets fixos por combinação de rótulos.
+    observar() é um bisect e três somas sob um lock (~1 µs).
+    """
+
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_LATENCIA):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.buckets = tuple(buckets)
+        self._series = {}   # valores dos rótulos -> [contagens por bucket (+Inf), soma]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *rotulos):
+        i = bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                serie = self._series[rotulos] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][i] += 1
+            serie[1] += valor
+
+    def exportar(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} histogram']
+        with self._lock:
+            series = [(r, list(c), s) for r, (c, s) in self._series.items()]
+        for rotulos, contagens, soma in sorted(series):
+            acumulado = 0
+            for limite, n in zip(self.buckets + ('+Inf',), contagens):
+                acumulado += n
+                rot = _rotulos(self.rotulos + ('le',), rotulos + (limite,))
+                linhas.append(f'{self.nome}_bucket{rot} {acumulado}')
+            rot = _rotulos(self.rotulos, rotulos)
+            linhas.append(f'{self.nome}_sum{rot} {soma:.6f}')
+            linhas.append(f'{self.nome}_count{rot} {acumulado}')
+        return linhas
+
+
+class Contador:
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, *rotulos, n=1):
+        with self._lock:
+            self._valores[rotulos] = self._valores.get(rotulos, 0) + n
+
+    def exportar(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} counter']
+        with self._lock:
+            valores = sorted(self._valores.items())
+        for rotulos, valor in valores:
+            linhas.append(f'{self.nome}{_rotulos(self.rotulos, rotulos)} {valor}')
+        return linhas
+
+
+class Metricas:
+    """
+    Registro de métricas do processo. `coletores` são funções chamadas só no
+    scrape, que devolvem linhas prontas (ex.: contadores dos caches).
+    Cada worker do gunicorn tem o seu registro.
+    """
+
+    def __init__(self):
+        self._metricas = []
+        self._coletores = []
+
+    def histograma(self, nome, ajuda, rotulos=(), buckets=BUCKETS_LATENCIA):
+        h = Histograma(nome, ajuda, rotulos, buckets)
+        self._metricas.append(h)
+        return h
+
+    def contador(self, nome, ajuda, rotulos=()):
+        c = Contador(nome, ajuda, rotulos)
+        self._metricas.append(c)
+        return c
+
+    def coletor(self, funcao):
+        self._coletores.append(funcao)
+        return funcao
+
+    def exportar(self):
+        linhas = []
+        for m in self._metricas:
+            linhas.extend(m.exportar())
+        for coletor in self._coletores:
+            linhas.extend(coletor())
+        return '\n'.join(linhas) + '\n'
+
+
+def exportar_valores(nome, ajuda, tipo, rotulo, valores):
+    """
+    Linhas de uma métrica simples a partir de {valor_do_rotulo: número}
+    """
+    linhas = [f'# HELP {nome} {ajuda}', f'# TYPE {nome} {tipo}']
+    for chave, valor in valores.items():
+        linhas.append(f'{nome}{_rotulos(rotulo, chave)} {valor}')
+    return linhas
@@ -0,0 +1,94 @@
+import numpy as np
+
+# =============================================================================
+# MOTOR VETORIZADO (DESTINOS x CDs)
+# =============================================================================
+
+RAIO_TERRA_KM = 6371.0
+AJUSTE_RODOVIARIO = 1.15
+
+
+class MotorFrete:
+    """
+    Distâncias, preços e prazos para muitos destinos de uma vez.
+    As coordenadas dos CDs ficam pré-calculadas em radianos/cossenos; uma
+    chamada calcula a matriz destino x CD inteira numa passada NumPy.
+    Usa as mesmas fórmulas de haversine / calcular_valor_frete /
+    calcular_prazo_entrega (diferenças só na última casa do float).
+    """
+
+    def __init__(self, centros, faixas_prazo, prazo_maximo, valor_km):
+        self.ids = list(centros)
+        self.centros = [centros[cd_id] for cd_id in self.ids]
+        lat = np.radians(np.array([cd['lat'] for cd in self.centros], dtype=np.float64))
+        lon = np.radians(np.array([cd['lon'] for cd in self.centros], dtype=np.float64))
+        self._lat = lat
+        self._lon = lon
+        self._cos_lat = np.cos(lat)
+        self._limites = np.array([limite for limite, _ in faixas_prazo], dtype=np.float64)
+        self._dias = np.array([dias for _, dias in faixas_prazo] + [prazo_maximo], dtype=np.int32)
+        self.valor_km = valor_km
+
+    def __len__(self):
+        return len(self.ids)
+
+    def distancias(self, lat_destinos, lon_destinos, fatores=None, km=None):
+        """
+        Matriz (n_destinos, n_cds) de distâncias rodoviárias estimadas em km
+        `fatores` (n_destinos, n_cds) substitui o AJUSTE_RODOVIARIO e `km`
+        (NaN onde não há rota) substitui a estimativa, como em
+        MatrizRodoviaria.correcao
+        """
+        lat = np.radians(np.asarray(lat_destinos, dtype=np.float64))[:, None]
+        lon = np.radians(np.asarray(lon_destinos, dtype=np.float64))[:, None]
+        dlat = lat - self._lat
+        dlon = lon - self._lon
+        a = np.sin(dlat / 2) ** 2 + self._cos_lat * np.cos(lat) * np.sin(dlon / 2) ** 2
+        dist = RAIO_TERRA_KM * 2 * np.arcsin(np.sqrt(a)) * (AJUSTE_RODOVIARIO if fatores is None else fatores)
+        if km is not None:
+            dist = np.where(np.isnan(km), dist, km)
+        return dist
+
+    def ranking(self, lat_destinos, lon_destinos, fatores=None, km=None):
+        """
+        Retorna (distancias, ordem): ordem[i] são os índices dos CDs do mais
+        próximo ao mais distante para o destino i
+        """
+        dist = self.distancias(lat_destinos, lon_destinos, fatores, km)
+        return dist, np.argsort(dist, axis=1, kind='stable')
+
+    def prazos(self, distancias):
+        """
+        Prazo em dias por faixa de distância (mesmas faixas, limite inclusivo)
+        """
+        return self._dias[np.searchsorted(self._limites, distancias, side='left')]
+
+    def valores(self, distancias, peso_total, volume_total, valor_km=None,
+                ocupacao=None, valor_km_metro=None, arredondar=True):
+        """
+        Valor do frete; peso_total/volume_total podem ser escalares ou arrays
+        que façam broadcast com `distancias`.
+        Com `ocupacao` (metros de caminhão) e `valor_km_metro` da tabela de
+        frete, os destinos com ocupação > 0 usam o preço da tabela.
+        """
+        if valor_km is None:
+            valor_km = self.valor_km
+        distancias = np.asarray(distancias, dtype=np.float64)
+        valor_base = distancias * valor_km
+        fator_peso = 1 + (np.asarray(peso_total, dtype=np.float64) / 10.0) * 0.05
+        fator_volume = 1 + (np.asarray(volume_total, dtype=np.float64) * 0.10)
+        valor = valor_base * fator_peso * fator_volume
+        if ocupacao is not None and valor_km_metro:
+            ocupacao = np.asarray(ocupacao, dtype=np.float64)
+            valor = np.where(ocupacao > 0, distancias * valor_km_metro * ocupacao, valor)
+        valor = np.maximum(valor, 50.00)
+        return np.round(valor, 2) if arredondar else valor
+
+    def lista_distancias(self, dist, ordem, i):
+        """
+        Linha i da matriz no formato de calcular_distancias_cds
+        """
+        return [
+            {'cd_id': self.ids[j], 'cd_info': self.centros[j], 'distancia': float(dist[i, j])}
+            for j in ordem[i]
+        ]
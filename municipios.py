@@ -0,0 +1,158 @@
+"""
+Tabela de municípios do IBGE (centróide lat/lon)
+
+Quando o provedor de CEP só devolve município/UF (ViaCEP, BrasilAPI sem
+location), as coordenadas saem desta tabela em vez da capital do estado.
+Fica inteira em memória (~5.570 linhas), indexada pelo código IBGE e por
+(nome normalizado, UF); a consulta é um acesso a dict, sem rede.
+
+O arquivo distribuído (municipios.csv.gz, 5.556 dos 5.570 municípios) usa
+os códigos IBGE com as coordenadas da sede do município no GeoNames
+(cities500, CC BY 4.0, geonames.org). Os 14 municípios sem sede no GeoNames
+ficam de fora e continuam no fallback da capital.
+
+Gerar o arquivo compacto a partir do CSV público de municípios:
+    python municipios.py build municipios.csv municipios.csv.gz
+
+O CSV precisa das colunas codigo_ibge, nome, lat/latitude, lon/longitude e
+uf (sigla) ou codigo_uf (código IBGE do estado).
+"""
+import csv
+import gzip
+import io
+import logging
+import os
+import sys
+
+from texto import normalizar_nome
+
+COLUNAS = ('codigo_ibge', 'nome', 'uf', 'lat', 'lon')
+
+# Código IBGE do estado -> sigla
+UF_POR_CODIGO = {
+    11: 'RO', 12: 'AC', 13: 'AM', 14: 'RR', 15: 'PA', 16: 'AP', 17: 'TO',
+    21: 'MA', 22: 'PI', 23: 'CE', 24: 'RN', 25: 'PB', 26: 'PE', 27: 'AL', 28: 'SE', 29: 'BA',
+    31: 'MG', 32: 'ES', 33: 'RJ', 35: 'SP',
+    41: 'PR', 42: 'SC', 43: 'RS',
+    50: 'MS', 51: 'MT', 52: 'GO', 53: 'DF',
+}
+
+log = logging.getLogger('municipios')
+
+
+def chave_nome(nome, uf):
+    # "Embu-Guaçu" e "Santa Bárbara d'Oeste" batem com ou sem pontuação
+    return normalizar_nome(str(nome or '').replace('-', ' ').replace("'", ' ')), str(uf or '').strip().upper()
+
+
+class TabelaMunicipios:
+    def __init__(self):
+        self._por_codigo = {}   # codigo_ibge -> (codigo_ibge, nome, uf, lat, lon)
+        self._por_nome = {}     # (nome normalizado, uf) -> (codigo_ibge, nome, uf, lat, lon)
+
+    def __len__(self):
+        return len(self._por_codigo)
+
+    def adicionar(self, codigo, nome, uf, lat, lon):
+        registro = (codigo, nome, uf, lat, lon)
+        self._por_codigo[codigo] = registro
+        self._por_nome[chave_nome(nome, uf)] = registro
+
+    @classmethod
+    def carregar(cls, caminho):
+        tabela = cls()
+        with gzip.open(caminho, 'rt', encoding='utf-8', newline='') as f:
+            leitor = csv.reader(f)
+            if tuple(next(leitor, ())) != COLUNAS:
+                raise ValueError(f"Arquivo de municípios inválido: {caminho}")
+            for codigo, nome, uf, lat, lon in leitor:
+                tabela.adicionar(int(codigo), nome, uf, float(lat), float(lon))
+        return tabela
+
+    def buscar(self, municipio=None, uf=None, codigo_ibge=None):
+        """
+        Retorna {'municipio','uf','lat','lon','codigo_ibge'} ou None.
+        Tenta primeiro o código IBGE (ViaCEP informa), depois nome + UF.
+        """
+        registro = None
+        if codigo_ibge:
+            try:
+                registro = self._por_codigo.get(int(codigo_ibge))
+            except (TypeError, ValueError):
+                pass
+        if registro is None and municipio and uf:
+            registro = self._por_nome.get(chave_nome(municipio, uf))
+        if registro is None:
+            return None
+        codigo, nome, uf, lat, lon = registro
+        return {'municipio': nome, 'uf': uf, 'lat': lat, 'lon': lon, 'codigo_ibge': codigo}
+
+    def codigo(self, municipio, uf):
+        """
+        Código IBGE pelo nome + UF, ou None
+        """
+        registro = self._por_nome.get(chave_nome(municipio, uf))
+        return registro[0] if registro else None
+
+
+def carregar_municipios(caminho):
+    """
+    Carrega a tabela se o arquivo existir; em caso de erro retorna tabela vazia
+    """
+    if not caminho or not os.path.exists(caminho):
+        return TabelaMunicipios()
+    try:
+        tabela = TabelaMunicipios.carregar(caminho)
+        log.info("Tabela de municípios carregada: %d (%s)", len(tabela), caminho)
+        return tabela
+    except Exception as e:
+        log.warning("Erro ao carregar municípios %s: %s", caminho, e)
+        return TabelaMunicipios()
+
+
+# =============================================================================
+# BUILD (CLI)
+# =============================================================================
+
+def _campo(row, *nomes):
+    for nome in nomes:
+        valor = row.get(nome)
+        if valor not in (None, ''):
+            return valor.strip()
+    return None
+
+
+def build(entrada, saida):
+    linhas = []
+    with open(entrada, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            try:
+                codigo = int(_campo(row, 'codigo_ibge', 'codigo'))
+                lat = round(float(_campo(row, 'lat', 'latitude')), 5)
+                lon = round(float(_campo(row, 'lon', 'longitude')), 5)
+            except (TypeError, ValueError):
+                continue
+            uf = (_campo(row, 'uf') or '').upper()
+            if not uf:
+                uf = UF_POR_CODIGO.get(int(_campo(row, 'codigo_uf') or codigo // 100000), '')
+            nome = _campo(row, 'nome', 'municipio')
+            if nome and uf:
+                linhas.append((codigo, nome, uf, lat, lon))
+    linhas.sort()
+
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, lineterminator='\n')
+    escritor.writerow(COLUNAS)
+    escritor.writerows(linhas)
+    with gzip.open(saida + '.tmp', 'wb', compresslevel=9) as f:
+        f.write(buffer.getvalue().encode('utf-8'))
+    os.replace(saida + '.tmp', saida)
+
+    print(f"[MUNICIPIOS] {len(linhas)} municípios em {saida} ({os.path.getsize(saida)} bytes)")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'build':
+        print("Uso: python municipios.py build <entrada.csv> <saida.csv.gz>")
+        sys.exit(1)
+    build(sys.argv[2], sys.argv[3])
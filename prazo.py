@@ -0,0 +1,36 @@
+import time
+
+# =============================================================================
+# PRAZO POR REQUISIÇÃO (DEADLINE)
+# =============================================================================
+
+
+class Prazo:
+    """
+    Orçamento de tempo de uma cotação, criado no início do /frete e passado
+    para geocodificação e estoque. Cada chamada a upstream recebe só o que
+    resta; esgotado, as etapas degradam (capital, CD mais próximo, assume
+    estoque) e anotam em `degradacoes`.
+    """
+
+    __slots__ = ('limite', 'degradacoes')
+
+    def __init__(self, segundos):
+        self.limite = time.monotonic() + segundos
+        self.degradacoes = []
+
+    def restante(self):
+        return max(0.0, self.limite - time.monotonic())
+
+    def esgotado(self, margem=0.0):
+        return self.restante() <= margem
+
+    def limitar(self, segundos):
+        """
+        min(segundos, tempo restante)
+        """
+        return min(segundos, self.restante())
+
+    def degradar(self, etapa):
+        if etapa not in self.degradacoes:
+            self.degradacoes.append(etapa)
@@ -0,0 +1,337 @@
+"""
+Registro de CDs / pontos de origem
+
+Os CDs vêm de um arquivo JSON (`cds.json`) em vez de um dict no código:
+    {"RS": {"nome": ..., "cidade": ..., "uf": ..., "cep": ..., "lat": ...,
+            "lon": ..., "codigo_cd_tray": ..., "codigo_ibge": ...}, ...}
+
+Cada carga vira um snapshot imutável (ConfigCDs) com os CDs, um índice
+espacial (k-d tree sobre as coordenadas na esfera unitária) e o que mais a
+aplicação derivar deles (motor, matriz rodoviária, tabela de setores). A
+fonte confere o mtime periodicamente e troca o snapshot inteiro numa
+atribuição; quem já pegou o snapshot anterior termina com ele.
+
+O ranking de uma cotação é preguiçoso: o índice entrega os CDs em ordem de
+distância em linha reta e a distância rodoviária só é calculada para os que
+a cotação de fato percorrer (para no primeiro com estoque).
+"""
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from distancias_rodoviarias import REGIAO_POR_UF, distancia_reta
+from motor_frete import RAIO_TERRA_KM
+
+CAMPOS_OBRIGATORIOS = ('nome', 'cidade', 'uf', 'cep', 'lat', 'lon', 'codigo_cd_tray')
+
+log = logging.getLogger('cds')
+
+
+# =============================================================================
+# ARQUIVO
+# =============================================================================
+
+def carregar_centros(caminho):
+    """
+    Lê e valida o arquivo de CDs; levanta ValueError se inválido
+    """
+    with open(caminho, encoding='utf-8') as f:
+        dados = json.load(f)
+    if not isinstance(dados, dict) or not dados:
+        raise ValueError(f"{caminho}: esperado objeto {{id: cd}} não vazio")
+
+    centros = {}
+    for cd_id, cd in dados.items():
+        faltando = [c for c in CAMPOS_OBRIGATORIOS if c not in cd]
+        if faltando:
+            raise ValueError(f"{caminho}: CD {cd_id} sem {', '.join(faltando)}")
+        lat, lon = float(cd['lat']), float(cd['lon'])
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f"{caminho}: CD {cd_id} com coordenadas inválidas")
+        centros[str(cd_id)] = dict(cd, lat=lat, lon=lon, cep=str(cd['cep']))
+    return centros
+
+
+# =============================================================================
+# ÍNDICE ESPACIAL
+# =============================================================================
+
+def _unitario(lat, lon):
+    lat, lon = math.radians(lat), math.radians(lon)
+    cos_lat = math.cos(lat)
+    return (cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat))
+
+
+def corda_para_km(corda):
+    """
+    Distância em linha reta (arco) correspondente a uma corda da esfera unitária
+    """
+    return RAIO_TERRA_KM * 2 * math.asin(min(1.0, corda / 2))
+
+
+class _No:
+    __slots__ = ('j', 'eixo', 'esquerda', 'direita', 'minimo', 'maximo')
+
+
+class IndiceEspacial:
+    """
+    k-d tree sobre (x, y, z) na esfera unitária: a distância euclidiana (corda)
+    cresce junto com a distância sobre a esfera. `vizinhos` percorre a árvore
+    em best-first (heap de nós pela distância até a caixa do nó) e entrega os
+    pontos em ordem crescente, sob demanda: os k primeiros custam O(k log n).
+    """
+
+    def __init__(self, pontos):
+        self._xyz = [_unitario(lat, lon) for lat, lon in pontos]
+        self._raiz = self._construir(list(range(len(self._xyz))), 0)
+
+    def __len__(self):
+        return len(self._xyz)
+
+    def _construir(self, indices, profundidade):
+        if not indices:
+            return None
+        eixo = profundidade % 3
+        indices.sort(key=lambda j: self._xyz[j][eixo])
+        meio = len(indices) // 2
+        no = _No()
+        no.j = indices[meio]
+        no.eixo = eixo
+        no.esquerda = self._construir(indices[:meio], profundidade + 1)
+        no.direita = self._construir(indices[meio + 1:], profundidade + 1)
+        pontos = [self._xyz[j] for j in indices]
+        no.minimo = tuple(min(p[k] for p in pontos) for k in range(3))
+        no.maximo = tuple(max(p[k] for p in pontos) for k in range(3))
+        return no
+
+    @staticmethod
+    def _distancia_caixa(q, no):
+        soma = 0.0
+        for k in range(3):
+            if q[k] < no.minimo[k]:
+                soma += (no.minimo[k] - q[k]) ** 2
+            elif q[k] > no.maximo[k]:
+                soma += (q[k] - no.maximo[k]) ** 2
+        return math.sqrt(soma)
+
+    def vizinhos(self, lat, lon):
+        """
+        Gera (j, corda) do ponto mais próximo ao mais distante
+        """
+        if self._raiz is None:
+            return
+        q = _unitario(lat, lon)
+        # (distância, desempate, tipo, item): tipo 0 = ponto, 1 = nó
+        heap = [(0.0, 0, 1, self._raiz)]
+        contador = 1
+        while heap:
+            distancia, _, tipo, item = heapq.heappop(heap)
+            if tipo == 0:
+                yield item, distancia
+                continue
+            p = self._xyz[item.j]
+            corda = math.sqrt((p[0] - q[0]) ** 2 + (p[1] - q[1]) ** 2 + (p[2] - q[2]) ** 2)
+            # Desempate pelo índice: mesma ordem do sort estável sobre a lista de CDs
+            heapq.heappush(heap, (corda, item.j, 0, item.j))
+            for filho in (item.esquerda, item.direita):
+                if filho is not None:
+                    heapq.heappush(heap, (self._distancia_caixa(q, filho), -1 - contador, 1, filho))
+                    contador += 1
+
+    def mais_proximos(self, lat, lon, k):
+        saida = []
+        for j, corda in self.vizinhos(lat, lon):
+            if len(saida) >= k:
+                break
+            saida.append((j, corda))
+        return saida
+
+
+# =============================================================================
+# RANKING PREGUIÇOSO
+# =============================================================================
+
+class RankingPreguicoso:
+    """
+    Lista de CDs ordenada por distância, calculada conforme é percorrida.
+    Iterar de novo reaproveita o que já foi calculado; len() e índices
+    negativos forçam o cálculo completo.
+    """
+
+    def __init__(self, gerador):
+        self._gerador = gerador
+        self._itens = []
+
+    @property
+    def avaliados(self):
+        return len(self._itens)
+
+    def _proximo(self):
+        if self._gerador is None:
+            return False
+        try:
+            self._itens.append(next(self._gerador))
+            return True
+        except StopIteration:
+            self._gerador = None
+            return False
+
+    def __iter__(self):
+        i = 0
+        while i < len(self._itens) or self._proximo():
+            yield self._itens[i]
+            i += 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice) or i < 0:
+            while self._proximo():
+                pass
+            return self._itens[i]
+        while len(self._itens) <= i and self._proximo():
+            pass
+        return self._itens[i]
+
+    def __len__(self):
+        while self._proximo():
+            pass
+        return len(self._itens)
+
+    def __bool__(self):
+        return bool(self._itens) or self._proximo()
+
+
+# =============================================================================
+# SNAPSHOT
+# =============================================================================
+
+class ConfigCDs:
+    """
+    Snapshot de uma carga do arquivo de CDs. `extras` guarda o que a
+    aplicação derivou dos CDs (motor, rotas, setores, versão), acessível
+    como atributo.
+    """
+
+    def __init__(self, centros, rotas, assinatura='', **extras):
+        self.centros = centros
+        self.ids = list(centros)
+        self.lista = [centros[cd_id] for cd_id in self.ids]
+        self.rotas = rotas
+        self.assinatura = assinatura
+        self.indice = IndiceEspacial([(cd['lat'], cd['lon']) for cd in self.lista])
+        # Menor fator rodoviário por região: limite inferior para o ranking preguiçoso
+        self._fator_minimo = {
+            regiao: min((rotas.fator(j, uf) for j in range(len(self.ids))), default=1.0)
+            for uf, regiao in [(None, None), *REGIAO_POR_UF.items()]
+        }
+        self.__dict__.update(extras)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _item(self, j, distancia):
+        return {'cd_id': self.ids[j], 'cd_info': self.lista[j], 'distancia': distancia}
+
+    def _ordenado(self, lat, lon, linha, uf):
+        # Com linha na matriz rodoviária a distância não tem limite inferior
+        # confiável pela linha reta: calcula todos (ainda O(n), sem rede)
+        itens = []
+        for j, cd in enumerate(self.lista):
+            reta = distancia_reta(cd['lat'], cd['lon'], lat, lon)
+            itens.append(self._item(j, self.rotas.distancia(j, reta, linha, uf)))
+        itens.sort(key=lambda x: x['distancia'])
+        yield from itens
+
+    def _preguicoso(self, lat, lon, uf):
+        fator_minimo = self._fator_minimo.get(REGIAO_POR_UF.get(uf), self._fator_minimo[None])
+        candidatos = []   # heap (distância rodoviária, j)
+        for j, corda in self.indice.vizinhos(lat, lon):
+            # Tudo que ainda vem do índice está a pelo menos `limite` km
+            limite = corda_para_km(corda) * fator_minimo * (1 - 1e-9)
+            while candidatos and candidatos[0][0] <= limite:
+                distancia, k = heapq.heappop(candidatos)
+                yield self._item(k, distancia)
+            cd = self.lista[j]
+            reta = distancia_reta(cd['lat'], cd['lon'], lat, lon)
+            heapq.heappush(candidatos, (self.rotas.distancia(j, reta, None, uf), j))
+        while candidatos:
+            distancia, k = heapq.heappop(candidatos)
+            yield self._item(k, distancia)
+
+    def ranking(self, lat, lon, linha=None, uf=None):
+        """
+        RankingPreguicoso no formato de calcular_distancias_cds
+        """
+        if linha is not None:
+            return RankingPreguicoso(self._ordenado(lat, lon, linha, uf))
+        return RankingPreguicoso(self._preguicoso(lat, lon, uf))
+
+
+# =============================================================================
+# FONTE (HOT RELOAD)
+# =============================================================================
+
+class FonteCDs:
+    """
+    Mantém o snapshot atual e o recarrega quando o arquivo muda.
+    `construir(centros)` monta o ConfigCDs; `ao_recarregar(config)` é
+    chamado depois de cada troca. A checagem do mtime é feita no máximo a
+    cada `intervalo` segundos. A primeira carga levanta erro se o arquivo
+    for inválido; nas seguintes, erro mantém o snapshot anterior.
+    """
+
+    def __init__(self, caminho, construir, intervalo=10.0, ao_recarregar=None):
+        self.caminho = caminho
+        self.construir = construir
+        self.intervalo = intervalo
+        self.ao_recarregar = ao_recarregar
+        self._lock = threading.Lock()
+        self._assinatura = self._assinatura_arquivo()
+        self._config = construir(carregar_centros(caminho))
+        self._proxima_checagem = time.time() + intervalo
+        self.recargas = 0
+        log.info("CDs carregados: %d (%s)", len(self._config), caminho)
+
+    def _assinatura_arquivo(self):
+        try:
+            st = os.stat(self.caminho)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def atual(self):
+        agora = time.time()
+        if self.intervalo <= 0 or agora < self._proxima_checagem:
+            return self._config
+        with self._lock:
+            if agora < self._proxima_checagem:
+                return self._config
+            self._proxima_checagem = agora + self.intervalo
+            assinatura = self._assinatura_arquivo()
+            if assinatura is None or assinatura == self._assinatura:
+                return self._config
+            try:
+                config = self.construir(carregar_centros(self.caminho))
+            except Exception as e:
+                log.warning("Erro ao recarregar %s, mantendo os CDs atuais: %s", self.caminho, e)
+                self._assinatura = assinatura
+                return self._config
+            self._config, self._assinatura = config, assinatura
+            self.recargas += 1
+            log.info("CDs recarregados: %d (%s)", len(config), self.caminho)
+        if self.ao_recarregar is not None:
+            try:
+                self.ao_recarregar(config)
+            except Exception as e:
+                log.warning("Erro após recarregar CDs: %s", e)
+        return config
+
+    def estatisticas(self):
+        return {
+            'cds': len(self._config),
+            'recargas': self.recargas,
+            'arquivo': self.caminho,
+        }
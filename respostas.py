@@ -0,0 +1,99 @@
+"""
+Respostas pré-compiladas (/, /cds)
+
+Corpos que só mudam com deploy ou recarga de configuração são gerados uma
+vez e guardados já comprimidos (gzip e, se o pacote `brotli` estiver
+instalado, br). Cada variante tem ETag forte próprio; If-None-Match com
+qualquer um deles responde 304 sem corpo.
+"""
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:  # opcional: sem ele, só gzip
+    brotli = None
+
+# Preferência quando o cliente aceita mais de uma
+CODIFICACOES = ('br', 'gzip')
+
+
+def _comprimir(codificacao, corpo):
+    if codificacao == 'br':
+        return brotli.compress(corpo, quality=11) if brotli is not None else None
+    # mtime=0: mesmo corpo, mesmos bytes (e mesmo ETag) em todos os workers
+    return gzip.compress(corpo, compresslevel=9, mtime=0)
+
+
+def aceitas(accept_encoding):
+    """
+    Codificações aceitas pelo cliente (ignora as com q=0)
+    """
+    saida = set()
+    for parte in (accept_encoding or '').split(','):
+        nome, _, params = parte.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                pass
+        if nome:
+            saida.add(nome.strip().lower())
+    return saida
+
+
+class RespostaPronta:
+    __slots__ = ('mimetype', 'max_age', 'variantes', 'etags')
+
+    def __init__(self, corpo, mimetype, max_age=300):
+        if isinstance(corpo, str):
+            corpo = corpo.encode('utf-8')
+        self.mimetype = mimetype
+        self.max_age = max_age
+        resumo = hashlib.blake2b(corpo, digest_size=12).hexdigest()
+        # codificacao -> (corpo, etag); None = identity
+        self.variantes = {None: (corpo, f'"{resumo}"')}
+        for codificacao in CODIFICACOES:
+            comprimido = _comprimir(codificacao, corpo)
+            if comprimido is not None and len(comprimido) < len(corpo):
+                self.variantes[codificacao] = (comprimido, f'"{resumo}-{codificacao}"')
+        self.etags = frozenset(etag for _, etag in self.variantes.values())
+
+    def escolher(self, accept_encoding):
+        aceitas_cliente = aceitas(accept_encoding)
+        for codificacao in CODIFICACOES:
+            if codificacao in self.variantes and (codificacao in aceitas_cliente or '*' in aceitas_cliente):
+                return codificacao
+        return None
+
+    def _nao_modificado(self, if_none_match):
+        if not if_none_match:
+            return False
+        for etag in if_none_match.split(','):
+            etag = etag.strip()
+            if etag == '*' or etag.removeprefix('W/') in self.etags:
+                return True
+        return False
+
+    def responder(self, if_none_match=None, accept_encoding=None):
+        """
+        Retorna (status, cabecalhos, corpo) para o pedido
+        """
+        codificacao = self.escolher(accept_encoding)
+        corpo, etag = self.variantes[codificacao]
+        cabecalhos = {
+            'ETag': etag,
+            'Vary': 'Accept-Encoding',
+            'Cache-Control': f'public, max-age={self.max_age}',
+        }
+        if self._nao_modificado(if_none_match):
+            return 304, cabecalhos, b''
+        cabecalhos['Content-Type'] = self.mimetype
+        if codificacao:
+            cabecalhos['Content-Encoding'] = codificacao
+        return 200, cabecalhos, corpo
+
+    def tamanhos(self):
+        return {codificacao or 'identity': len(corpo) for codificacao, (corpo, _) in self.variantes.items()}
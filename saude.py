@@ -0,0 +1,102 @@
+import logging
+import os
+import threading
+import time
+
+# =============================================================================
+# SONDAGEM DOS UPSTREAMS EM BACKGROUND (/health)
+# =============================================================================
+
+log = logging.getLogger('saude')
+
+
+class MonitorSaude:
+    """
+    Testa periodicamente cada upstream numa thread própria e guarda o último
+    resultado em memória; /health e /health/ready só leem esse estado, sem
+    ir à rede na thread da requisição.
+    `sondas`: {nome: função()}; a função faz a chamada de teste e retorna o
+    status HTTP (2xx/3xx = ok) ou levanta exceção.
+    """
+
+    def __init__(self, sondas, intervalo=30.0):
+        self.sondas = dict(sondas)
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._iniciar_lock = threading.Lock()
+        self._pid = None
+        self._estado = {
+            nome: {
+                'ok': None,
+                'status': None,
+                'erro': None,
+                'latencia_ms': None,
+                'verificado_em': None,
+                'falhas_seguidas': 0,
+            }
+            for nome in self.sondas
+        }
+        self.rodadas = 0
+
+    def _sondar(self, nome):
+        inicio = time.perf_counter()
+        status, erro = None, None
+        try:
+            status = self.sondas[nome]()
+            ok = status is not None and 200 <= status < 400
+        except Exception as e:
+            ok, erro = False, f"{type(e).__name__}: {e}"
+        latencia_ms = round((time.perf_counter() - inicio) * 1000, 1)
+
+        with self._lock:
+            estado = self._estado[nome]
+            estado.update(ok=ok, status=status, erro=erro, latencia_ms=latencia_ms, verificado_em=time.time())
+            estado['falhas_seguidas'] = 0 if ok else estado['falhas_seguidas'] + 1
+        if not ok:
+            log.warning("Sonda %s falhou: %s", nome, erro or f"status {status}")
+
+    def verificar(self):
+        """
+        Uma rodada de sondas (síncrona)
+        """
+        for nome in self.sondas:
+            self._sondar(nome)
+        with self._lock:
+            self.rodadas += 1
+
+    def iniciar(self):
+        """
+        Inicia (uma vez por processo) a thread de sondagem. Threads não
+        sobrevivem ao fork do gunicorn, por isso a checagem é por pid.
+        """
+        if self.intervalo <= 0 or not self.sondas:
+            return
+        with self._iniciar_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+
+        def loop():
+            while True:
+                try:
+                    self.verificar()
+                except Exception as e:
+                    log.warning("Erro na sondagem: %s", e)
+                time.sleep(self.intervalo)
+
+        threading.Thread(target=loop, name='saude-sondagem', daemon=True).start()
+
+    def ok(self, nome):
+        """
+        Resultado da última sonda: True/False, ou None se ainda não rodou
+        """
+        with self._lock:
+            return self._estado[nome]['ok']
+
+    def estado(self):
+        agora = time.time()
+        with self._lock:
+            return {
+                nome: dict(e, idade_s=round(agora - e['verificado_em'], 1) if e['verificado_em'] else None)
+                for nome, e in self._estado.items()
+            }
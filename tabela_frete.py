@@ -0,0 +1,311 @@
+"""
+Tabela de frete da planilha (CADASTRO_PRODUTO)
+
+A planilha calcula o frete por tamanho de peça: cada metro de caminhão
+ocupado custa VALOR KM / TAMANHO CAMINHAO por km rodado, e o cadastro traz o
+tamanho (m) de cada produto. A planilha é lida uma vez com a biblioteca
+padrão (xlsx é um zip de XML) e convertida para um cache JSON compacto; nos
+boots seguintes só o JSON é lido, enquanto a planilha não mudar. A fonte
+confere o mtime periodicamente e troca a tabela inteira quando o arquivo muda.
+
+O cadastro é por nome de produto e a Tray manda a referência (SKU); a ligação
+vem de um JSON {"referência": "nome na planilha"}. Só carrinhos com todas as
+linhas no cadastro usam o preço da planilha; os demais ficam na fórmula
+padrão por peso/volume. Com `medidas`, linhas fora do cadastro usam as medidas
+da Tray pela regra da planilha (horizontais pela largura, verticais pela
+altura: a maior das duas).
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+
+from texto import normalizar_nome
+
+ABA_PRODUTOS = 'CADASTRO_PRODUTO'
+VERSAO_CACHE = 1
+
+log = logging.getLogger('tabela')
+
+_NS = {
+    'm': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    'rel': 'http://schemas.openxmlformats.org/package/2006/relationships',
+}
+_COORD = re.compile(r'([A-Z]+)(\d+)')
+
+
+# =============================================================================
+# LEITURA DO XLSX
+# =============================================================================
+
+def _ler_aba(caminho, aba):
+    """
+    Retorna {(coluna, linha): valor} da aba, com os valores já calculados
+    das fórmulas (o Excel grava o último resultado no arquivo)
+    """
+    with zipfile.ZipFile(caminho) as z:
+        compartilhadas = []
+        if 'xl/sharedStrings.xml' in z.namelist():
+            raiz = ET.fromstring(z.read('xl/sharedStrings.xml'))
+            for si in raiz.findall('m:si', _NS):
+                compartilhadas.append(''.join(t.text or '' for t in si.iter(f"{{{_NS['m']}}}t")))
+
+        workbook = ET.fromstring(z.read('xl/workbook.xml'))
+        rels = ET.fromstring(z.read('xl/_rels/workbook.xml.rels'))
+        alvos = {r.get('Id'): r.get('Target') for r in rels.findall('rel:Relationship', _NS)}
+        alvo = None
+        for sheet in workbook.find('m:sheets', _NS):
+            if sheet.get('name') == aba:
+                alvo = alvos[sheet.get(f"{{{_NS['r']}}}id")]
+        if alvo is None:
+            raise ValueError(f"Aba {aba} não encontrada em {caminho}")
+
+        celulas = {}
+        raiz = ET.fromstring(z.read('xl/' + alvo.lstrip('/').removeprefix('xl/')))
+        for c in raiz.iter(f"{{{_NS['m']}}}c"):
+            v = c.find('m:v', _NS)
+            if v is None or v.text is None:
+                continue
+            tipo = c.get('t')
+            if tipo == 's':
+                valor = compartilhadas[int(v.text)]
+            elif tipo in ('str', 'inlineStr', 'e'):
+                valor = v.text
+            else:
+                valor = float(v.text)
+            coluna, linha = _COORD.match(c.get('r')).groups()
+            celulas[(coluna, int(linha))] = valor
+        return celulas
+
+
+# =============================================================================
+# TABELA
+# =============================================================================
+
+def carregar_skus(caminho):
+    """
+    {referência: nome na planilha} do JSON, se o arquivo existir;
+    em caso de erro retorna vazio
+    """
+    if not caminho or not os.path.exists(caminho):
+        return {}
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            dados = json.load(f)
+        if not isinstance(dados, dict):
+            raise ValueError("esperado um objeto {referência: nome}")
+        return {str(sku).strip(): str(nome) for sku, nome in dados.items()}
+    except Exception as e:
+        log.warning("Erro ao carregar referências %s: %s", caminho, e)
+        return {}
+
+
+class TabelaFrete:
+    """
+    Parâmetros da planilha e tamanho (m) de cada produto do cadastro
+    """
+
+    def __init__(self, valor_km, tamanho_caminhao, produtos):
+        self.valor_km = valor_km
+        self.tamanho_caminhao = tamanho_caminhao
+        self.produtos = produtos   # nome normalizado -> tamanho em metros
+        # custo por km de cada metro de caminhão ocupado
+        self.valor_km_metro = valor_km / tamanho_caminhao
+        self.skus = {}             # referência -> nome normalizado
+        self.medidas = False
+
+    def configurar(self, skus, medidas=False):
+        """
+        Liga as referências da Tray aos produtos do cadastro; nomes que não
+        estão na planilha são ignorados (com aviso)
+        """
+        self.medidas = medidas
+        self.skus = {}
+        for sku, nome in skus.items():
+            chave = normalizar_nome(nome)
+            if chave in self.produtos:
+                self.skus[sku] = chave
+            else:
+                log.warning("Referência %s: produto '%s' não está na planilha", sku, nome)
+
+    def __len__(self):
+        return len(self.produtos)
+
+    @classmethod
+    def ler_planilha(cls, caminho):
+        celulas = _ler_aba(caminho, ABA_PRODUTOS)
+
+        parametros = {}
+        for (coluna, linha), valor in celulas.items():
+            if coluna == 'A' and isinstance(valor, str):
+                parametros[normalizar_nome(valor)] = celulas.get(('B', linha))
+        valor_km = parametros.get('valor km')
+        tamanho_caminhao = parametros.get('tamanho caminhao')
+        if not isinstance(valor_km, float) or not isinstance(tamanho_caminhao, float) or tamanho_caminhao <= 0:
+            raise ValueError("VALOR KM / TAMANHO CAMINHAO não encontrados na planilha")
+
+        # Produtos aparecem em mais de uma linha (largura e altura):
+        # fica o maior tamanho, que é o que ocupa o caminhão
+        produtos = {}
+        for (coluna, linha), nome in celulas.items():
+            tamanho = celulas.get(('D', linha))
+            if coluna != 'C' or not isinstance(nome, str) or not isinstance(tamanho, float):
+                continue
+            chave = normalizar_nome(nome)
+            if tamanho > produtos.get(chave, 0.0):
+                produtos[chave] = tamanho
+
+        return cls(valor_km, tamanho_caminhao, produtos)
+
+    def tamanho_peca(self, produto):
+        """
+        Tamanho (m) da peça: o do cadastro se a referência estiver ligada a
+        um produto da planilha (ou for o próprio nome); senão, com `medidas`,
+        a largura ou altura da Tray (cm), a maior; 0.0 se não há como medir
+        """
+        codigo = (produto.codigo or '').strip()
+        chave = self.skus.get(codigo) or normalizar_nome(codigo)
+        tamanho = self.produtos.get(chave)
+        if tamanho is not None:
+            return tamanho
+        if self.medidas:
+            return max(produto.largura or 0.0, produto.altura or 0.0) / 100.0
+        return 0.0
+
+    def ocupacao(self, produtos):
+        """
+        Metros de caminhão ocupados pelo carrinho; None se alguma peça não
+        tem tamanho (aí o carrinho inteiro vai pela fórmula padrão por peso/volume)
+        """
+        total = 0.0
+        for p in produtos:
+            tamanho = self.tamanho_peca(p)
+            if tamanho <= 0:
+                return None
+            total += tamanho * p.quantidade
+        return total or None
+
+    def para_dict(self):
+        return {
+            'valor_km': self.valor_km,
+            'tamanho_caminhao': self.tamanho_caminhao,
+            'produtos': self.produtos,
+        }
+
+
+# =============================================================================
+# FONTE (CACHE + HOT RELOAD)
+# =============================================================================
+
+class FonteTabelaFrete:
+    """
+    Mantém a tabela atual e a recarrega quando a planilha muda.
+    A checagem do mtime é feita no máximo a cada `intervalo` segundos e a
+    troca é uma atribuição única (leitores nunca veem tabela pela metade).
+    """
+
+    def __init__(self, caminho, caminho_cache, intervalo=10.0, caminho_skus=None, medidas=False):
+        self.caminho = caminho
+        self.caminho_cache = caminho_cache
+        self.intervalo = intervalo
+        self.caminho_skus = caminho_skus
+        self.medidas = medidas
+        self._tabela = None
+        self._assinatura = None
+        self._assinatura_skus = None
+        self._proxima_checagem = 0.0
+        self._lock = threading.Lock()
+        self.recargas = 0
+
+    @staticmethod
+    def _assinatura_arquivo(caminho):
+        if not caminho:
+            return None
+        try:
+            st = os.stat(caminho)
+        except OSError:
+            return None
+        return [st.st_mtime_ns, st.st_size]
+
+    def _ler_cache(self, assinatura):
+        if not self.caminho_cache:
+            return None
+        try:
+            with open(self.caminho_cache, encoding='utf-8') as f:
+                dados = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if dados.get('versao') != VERSAO_CACHE or dados.get('origem') != assinatura:
+            return None
+        return TabelaFrete(dados['valor_km'], dados['tamanho_caminhao'], dados['produtos'])
+
+    def _gravar_cache(self, tabela, assinatura):
+        if not self.caminho_cache:
+            return
+        try:
+            with open(self.caminho_cache + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump({'versao': VERSAO_CACHE, 'origem': assinatura, **tabela.para_dict()}, f, ensure_ascii=False)
+            os.replace(self.caminho_cache + '.tmp', self.caminho_cache)
+        except OSError as e:
+            log.warning("Erro ao gravar cache %s: %s", self.caminho_cache, e)
+
+    def _carregar(self, assinatura):
+        tabela = self._ler_cache(assinatura)
+        if tabela is not None:
+            return tabela, 'cache'
+        tabela = TabelaFrete.ler_planilha(self.caminho)
+        self._gravar_cache(tabela, assinatura)
+        return tabela, 'planilha'
+
+    def atual(self):
+        """
+        Tabela vigente, ou None se não há planilha válida
+        """
+        agora = time.time()
+        if agora < self._proxima_checagem:
+            return self._tabela
+        with self._lock:
+            if agora < self._proxima_checagem:
+                return self._tabela
+            self._proxima_checagem = agora + self.intervalo
+            assinatura = self._assinatura_arquivo(self.caminho)
+            assinatura_skus = self._assinatura_arquivo(self.caminho_skus)
+            if assinatura == self._assinatura and assinatura_skus == self._assinatura_skus:
+                return self._tabela
+            if assinatura is None:
+                self._tabela, self._assinatura = None, None
+                return None
+            try:
+                tabela, origem = self._carregar(assinatura)
+            except Exception as e:
+                # Planilha com problema: mantém a tabela anterior
+                log.warning("Erro ao ler %s: %s", self.caminho, e)
+                return self._tabela
+            tabela.configurar(carregar_skus(self.caminho_skus), self.medidas)
+            self._tabela, self._assinatura, self._assinatura_skus = tabela, assinatura, assinatura_skus
+            self.recargas += 1
+            log.info("Tabela de frete carregada (%s): %d produtos, %d referências, R$ %.2f/km, caminhão %.1f m",
+                     origem, len(tabela), len(tabela.skus), tabela.valor_km, tabela.tamanho_caminhao)
+            return tabela
+
+    @property
+    def assinatura(self):
+        """
+        mtime/tamanho da planilha e das referências vigentes (muda a cada recarga)
+        """
+        return [self._assinatura, self._assinatura_skus, self.medidas]
+
+    def estatisticas(self):
+        tabela = self._tabela
+        return {
+            'carregada': tabela is not None,
+            'produtos': len(tabela) if tabela else 0,
+            'referencias': len(tabela.skus) if tabela else 0,
+            'medidas': self.medidas,
+            'recargas': self.recargas,
+        }
@@ -0,0 +1,186 @@
+"""
+Tabela pré-calculada de cotação por setor de CEP (5 dígitos)
+
+Sem restrição de estoque, o ranking de CDs, as distâncias e o prazo dependem
+só do destino. Esta tabela guarda, para cada setor do índice de CEP, a ordem
+dos CDs, a distância e o prazo de cada um, num arquivo binário lido via mmap.
+Em tempo de requisição resta aplicar o estoque e os fatores de peso/volume.
+
+A assinatura da configuração (CDs, faixas de prazo, ajuste rodoviário) fica
+no cabeçalho; se não bater com a configuração atual a tabela é ignorada.
+Gerar novamente sempre que as coordenadas em cds.json, as faixas ou a matriz
+rodoviária mudarem:
+    python tabela_setores.py build cep_index.bin tabela_setores.bin
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from bisect import bisect_left
+
+from registro_cds import RankingPreguicoso
+
+MAGIC = b'SETCEP01'
+# n_setores, n_cds, assinatura
+CABECALHO = struct.Struct('<8sII16s')
+
+log = logging.getLogger('setores')
+
+
+def assinatura_config(motor, faixas_prazo, prazo_maximo, rotas=None):
+    from motor_frete import AJUSTE_RODOVIARIO
+    config = [
+        [(cd_id, cd['lat'], cd['lon']) for cd_id, cd in zip(motor.ids, motor.centros)],
+        [list(f) for f in faixas_prazo],
+        prazo_maximo,
+        AJUSTE_RODOVIARIO,
+    ]
+    if rotas is not None and len(rotas):
+        config.append(rotas.assinatura.hex())
+    dados = json.dumps(config)
+    return hashlib.sha1(dados.encode('utf-8')).digest()[:16]
+
+
+class TabelaSetores:
+    """
+    Colunas (zero-cópia sobre o mmap):
+    - chaves uint32[n] ordenadas
+    - distancias float32[n * n_cds], na ordem de CDs do motor
+    - ordem uint8[n * n_cds], índices dos CDs do mais próximo ao mais distante
+    - prazos uint8[n * n_cds]
+    """
+
+    def __init__(self, ids=(), centros=()):
+        self.ids = list(ids)
+        self.centros = list(centros)
+        self.n_cds = len(self.ids)
+        self._chaves = ()
+        self._mmap = None
+
+    def __len__(self):
+        return len(self._chaves)
+
+    @classmethod
+    def carregar(cls, caminho, motor, assinatura):
+        tabela = cls(motor.ids, motor.centros)
+        with open(caminho, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, n, n_cds, assinatura_arquivo = CABECALHO.unpack_from(mm, 0)
+        if magic != MAGIC:
+            mm.close()
+            raise ValueError(f"Arquivo de tabela inválido: {caminho}")
+        if n_cds != len(motor) or assinatura_arquivo != assinatura:
+            mm.close()
+            raise ValueError("tabela gerada com outra configuração de CDs/prazos, gere novamente")
+
+        buf = memoryview(mm)
+        pos = CABECALHO.size
+        tabela._chaves = buf[pos:pos + 4 * n].cast('I')
+        pos += 4 * n
+        tabela._dist = buf[pos:pos + 4 * n * n_cds].cast('f')
+        pos += 4 * n * n_cds
+        tabela._ordem = buf[pos:pos + n * n_cds]
+        pos += n * n_cds
+        tabela._prazos = buf[pos:pos + n * n_cds]
+        tabela._mmap = mm
+        return tabela
+
+    def buscar(self, cep):
+        """
+        RankingPreguicoso no formato de calcular_distancias_cds (com 'prazo')
+        ou None; cada CD só vira dict quando o ranking chega nele
+        """
+        if len(cep) != 8 or not cep.isdigit():
+            return None
+        chave = int(cep[:5])
+        i = bisect_left(self._chaves, chave)
+        if i >= len(self._chaves) or self._chaves[i] != chave:
+            return None
+        return RankingPreguicoso(self._ranking(i * self.n_cds))
+
+    def _ranking(self, base):
+        for j in self._ordem[base:base + self.n_cds]:
+            yield {
+                'cd_id': self.ids[j],
+                'cd_info': self.centros[j],
+                'distancia': self._dist[base + j],
+                'prazo': self._prazos[base + j],
+            }
+
+
+def carregar_tabela(caminho, motor, assinatura):
+    """
+    Carrega a tabela se o arquivo existir e for da configuração atual;
+    caso contrário retorna tabela vazia
+    """
+    if not caminho or not os.path.exists(caminho):
+        return TabelaSetores(motor.ids, motor.centros)
+    try:
+        tabela = TabelaSetores.carregar(caminho, motor, assinatura)
+        log.info("Tabela carregada: %d setores (%s)", len(tabela), caminho)
+        return tabela
+    except Exception as e:
+        log.warning("Ignorando tabela %s: %s", caminho, e)
+        return TabelaSetores(motor.ids, motor.centros)
+
+
+# =============================================================================
+# BUILD (CLI)
+# =============================================================================
+
+def build(indice, motor, assinatura, saida, rotas=None, municipios=None):
+    """
+    Gera a tabela para todos os setores de 5 dígitos do índice de CEP
+    (com `rotas`, usa a matriz rodoviária do município de cada setor)
+    """
+    import numpy as np
+
+    if len(motor) > 256:
+        # A ordem dos CDs por setor é gravada em uint8
+        raise ValueError(f"Tabela de setores suporta até 256 CDs ({len(motor)} configurados)")
+
+    chaves, lat, lon, mun = indice.niveis.get(5) or ((), (), (), ())
+    n = len(chaves)
+    if n:
+        correcao = (None, None)
+        if rotas is not None and len(rotas):
+            destinos = [indice.nomes[m] for m in mun]
+            linhas = [rotas.linha(municipios.codigo(nome, uf)) if municipios else None for nome, uf in destinos]
+            correcao = rotas.correcao(linhas, [uf for _, uf in destinos])
+        dist, ordem = motor.ranking(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64), *correcao)
+        prazos = motor.prazos(dist)
+    else:
+        dist = ordem = prazos = np.zeros((0, len(motor)))
+
+    with open(saida + '.tmp', 'wb') as f:
+        f.write(CABECALHO.pack(MAGIC, n, len(motor), assinatura))
+        f.write(np.asarray(chaves, dtype=np.uint32).tobytes())
+        f.write(dist.astype(np.float32).tobytes())
+        f.write(ordem.astype(np.uint8).tobytes())
+        f.write(prazos.astype(np.uint8).tobytes())
+    os.replace(saida + '.tmp', saida)
+
+    print(f"[SETORES] {n} setores x {len(motor)} CDs em {saida}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'build':
+        print("Uso: python tabela_setores.py build <cep_index.bin> <saida.bin>")
+        sys.exit(1)
+
+    import app
+    from cep_index import IndiceCEP
+
+    config = app.REGISTRO_CDS.atual()
+    build(
+        IndiceCEP.carregar(sys.argv[2]),
+        config.motor,
+        config.assinatura,
+        sys.argv[3],
+        config.rotas,
+        app.MUNICIPIOS
+    )
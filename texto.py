@@ -0,0 +1,13 @@
+"""
+Normalização de nomes (produtos da planilha, municípios)
+"""
+import unicodedata
+
+
+def normalizar_nome(nome):
+    """
+    Minúsculas, sem acentos e com espaços colapsados
+    """
+    nome = unicodedata.normalize('NFKD', str(nome or ''))
+    nome = ''.join(ch for ch in nome if not unicodedata.combining(ch))
+    return ' '.join(nome.lower().split())
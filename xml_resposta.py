@@ -0,0 +1,71 @@
+"""
+Escrita das respostas XML (/frete)
+
+Em vez de montar o XML com f-string, os elementos passam por
+xml.sax.saxutils.XMLGenerator, que escapa o texto (&, <, > em nome de CD,
+mensagem de exceção etc.) e escreve direto na saída, elemento a elemento.
+"""
+import io
+from xml.sax.saxutils import XMLGenerator
+
+
+class EscritorXML:
+    """
+    Uso:
+        xml = EscritorXML()
+        xml.abrir('shipping')
+        xml.campo('price', '10.00')
+        xml.fechar()
+        texto = xml.terminar()
+    `saida`: arquivo texto onde escrever (padrão: StringIO, lido em terminar())
+    """
+
+    def __init__(self, saida=None, indentacao='    '):
+        self._saida = saida if saida is not None else io.StringIO()
+        self._indentacao = indentacao
+        self._pilha = []
+        self._gerador = XMLGenerator(self._saida, encoding='UTF-8', short_empty_elements=True)
+        self._gerador.startDocument()
+
+    def _quebra(self):
+        # A declaração já termina em '\n'; a raiz não recebe quebra
+        if self._indentacao is not None and self._pilha:
+            self._gerador.ignorableWhitespace('\n' + self._indentacao * len(self._pilha))
+
+    def abrir(self, tag):
+        self._quebra()
+        self._gerador.startElement(tag, {})
+        self._pilha.append(tag)
+
+    def fechar(self):
+        tag = self._pilha.pop()
+        if self._indentacao is not None:
+            self._gerador.ignorableWhitespace('\n' + self._indentacao * len(self._pilha))
+        self._gerador.endElement(tag)
+
+    def campo(self, tag, valor):
+        self._quebra()
+        self._gerador.startElement(tag, {})
+        if valor is not None:
+            self._gerador.characters(str(valor))
+        self._gerador.endElement(tag)
+
+    def terminar(self):
+        """
+        Fecha os elementos abertos; retorna o texto se a saída for a padrão
+        """
+        while self._pilha:
+            self.fechar()
+        self._gerador.endDocument()
+        if isinstance(self._saida, io.StringIO):
+            return self._saida.getvalue()
+        return None
+
+
+def xml_simples(tag, texto):
+    """
+    Documento com um único elemento (ex.: <error>)
+    """
+    xml = EscritorXML(indentacao=None)
+    xml.campo(tag, texto)
+    return xml.terminar()